@@ -0,0 +1,10 @@
+"""
+Benchmarks of google-books pipelines. They are not part of the test suite and
+are run as modules, for example:
+
+    $ python -m benchmarks.marcxml_reader
+
+The whole suite of CLI pipelines runs with:
+
+    $ python -m benchmarks
+"""
@@ -0,0 +1,130 @@
+"""
+Benchmark suite of the CLI pipelines. Each pipeline runs on seeded synthetic
+fixtures of every given size in a fresh interpreter, so peak memory of one run
+does not leak into another. Runs fully offline. Results are printed as a table
+and saved as JSON, optionally compared with a previous results file.
+
+    $ python -m benchmarks --sizes 10000 100000 1000000
+    $ python -m benchmarks --pipelines oclc hathi-urls --compare old.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.pipelines import PIPELINES, prepare
+
+
+ROOT = Path(__file__).parent.parent
+
+
+def run_pipeline(name: str, size: int, seed: int) -> dict:
+    """
+    Prepares fixtures of pipeline `name` in a temporary directory and measures
+    the pipeline in a subprocess.
+    """
+    with tempfile.TemporaryDirectory() as td:
+        cwd = os.getcwd()
+        os.chdir(td)
+        try:
+            start = time.perf_counter()
+            prepare(name, size, seed)
+            setup = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT), *sys.path]))
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.pipelines", name],
+            cwd=td,
+            env=env,
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+    measured = json.loads(result.stdout.splitlines()[-1])
+    return dict(
+        pipeline=name,
+        records=size,
+        seconds=round(measured["seconds"], 3),
+        records_per_sec=round(size / measured["seconds"]),
+        peak_rss_mb=measured["peak_rss_mb"],
+        setup_seconds=round(setup, 3),
+    )
+
+
+def compare(results: list[dict], baseline_fh: str) -> None:
+    """Prints speed-up and memory change against previous results"""
+    baseline = {
+        (r["pipeline"], r["records"]): r
+        for r in json.loads(Path(baseline_fh).read_text())["results"]
+    }
+    print(f"\nCompared with {baseline_fh}:")
+    print(f"{'pipeline':<32}{'records':>10}{'speed-up':>10}{'memory':>10}")
+    for r in results:
+        old = baseline.get((r["pipeline"], r["records"]))
+        if old is None:
+            continue
+        print(
+            f"{r['pipeline']:<32}{r['records']:>10}"
+            f"{old['seconds'] / r['seconds']:>9.2f}x"
+            f"{r['peak_rss_mb'] / old['peak_rss_mb']:>9.2f}x"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=[10000, 100000, 1000000]
+    )
+    parser.add_argument(
+        "--pipelines", nargs="+", choices=list(PIPELINES), default=list(PIPELINES)
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--out", help="results file; default is benchmarks/results/<timestamp>.json"
+    )
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    started = datetime.datetime.now()
+    results = []
+    print(f"{'pipeline':<32}{'records':>10}{'seconds':>10}{'rec/s':>10}{'MB':>8}")
+    for name in args.pipelines:
+        for size in args.sizes:
+            r = run_pipeline(name, size, args.seed)
+            results.append(r)
+            print(
+                f"{name:<32}{size:>10}{r['seconds']:>10.2f}"
+                f"{r['records_per_sec']:>10}{r['peak_rss_mb']:>8.1f}"
+            )
+
+    out = Path(args.out or ROOT / f"benchmarks/results/{started:%Y%m%d-%H%M%S}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(
+        json.dumps(
+            dict(
+                started=f"{started:%Y-%m-%d %H:%M:%S}",
+                python=platform.python_version(),
+                platform=platform.platform(),
+                seed=args.seed,
+                results=results,
+            ),
+            indent=2,
+        )
+    )
+    print(f"Results saved to {out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of `is_oversized` over a corpus of 300 $c values shaped like
+a Sierra export: a handful of values repeat heavily, with a long tail of
+rarer ones. Compares the single-pass memoized parser with the previous
+implementation that compiled three patterns on every call.
+
+    $ python -m benchmarks.dimensions --size 1000000
+"""
+
+import argparse
+import random
+import re
+import time
+
+from google_books.picklist import is_oversized, parse_dimensions
+
+
+COMMON = [
+    "24 cm.",
+    "23 cm.",
+    "26 cm.",
+    "22 cm.",
+    "25 cm.",
+    "28 cm.",
+    "20 cm.",
+    "19 cm.",
+    "27 cm.",
+    "30 cm.",
+    "21-23cm.",
+    "18 x 26 cm.",
+    "8vo.",
+    "4to.",
+    "33 cm.",
+    "23 x 31 cm.",
+    "",
+]
+
+
+def make_corpus(size: int, seed: int = 300) -> list[str]:
+    """Returns `size` of 300 $c values with Zipf-like repetition"""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        if rnd.random() < 0.9:
+            corpus.append(COMMON[min(int(rnd.paretovariate(1.2)) - 1, len(COMMON) - 1)])
+        else:
+            dims = [str(rnd.randint(8, 60)) for _ in range(rnd.randint(1, 3))]
+            sep = rnd.choice([" x ", "x", " X "])
+            corpus.append(sep.join(dims) + rnd.choice([" cm.", "cm", " cm"]))
+    return corpus
+
+
+def legacy_is_oversized(value: str) -> bool:
+    """Previous implementation kept for comparison"""
+    results = []
+    if match := re.compile(r"^(\d{1,2})(.*)").match(value):
+        results.append(int(match.group(1)) >= 32)
+    if match := re.compile(r"^(.*x\s?)(\d{1,2})(.*)").match(value):
+        results.append(int(match.group(2)) >= 46)
+    if match := re.compile(r"^(.*x.*x\s)(\d{1,2})(.*)").match(value):
+        results.append(int(match.group(2)) >= 13)
+    return any(results)
+
+
+def timeit(func, corpus: list[str]) -> float:
+    start = time.perf_counter()
+    for value in corpus:
+        func(value)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.size)
+    print(f"{args.size:,} values, {len(set(corpus)):,} distinct")
+    legacy = timeit(legacy_is_oversized, corpus)
+    parse_dimensions.cache_clear()
+    current = timeit(is_oversized, corpus)
+    for name, elapsed in [("legacy", legacy), ("single-pass", current)]:
+        print(f"{name:>12}: {elapsed:.3f}s ({args.size / elapsed:,.0f} values/s)")
+    print(f"{'speedup':>12}: {legacy / current:.1f}x")
+    print(f"{'cache':>12}: {parse_dimensions.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures peak RSS of `marcxml_reader` for growing MARCXML files. Each size is
+read in a fresh interpreter so peaks of previous runs do not leak into the
+results. Peak memory of the streaming reader should stay flat as the input
+grows, while `pymarc.parse_xml_to_array` grows linearly.
+
+    $ python -m benchmarks.marcxml_reader --sizes 1000 10000 100000
+"""
+
+import argparse
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+
+
+SAMPLE = Path(__file__).parent.parent / "tests/marcxml-sample-one-bib.xml"
+
+MEASURE = """
+import resource, sys
+from pymarc import parse_xml_to_array
+from google_books.marc_manipulator import marcxml_reader
+
+if sys.argv[1] == "streaming":
+    n = sum(1 for _ in marcxml_reader(sys.argv[2]))
+else:
+    n = len(parse_xml_to_array(sys.argv[2]))
+print(n, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def make_marcxml(fh: Path, size: int) -> None:
+    """Writes MARCXML file with `size` copies of the sample record"""
+    root = ET.parse(SAMPLE).getroot()
+    record = ET.tostring(root[0], encoding="utf-8")
+    with open(fh, "wb") as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>')
+        out.write(b'<collection xmlns="http://www.loc.gov/MARC21/slim">')
+        for _ in range(size):
+            out.write(record)
+        out.write(b"</collection>")
+
+
+def peak_rss(reader: str, fh: Path) -> tuple[int, int]:
+    """Returns number of records read and peak RSS in KiB"""
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE, reader, str(fh)],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    n, rss = result.stdout.split()
+    return int(n), int(rss)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 50000])
+    parser.add_argument(
+        "--compare", action="store_true", help="also measure parse_xml_to_array"
+    )
+    args = parser.parse_args()
+
+    readers = ["streaming", "array"] if args.compare else ["streaming"]
+    print(f"{'records':>10} {'file (MB)':>10} " + " ".join(f"{r:>16}" for r in readers))
+    with tempfile.TemporaryDirectory() as td:
+        for size in args.sizes:
+            fh = Path(td) / f"bench-{size}.xml"
+            make_marcxml(fh, size)
+            peaks = [peak_rss(reader, fh)[1] for reader in readers]
+            file_size = fh.stat().st_size / 1024**2
+            print(
+                f"{size:>10} {file_size:>10.1f} "
+                + " ".join(f"{p / 1024:>13.1f} MB" for p in peaks)
+            )
+            fh.unlink()
+
+
+if __name__ == "__main__":
+    main()
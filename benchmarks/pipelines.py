@@ -0,0 +1,154 @@
+"""
+Fixtures and runners of the public pipeline functions behind CLI commands.
+`prepare` lays out input files in the current directory the way the CLI
+expects them, `measure` runs the pipeline and reports wall time and peak RSS.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+from pathlib import Path
+import resource
+import time
+from typing import Callable
+import warnings
+
+from google_books import generator
+
+
+SHIPMENT_DATE = datetime.date(2024, 1, 2)
+SHIPMENT_DIR = Path(f"files/shipments/{SHIPMENT_DATE:%Y-%m-%d}_onsite")
+URLS_DIR = Path(f"files/shipments/{SHIPMENT_DATE:%Y-%m-%d}")
+OCLC_SOURCE = Path(f"files/NYPL_{SHIPMENT_DATE:%Y%m%d}-oclc-export.mrc")
+CANDIDATES_TAR = Path(f"files/NYPL_{SHIPMENT_DATE:%Y%m%d}_combined.tar.gz")
+SIERRA_EXPORT = Path("files/picklist/candidates-sierra-export.txt")
+ZEPHIR_REPORT = SHIPMENT_DIR / f"nyp_{SHIPMENT_DATE:%Y%m%d}_google_onsite.txt"
+SUBMITTED = URLS_DIR / f"nyp_{SHIPMENT_DATE:%Y%m%d}_google.xml"
+ZEPHIR_ERRORS = URLS_DIR / f"nyp_{SHIPMENT_DATE:%Y%m%d}_google_error.xml"
+
+
+def prepare_oclc(size: int, seed: int) -> None:
+    os.makedirs("files/out", exist_ok=True)
+    generator.write_marc21(OCLC_SOURCE, size, seed)
+
+
+def run_oclc() -> None:
+    from google_books.marc_manipulator import manipulate_records
+
+    manipulate_records(str(OCLC_SOURCE))
+
+
+def prepare_hathi_metadata_prep(size: int, seed: int) -> None:
+    SHIPMENT_DIR.mkdir(parents=True, exist_ok=True)
+    generator.write_marcxml(
+        SHIPMENT_DIR / f"NYPL_{SHIPMENT_DATE:%Y%m%d}.xml", size, seed
+    )
+    generator.write_grin_report(SHIPMENT_DIR / "_query.txt", size, seed)
+
+
+def run_hathi_metadata_prep() -> None:
+    from google_books.hathi_processor import clean_metadata_for_hathi_submission
+
+    clean_metadata_for_hathi_submission(f"{SHIPMENT_DATE:%Y%m%d}", "onsite")
+
+
+def prepare_hathi_report(size: int, seed: int) -> None:
+    SHIPMENT_DIR.mkdir(parents=True, exist_ok=True)
+    generator.write_zephir_report(ZEPHIR_REPORT, size, seed)
+
+
+def run_hathi_report() -> None:
+    from google_books.hathi_processor import (
+        get_hathi_report_paths,
+        parse_hathi_processing_report,
+    )
+
+    paths = get_hathi_report_paths("files/shipments", SHIPMENT_DATE, "onsite")
+    parse_hathi_processing_report(SHIPMENT_DATE, "onsite", *paths)
+
+
+def prepare_hathi_urls(size: int, seed: int) -> None:
+    URLS_DIR.mkdir(parents=True, exist_ok=True)
+    generator.write_marcxml(SUBMITTED, size, seed)
+    generator.write_zephir_errors(ZEPHIR_ERRORS, size, seed)
+
+
+def run_hathi_urls() -> None:
+    from google_books.marc_manipulator import create_stub_hathi_records
+
+    create_stub_hathi_records(
+        SUBMITTED,
+        ZEPHIR_ERRORS,
+        URLS_DIR / f"hathi-stub-urls_{SHIPMENT_DATE:%Y%m%d}.mrc",
+    )
+
+
+def prepare_unpack_candidate_items(size: int, seed: int) -> None:
+    os.makedirs("files/picklist", exist_ok=True)
+    generator.write_candidates_tar(CANDIDATES_TAR, size, seed)
+
+
+def run_unpack_candidate_items() -> None:
+    from google_books.picklist import prep_item_list_for_sierra
+
+    prep_item_list_for_sierra(str(CANDIDATES_TAR), 200000)
+
+
+def prepare_clean_candidates_sierra_export(size: int, seed: int) -> None:
+    os.makedirs("files/picklist", exist_ok=True)
+    generator.write_sierra_export(SIERRA_EXPORT, size, seed)
+
+
+def run_clean_candidates_sierra_export() -> None:
+    from google_books.picklist import prep_sierra_export_for_dataframe
+
+    prep_sierra_export_for_dataframe(str(SIERRA_EXPORT), f"{SHIPMENT_DATE:%Y-%m-%d}")
+
+
+# CLI command: (prepare fixtures, run pipeline)
+PIPELINES: dict[str, tuple[Callable[[int, int], None], Callable[[], None]]] = {
+    "oclc": (prepare_oclc, run_oclc),
+    "hathi-metadata-prep": (prepare_hathi_metadata_prep, run_hathi_metadata_prep),
+    "hathi-report": (prepare_hathi_report, run_hathi_report),
+    "hathi-urls": (prepare_hathi_urls, run_hathi_urls),
+    "unpack-candidate-items": (
+        prepare_unpack_candidate_items,
+        run_unpack_candidate_items,
+    ),
+    "clean-candidates-sierra-export": (
+        prepare_clean_candidates_sierra_export,
+        run_clean_candidates_sierra_export,
+    ),
+}
+
+
+def prepare(name: str, size: int, seed: int = 0) -> None:
+    """Writes fixtures of `size` records for pipeline `name` to the current dir"""
+    PIPELINES[name][0](size, seed)
+
+
+def measure(name: str) -> dict:
+    """
+    Runs pipeline `name` on fixtures in the current directory. Progress output
+    and warnings of the pipeline are discarded.
+
+    Returns:
+        wall time in seconds and peak RSS in MiB of the interpreter
+    """
+    run = PIPELINES[name][1]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+    # ru_maxrss is reported in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return dict(seconds=seconds, peak_rss_mb=round(peak, 1))
+
+
+if __name__ == "__main__":
+    import sys
+
+    print(json.dumps(measure(sys.argv[1])))
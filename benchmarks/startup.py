@@ -0,0 +1,69 @@
+"""
+Measures CLI startup: wall time of `import google_books` and of
+`google-books --help` above a bare interpreter start, taken as the median of
+several fresh interpreters. Exits with an error if startup is over budget, so
+it can guard against slow imports creeping back in.
+
+    $ python -m benchmarks.startup --runs 20 --budget-ms 150
+"""
+
+import argparse
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROOT = Path(__file__).parent.parent
+
+COMMANDS = {
+    "python": "pass",
+    "import google_books": "import google_books",
+    "google-books --help": (
+        "import sys; sys.argv = ['google-books', '--help']; "
+        "from google_books import main; main()"
+    ),
+}
+
+
+def median_ms(code: str, runs: int) -> float:
+    """Returns median wall time of running the code in a fresh interpreter"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=150.0,
+        help="allowed startup time above a bare interpreter",
+    )
+    args = parser.parse_args()
+
+    timings = {name: median_ms(code, args.runs) for name, code in COMMANDS.items()}
+    baseline = timings.pop("python")
+    print(f"{'python (baseline)':<24}{baseline:>8.1f} ms")
+    over_budget = False
+    for name, ms in timings.items():
+        overhead = ms - baseline
+        over_budget |= overhead > args.budget_ms
+        print(f"{name:<24}{ms:>8.1f} ms  (+{overhead:.1f} ms)")
+    if over_budget:
+        sys.exit(f"Startup is over the budget of +{args.budget_ms:.0f} ms.")
+    print(f"Startup is within the budget of +{args.budget_ms:.0f} ms.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,13 @@
+import datetime
 from pathlib import Path
+from typing import Optional
 import click
 
-from google_books.errors import FileNameError
-from google_books.hathi_processor import (
-    parse_hathi_processing_report,
-    clean_metadata_for_hathi_submission,
-)
-from google_books.marc_manipulator import manipulate_records as fix_oclc_data
-from google_books.marc_manipulator import create_stub_hathi_records
-from google_books.manifest import (
-    prep_onsite_manifest_for_google,
-    prep_recap_manifest_for_sierra_list,
-)
-from google_books.picklist import (
-    prep_item_list_for_sierra,
-    prep_sierra_export_for_dataframe,
-)
+# Only light modules are imported here. Modules of commands (and pymarc with
+# them) are imported when the command runs, so `--help` and simple commands
+# start fast.
+from google_books.errors import FileNameError, GoogleBooksToolError
+from google_books.status_store import DEFAULT_STORE, KEY_COLUMNS, StatusStore
 from google_books.utils import get_directory, shipment_date_obj
 
 
@@ -23,48 +15,157 @@ __version__ = "0.1.0"
 
 
 @click.group()
-def cli() -> None:
-    pass
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Profile the command with cProfile and save pstats and text reports.",
+)
+@click.option(
+    "--trace-memory",
+    is_flag=True,
+    help="Trace memory allocations of the command with tracemalloc.",
+)
+@click.option(
+    "--profile-dir",
+    type=click.Path(file_okay=False),
+    default="files/out",
+    show_default=True,
+    help="Directory profiling reports are saved to.",
+)
+@click.pass_context
+def cli(
+    ctx: click.Context, profile: bool, trace_memory: bool, profile_dir: str
+) -> None:
+    if not (profile or trace_memory):
+        return
+
+    # profiling tools are imported only when requested
+    from google_books.profiling import (
+        profile_fh,
+        save_memory_trace,
+        save_profile,
+        start_memory_trace,
+        start_profiler,
+    )
+
+    command = ctx.invoked_subcommand or "cli"
+    started = datetime.datetime.now()
+    if trace_memory:
+        start_memory_trace()
+    if profile:
+        profiler = start_profiler()
+
+    def finish() -> None:
+        # stop profiling first so saving the memory trace is not profiled
+        if profile:
+            profiler.disable()
+        if trace_memory:
+            fh = profile_fh(profile_dir, command, "-memory.txt", started)
+            click.echo(save_memory_trace(fh), err=True)
+        if profile:
+            fh = profile_fh(profile_dir, command, ".prof", started)
+            click.echo(save_profile(profiler, fh), err=True)
+
+    ctx.call_on_close(finish)
 
 
 @cli.command()
 @click.argument("shipment_date")
 @click.argument("mat_source")
 @click.argument("parent_dir", type=click.Path(), default="files/shipments")
-def hathi_report(shipment_date: str, mat_source: str, parent_dir: str) -> None:
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    default=str(DEFAULT_STORE),
+    show_default=True,
+    help="Status store the results are recorded in.",
+)
+def hathi_report(shipment_date: str, mat_source: str, parent_dir: str, db: str) -> None:
     """
     Run analysis of the HathiTrust/Zephir reports and create actionable data.
     Outputs reports to files/out/ directory.
     """
-    date = shipment_date_obj(shipment_date)
-    shipment_dir = Path(f"{parent_dir}/{date:%Y-%m-%d}_{mat_source}")
-    source_fh = shipment_dir / f"nyp_{date:%Y%m%d}_google_{mat_source}.txt"
-    success_fh = shipment_dir / f"hathi-{date:%Y%m%d}-success.csv"
-    invalid_oclc_fh = shipment_dir / f"hathi-{date:%Y%m%d}-unspecified-oclc.csv"
-    missing_oclc_fh = shipment_dir / f"hathi-{date:%Y%m%d}-missing-oclc.csv"
-    error_fh = shipment_dir / f"hathi-{date:%Y%m%d}-errors.csv"
-
-    suc, inv, mis, err = parse_hathi_processing_report(
-        date,
-        mat_source,
-        source_fh,
-        success_fh,
-        invalid_oclc_fh,
-        missing_oclc_fh,
-        error_fh,
+    from google_books.hathi_processor import (
+        get_hathi_report_paths,
+        parse_hathi_processing_report,
     )
 
+    date = shipment_date_obj(shipment_date)
+    paths = get_hathi_report_paths(parent_dir, date, mat_source)
+
+    with StatusStore(db) as store:
+        suc, inv, mis, err = parse_hathi_processing_report(
+            date,
+            mat_source,
+            *paths,
+            store,
+        )
+
     click.echo("Report:")
-    click.echo(f"Successfully processed {suc}. See {success_fh}")
-    click.echo(f"OCLC in 035 only: {inv}. See {invalid_oclc_fh}")
-    click.echo(f"Missing OCLC #: {mis}. See {missing_oclc_fh}")
-    click.echo(f"Rejected {err}. See {error_fh}")
+    click.echo(f"Successfully processed {suc}. See {paths.success}")
+    click.echo(f"OCLC in 035 only: {inv}. See {paths.invalid_oclc}")
+    click.echo(f"Missing OCLC #: {mis}. See {paths.missing_oclc}")
+    click.echo(f"Rejected {err}. See {paths.error}")
+
+
+@cli.command()
+@click.argument("parent_dir", type=click.Path(exists=True), default="files/shipments")
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of shipments parsed in parallel.",
+)
+@click.option(
+    "--skip-current/--all",
+    default=True,
+    show_default=True,
+    help="Skip shipments whose reports are newer than their Zephir report.",
+)
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    default=str(DEFAULT_STORE),
+    show_default=True,
+    help="Status store the results are recorded in.",
+)
+def hathi_report_batch(
+    parent_dir: str, workers: int, skip_current: bool, db: str
+) -> None:
+    """
+    Runs analysis of Zephir reports of all `YYYY-MM-DD_<source>` shipment
+    folders in PARENT_DIR and prints a summary table.
+    """
+    from google_books.hathi_processor import batch_parse_hathi_processing_reports
+
+    summaries, skipped = batch_parse_hathi_processing_reports(
+        parent_dir, workers, skip_current, db
+    )
+    header = ("Shipment", "Source", "Success", "035 only", "Missing OCLC", "Rejected")
+    click.echo("{:<12}{:<10}{:>10}{:>10}{:>14}{:>10}".format(*header))
+    for summary in summaries:
+        click.echo(
+            "{:<12}{:<10}{:>10}{:>10}{:>14}{:>10}".format(
+                f"{summary.shipment_date}", *summary[1:]
+            )
+        )
+    totals = [sum(column) for column in list(zip(*summaries))[2:]] or [0] * 4
+    click.echo("{:<22}{:>10}{:>10}{:>14}{:>10}".format("Total", *totals))
+    if skipped:
+        click.echo(f"Skipped {skipped} up-to-date shipment(s).")
 
 
 @cli.command()
 @click.argument("shipment_date")
 @click.argument("mat_source")
-def hathi_metadata_prep(shipment_date: str, mat_source: str) -> None:
+@click.option(
+    "--pymarc",
+    "decode_all",
+    is_flag=True,
+    help="Parse and rewrite every record with pymarc (slower; to cross-check).",
+)
+def hathi_metadata_prep(shipment_date: str, mat_source: str, decode_all: bool) -> None:
     """
     Preps HathiTrust MARCXML file using GRIN's Advanced Search report by
     removing from it records/items that have not been digitized.
@@ -72,8 +173,10 @@ def hathi_metadata_prep(shipment_date: str, mat_source: str) -> None:
     Args:
         shipment_date:  date in the format YYYYMMDD
     """
+    from google_books.hathi_processor import clean_metadata_for_hathi_submission
+
     saved_bibs, rejected_bibs, file_size = clean_metadata_for_hathi_submission(
-        shipment_date, mat_source
+        shipment_date, mat_source, raw=not decode_all
     )
     click.echo(
         f"Scanned items: {saved_bibs}\nRejected items: {rejected_bibs}\n"
@@ -112,12 +215,27 @@ def new_shipment(shipment_date: str, mat_source: str, parent_dir: str):
 
 @cli.command()
 @click.argument("filename", type=click.Path(exists=True))
-def oclc(filename: str) -> None:
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes to fix records in.",
+)
+@click.option(
+    "--pymarc",
+    "decode_all",
+    is_flag=True,
+    help="Decode every record with pymarc (slower; to cross-check the output).",
+)
+def oclc(filename: str, workers: int, decode_all: bool) -> None:
     """
     Replaces 001/003 with OCLC info found in 035 or 991. Deletes 991.
     Outputs manipulated file to files/out/ directory
     """
-    fix_oclc_data(filename)
+    from google_books.marc_manipulator import manipulate_records as fix_oclc_data
+
+    fix_oclc_data(filename, workers, raw=not decode_all)
 
 
 @cli.command()
@@ -130,6 +248,8 @@ def recap_manifest(shipment_date: str) -> None:
     Args:
         shipment_date:  date in the format YYYYMMDD
     """
+    from google_books.manifest import prep_recap_manifest_for_sierra_list
+
     try:
         out = prep_recap_manifest_for_sierra_list(shipment_date)
         click.echo(f"Cleaned up manifest was saved to {out.resolve()}")
@@ -147,6 +267,8 @@ def onsite_manifest(shipment_date: str) -> None:
     """
     Preps Sierra item export for submission to Google
     """
+    from google_books.manifest import prep_onsite_manifest_for_google
+
     try:
         out = prep_onsite_manifest_for_google(shipment_date)
         click.echo(f"Prepped manifest was saved to {out.resolve()}")
@@ -165,6 +287,8 @@ def unpack_candidate_items(tar_file: str, list_size: int) -> None:
     Args:
         tar_file (str): The tar file containing the candidate list.
     """
+    from google_books.picklist import prep_item_list_for_sierra
+
     prep_item_list_for_sierra(tar_file, list_size)
     click.echo("Candidate items have been saved to files/picklist/ directory.")
 
@@ -172,7 +296,23 @@ def unpack_candidate_items(tar_file: str, list_size: int) -> None:
 @cli.command()
 @click.argument("filename", type=click.Path(exists=True))
 @click.argument("date", type=str)
-def clean_candidates_sierra_export(filename: str, date: str) -> None:
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["tsv", "parquet", "arrow"]),
+    default="tsv",
+    show_default=True,
+    help="Output format. Parquet and Arrow IPC output requires pyarrow.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue an interrupted run from its last checkpoint (tsv only).",
+)
+def clean_candidates_sierra_export(
+    filename: str, date: str, fmt: str, resume: bool
+) -> None:
     """
     Transforms a given Sierra export file to a format that can be used to create
     `pandas.DataFrame` object. Will append data to the out file if already exists.
@@ -180,31 +320,224 @@ def clean_candidates_sierra_export(filename: str, date: str) -> None:
         filename (str): The path to the Sierra export file
         date (str): The date of the export for the output file name
     """
+    from google_books.picklist import prep_sierra_export_for_dataframe
+
     click.echo("Cleaning up Sierra export. This may take several minutes...")
-    prep_sierra_export_for_dataframe(filename, date)
+    prep_sierra_export_for_dataframe(filename, date, fmt, resume)
     click.echo("Cleaned Sierra export was saved to files/picklist/ directory.")
 
 
 @cli.command()
 @click.argument("shipment_date")
-def hathi_urls(shipment_date: str, parent_dir: str = "files/shipments") -> None:
+@click.option(
+    "--mat-source",
+    type=click.Choice(["onsite", "recap"]),
+    help="Source of the material; items with Hathi URLs are recorded in the "
+    "status store only when it is given.",
+)
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    default=str(DEFAULT_STORE),
+    show_default=True,
+    help="Status store the items with Hathi URLs are recorded in.",
+)
+def hathi_urls(
+    shipment_date: str,
+    mat_source: Optional[str],
+    db: str,
+    parent_dir: str = "files/shipments",
+) -> None:
     """
     Creates stub MARC21 records with generated 856 for HathiTrust URLs based
     on files in the shipment folder.
 
     Args:
         shipment_date:      shipment_date:  date in the format YYYYMMDD
+        mat_source:         optional source of the material (e.g. onsite, recap)
+                            the items are recorded under in the status store
 
     """
+    from google_books.marc_manipulator import create_stub_hathi_records
+
     date = shipment_date_obj(shipment_date)
     shipment_dir = Path(f"{parent_dir}/{date:%Y-%m-%d}")
     submitted_fh = shipment_dir / f"nyp_{date:%Y%m%d}_google.xml"
     errors_fh = shipment_dir / f"nyp_{date:%Y%m%d}_google_error.xml"
     out_fh = shipment_dir / f"hathi-stub-urls_{date:%Y%m%d}.mrc"
 
-    create_stub_hathi_records(submitted_fh, errors_fh, out_fh)
+    if mat_source is None:
+        create_stub_hathi_records(submitted_fh, errors_fh, out_fh)
+        click.echo(f"Items were not recorded in {db}. Use --mat-source to record them.")
+    else:
+        with StatusStore(db) as store:
+            create_stub_hathi_records(
+                submitted_fh,
+                errors_fh,
+                out_fh,
+                store=store,
+                shipment_date=date,
+                mat_source=mat_source,
+            )
     click.echo(f"Stub MARC records with Hathi URLs were saved to `{out_fh}`.")
 
 
+@cli.command()
+@click.argument("shipment_date")
+@click.argument("mat_source")
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    default=str(DEFAULT_STORE),
+    show_default=True,
+    help="Status store the results are recorded in.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Run all steps even if their outputs are up to date.",
+)
+def process_shipment(shipment_date: str, mat_source: str, db: str, force: bool):
+    """
+    Runs the whole shipment workflow (hathi-metadata-prep, hathi-report, and
+    hathi-urls) on files in the shipment folder. Steps whose outputs are newer
+    than their inputs are skipped and steps whose inputs are not in the folder
+    yet wait for them.
+
+    Args:
+        shipment_date:      date in the format YYYYMMDD
+        mat_source:         source of the material (e.g. onsite, recap)
+    """
+    from google_books.pipeline import ShipmentPipeline
+
+    try:
+        with StatusStore(db) as store:
+            results = ShipmentPipeline(shipment_date, mat_source, store, force).run()
+    except GoogleBooksToolError as exc:
+        click.echo(str(exc))
+        return
+    for result in results:
+        click.echo(f"{result.stage:<22}{result.status:<9}{result.message}")
+
+
+@cli.command()
+@click.argument("values", nargs=-1)
+@click.option(
+    "--key",
+    type=click.Choice(KEY_COLUMNS),
+    default="bibno",
+    show_default=True,
+    help="What the given values are.",
+)
+@click.option(
+    "--file",
+    "values_file",
+    type=click.File("r"),
+    help="File with one value per line to look up in addition to VALUES.",
+)
+@click.option(
+    "--db",
+    type=click.Path(exists=True, dir_okay=False),
+    default=str(DEFAULT_STORE),
+    show_default=True,
+    help="Status store to query.",
+)
+def hathi_status(values: tuple[str], key: str, values_file, db: str) -> None:
+    """
+    Looks up HathiTrust/Zephir statuses recorded across all shipments.
+    Outputs tab-delimited rows: shipment date, material source, bib #,
+    barcode, CID, status, message.
+
+    Args:
+        values:     bib #s (default), barcodes, CIDs, or shipment dates
+    """
+    lookup = list(values)
+    if values_file:
+        lookup.extend(line.strip() for line in values_file if line.strip())
+    with StatusStore(db) as store:
+        records = store.query(key, lookup)
+    for record in records:
+        click.echo("\t".join(record[:-1]))
+    found = {getattr(record, key) for record in records}
+    click.echo(f"Found {len(records)} status(es) for {len(found)} {key}(s).", err=True)
+
+
+@cli.command()
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.argument("keys", nargs=-1)
+@click.option(
+    "--file",
+    "keys_file",
+    type=click.File("r"),
+    help="File with one bib # or barcode per line to fetch in addition to KEYS.",
+)
+@click.option(
+    "--out",
+    type=click.Path(dir_okay=False),
+    required=True,
+    help="File fetched records are saved to, in the format of SOURCE.",
+)
+def fetch_records(source: str, keys: tuple[str], keys_file, out: str) -> None:
+    """
+    Fetches records from a large MARC21 or MARCXML file by 907$a bib # or
+    945$i barcode. Uses an index of record offsets saved next to SOURCE,
+    which is built on first use and rebuilt when SOURCE changes.
+
+    Args:
+        keys:       bib #s or barcodes
+    """
+    from google_books.record_index import write_records
+
+    lookup = list(keys)
+    if keys_file:
+        lookup.extend(line.strip() for line in keys_file if line.strip())
+    written = write_records(source, lookup, out)
+    click.echo(f"Fetched {written} record(s) to {out}.")
+
+
+@cli.command()
+@click.argument(
+    "kind",
+    # same as `google_books.generator.GENERATORS`
+    type=click.Choice(
+        [
+            "marc21",
+            "marcxml",
+            "zephir-errors",
+            "grin",
+            "zephir-report",
+            "sierra-export",
+            "candidates",
+        ]
+    ),
+)
+@click.argument("size", type=click.IntRange(min=0))
+@click.argument("out", type=click.Path(dir_okay=False))
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    show_default=True,
+    help="The same seed always produces the same file.",
+)
+def generate(kind: str, size: int, out: str, seed: int) -> None:
+    """
+    Generates synthetic input file for load testing. SIZE is the number of bibs
+    (items for Sierra exports and candidate lists). Inputs generated with the
+    same seed match each other, e.g. barcodes in GRIN report and MARCXML.
+
+    Args:
+        kind:       marc21, marcxml, zephir-errors, grin, zephir-report,
+                    sierra-export, or candidates
+        size:       number of records
+        out:        path of the output file
+    """
+    from google_books.generator import generate as generate_input
+
+    written = generate_input(kind, out, size, seed)
+    click.echo(f"Generated {kind} file with {size} record(s) ({written} bytes): {out}")
+
+
 def main() -> None:
     cli()
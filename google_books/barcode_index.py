@@ -0,0 +1,103 @@
+"""
+Compact index of item barcodes used for GRIN rejection lookups.
+"""
+
+from array import array
+from bisect import bisect_left
+import struct
+from typing import Iterable, Iterator, Optional, Union
+
+from google_books.utils import array_from_bytes, array_to_bytes
+
+
+def encode_barcode(barcode: str) -> Optional[int]:
+    """
+    Encodes numeric barcode as an integer. Barcodes that cannot be restored
+    from their integer value (non-numeric, leading zeros, longer than 18
+    digits) are not encoded.
+
+    Args:
+        barcode:            item barcode
+
+    Returns:
+        barcode as int or None
+    """
+    if (
+        barcode.isascii()
+        and barcode.isdigit()
+        and barcode[0] != "0"
+        and len(barcode) <= 18
+    ):
+        return int(barcode)
+    return None
+
+
+class BarcodeIndex:
+    """
+    Set-like collection of barcodes. Numeric barcodes are packed into a sorted
+    array of 64-bit integers and looked up with a binary search. Any other
+    barcodes fall back to a set of strings.
+
+    Args:
+        barcodes:           iterable of barcodes
+    """
+
+    __slots__ = ("_numeric", "_other")
+
+    def __init__(self, barcodes: Iterable[str] = ()) -> None:
+        numeric = set()
+        other = set()
+        for barcode in barcodes:
+            key = encode_barcode(barcode)
+            if key is None:
+                other.add(barcode)
+            else:
+                numeric.add(key)
+        self._numeric = array("q", sorted(numeric))
+        self._other = frozenset(other)
+
+    @classmethod
+    def from_bytes(cls, data: Union[bytes, memoryview]) -> "BarcodeIndex":
+        """
+        Restores index serialized with `to_bytes`.
+
+        Args:
+            data:           serialized index
+        """
+        numeric_count, other_count = struct.unpack_from("<QQ", data)
+        end = 16 + numeric_count * 8
+        index = cls()
+        index._numeric = array_from_bytes("q", data[16:end])
+        if other_count:
+            index._other = frozenset(bytes(data[end:]).decode("utf-8").split("\n"))
+        return index
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the index: number of numeric and other barcodes, numeric
+        barcodes as little-endian 64-bit integers, and other barcodes separated
+        by new lines.
+        """
+        return (
+            struct.pack("<QQ", len(self._numeric), len(self._other))
+            + array_to_bytes(self._numeric)
+            + "\n".join(sorted(self._other)).encode("utf-8")
+        )
+
+    def __contains__(self, barcode: object) -> bool:
+        if not isinstance(barcode, str):
+            return False
+        key = encode_barcode(barcode)
+        if key is None:
+            return barcode in self._other
+        idx = bisect_left(self._numeric, key)
+        return idx < len(self._numeric) and self._numeric[idx] == key
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(sorted([str(key) for key in self._numeric] + list(self._other)))
+
+    def __len__(self) -> int:
+        return len(self._numeric) + len(self._other)
+
+    def __repr__(self) -> str:
+        return f"<BarcodeIndex barcodes={len(self)}>"
@@ -0,0 +1,382 @@
+"""
+A module with methods to generate synthetic, seeded inputs of the tool for
+load testing. Every writer streams its output, so files of any size can be
+produced with flat memory use. Values derived from a record number are
+consistent across writers, e.g. barcodes in the GRIN report match items in
+the shipment MARCXML, and the same seed always produces the same files.
+"""
+
+import gzip
+from html import escape
+import io
+from pathlib import Path
+import tarfile
+from typing import Callable, Union
+
+from pymarc import Field, Indicators, Leader, Record, Subfield
+
+from google_books.errors import GoogleBooksToolError
+from google_books.picklist import SIERRA_EXPORT_FIELDS
+
+
+TITLES = [
+    "The conflict; a health masque in pantomime",
+    "Report of meeting",
+    "Studies in Latin literature and its tradition",
+    "Annual report of the Board of Education",
+    "A history of the city of New York",
+    "Proceedings of the American Antiquarian Society",
+    "Catalogue of the manuscripts",
+    "Journal of the Royal Asiatic Society",
+]
+EXTENTS = ["24 cm.", "23 cm.", "26 cm.", "28 cm.", "33 cm.", "23 x 31 cm.", "8vo.", ""]
+GRIN_CONDITIONS = ["", "", "", "25", "26", "27"]
+
+
+def bucket(seed: int, n: int, salt: int = 0) -> int:
+    """Deterministic pseudo-random number from 0 to 99 for record `n`"""
+    x = (n * 0x9E3779B1 + seed * 0x85EBCA77 + salt * 0xC2B2AE3D) & 0xFFFFFFFF
+    x ^= x >> 15
+    x = (x * 0x2C1B3C6D) & 0xFFFFFFFF
+    x ^= x >> 12
+    return x % 100
+
+
+def bibno(n: int) -> str:
+    """Sierra bib # with a check digit (e.g. .b152373081)"""
+    digits = f"{10000000 + n:08d}"
+    check = sum(int(d) * w for d, w in zip(reversed(digits), range(2, 10))) % 11
+    return f".b{digits}{'x' if check == 10 else check}"
+
+
+def barcode(n: int, item: int = 0) -> str:
+    return f"33433{n * 4 + item:09d}"
+
+
+def oclcno(n: int) -> str:
+    return f"{100000000 + n:09d}"
+
+
+def items_per_bib(seed: int, n: int) -> int:
+    return 2 if bucket(seed, n, 1) < 10 else 1
+
+
+def is_rejected(seed: int, n: int, item: int) -> bool:
+    return bucket(seed, n, 10 + item) < 5
+
+
+def is_zephir_error(seed: int, n: int) -> bool:
+    return bucket(seed, n, 3) < 1
+
+
+def marc21_templates() -> list[bytes]:
+    """
+    MARC21 record templates with fixed-width placeholders for OCLC #, bib #
+    and barcode, so values can be swapped without rebuilding the directory.
+    Templates have OCLC # in 035, in 991 only, or no OCLC # at all.
+    """
+    templates = []
+    for variant in ("035", "991", "none"):
+        bib = Record()
+        bib.leader = Leader("00000cam a2200000 a 4500")
+        bib.add_field(Field(tag="001", data="~" * 9))
+        bib.add_field(Field(tag="003", data="NN"))
+        bib.add_field(Field(tag="005", data="20240101120000.0"))
+        bib.add_field(Field(tag="008", data="711126s1930    nyua     b    000 0 eng d"))
+        if variant == "035":
+            bib.add_field(
+                Field(tag="035", subfields=[Subfield("a", f"(OCoLC){'~' * 9}")])
+            )
+        bib.add_field(Field(tag="035", subfields=[Subfield("a", "(WaOLN)nyp2264446")]))
+        bib.add_field(
+            Field(
+                tag="245",
+                indicators=Indicators("1", "4"),
+                subfields=[Subfield("a", f"{TITLES[0]} /"), Subfield("c", "Colby.")],
+            )
+        )
+        bib.add_field(Field(tag="300", subfields=[Subfield("c", "24 cm.")]))
+        bib.add_field(Field(tag="907", subfields=[Subfield("a", f".b{'^' * 9}")]))
+        bib.add_field(
+            Field(
+                tag="945",
+                subfields=[Subfield("i", "`" * 14), Subfield("l", "rcpd2")],
+            )
+        )
+        bib.add_field(Field(tag="910", subfields=[Subfield("a", "RL")]))
+        if variant in ("035", "991"):
+            bib.add_field(Field(tag="991", subfields=[Subfield("y", "~" * 9)]))
+        templates.append(bib.as_marc())
+    return templates
+
+
+def write_marc21(fh: Union[str, Path], size: int, seed: int = 0) -> int:
+    """
+    Writes binary MARC file like the Sierra export used by the `oclc` command.
+    About 2% of records have no OCLC #.
+
+    Returns:
+        number of bytes written
+    """
+    templates = marc21_templates()
+    written = 0
+    with open(fh, "wb", buffering=1024 * 1024) as out:
+        for n in range(size):
+            b = bucket(seed, n, 2)
+            template = templates[0 if b < 80 else 1 if b < 98 else 2]
+            written += out.write(
+                template.replace(b"~" * 9, oclcno(n).encode())
+                .replace(b"^" * 9, bibno(n)[2:].encode())
+                .replace(b"`" * 14, barcode(n).encode())
+            )
+    return written
+
+
+def marcxml_record(seed: int, n: int) -> str:
+    title = escape(TITLES[n % len(TITLES)], quote=False)
+    items = "".join(
+        '<datafield tag="945" ind1=" " ind2=" ">'
+        f'<subfield code="c">{f"v. {item + 1}" if item else ""}</subfield>'
+        f'<subfield code="i">{barcode(n, item)}</subfield>'
+        '<subfield code="l">rcpd2</subfield>'
+        f'<subfield code="y">.i{20000000 + n * 4 + item}</subfield>'
+        "</datafield>"
+        for item in range(items_per_bib(seed, n))
+    )
+    return (
+        "<record>"
+        "<leader>01291nam a2200325zi 4500</leader>"
+        f'<controlfield tag="001">{oclcno(n)}</controlfield>'
+        '<controlfield tag="003">OCoLC</controlfield>'
+        '<controlfield tag="008">711126c19301921xxua|   |b   |0|| | eng d'
+        "</controlfield>"
+        '<datafield tag="035" ind1=" " ind2=" ">'
+        f'<subfield code="a">(OCoLC){oclcno(n)}</subfield></datafield>'
+        '<datafield tag="245" ind1="1" ind2="4">'
+        f'<subfield code="a">{title} /</subfield>'
+        '<subfield code="c">by Gertrude K. Colby.</subfield></datafield>'
+        '<datafield tag="300" ind1=" " ind2=" ">'
+        f'<subfield code="c">{EXTENTS[n % len(EXTENTS)]}</subfield></datafield>'
+        '<datafield tag="907" ind1=" " ind2=" ">'
+        f'<subfield code="a">{bibno(n)}</subfield></datafield>'
+        f"{items}"
+        "</record>\n"
+    )
+
+
+def write_marcxml(
+    fh: Union[str, Path], size: int, seed: int = 0, errors_only: bool = False
+) -> int:
+    """
+    Writes shipment MARCXML file. With `errors_only` only records Zephir
+    rejects are written, like in Zephir's MARCXML error report.
+
+    Returns:
+        number of bytes written
+    """
+    written = 0
+    with open(fh, "w", encoding="utf-8", buffering=1024 * 1024) as out:
+        written += out.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<collection xmlns="http://www.loc.gov/MARC21/slim">\n'
+        )
+        for n in range(size):
+            if errors_only and not is_zephir_error(seed, n):
+                continue
+            written += out.write(marcxml_record(seed, n))
+        written += out.write("</collection>\n")
+    return written
+
+
+def write_zephir_errors(fh: Union[str, Path], size: int, seed: int = 0) -> int:
+    """
+    Writes Zephir's MARCXML error report with records of a submission of
+    `size` bibs that Zephir rejects (about 1%).
+
+    Returns:
+        number of bytes written
+    """
+    return write_marcxml(fh, size, seed, errors_only=True)
+
+
+def write_grin_report(fh: Union[str, Path], size: int, seed: int = 0) -> int:
+    """
+    Writes GRIN `_query.txt` report covering all items of `size` bibs.
+    About 5% of items are not scannable.
+
+    Returns:
+        number of bytes written
+    """
+    header = [
+        "Barcode",
+        "Check-In Date",
+        "State",
+        "Viewability",
+        "Conditions",
+        "Scannable",
+    ]
+    written = 0
+    with open(fh, "w", encoding="utf-8", buffering=1024 * 1024) as out:
+        written += out.write("\t".join(header) + "\n")
+        for n in range(size):
+            for item in range(items_per_bib(seed, n)):
+                rejected = is_rejected(seed, n, item)
+                row = [
+                    barcode(n, item),
+                    f"2024/{n % 12 + 1:02d}/{n % 28 + 1:02d} {n % 24:02d}:{n % 60:02d}",
+                    "CHECKED_IN",
+                    "-",
+                    GRIN_CONDITIONS[n % len(GRIN_CONDITIONS)] if rejected else "",
+                    "false" if rejected else "true",
+                ]
+                written += out.write("\t".join(row) + "\n")
+    return written
+
+
+def write_zephir_report(fh: Union[str, Path], size: int, seed: int = 0) -> int:
+    """
+    Writes Zephir job report for a submission of `size` bibs.
+
+    Returns:
+        number of bytes written
+    """
+    written = 0
+    with open(fh, "w", encoding="utf-8", buffering=1024 * 1024) as out:
+        written += out.write(
+            "The following configuration was used for this run:\n    foo\n\n"
+            "Processing messages:\n\n"
+        )
+        cid = 100000000
+        for n in range(size):
+            bib = bibno(n)
+            b = bucket(seed, n, 4)
+            if is_zephir_error(seed, n):
+                written += out.write(
+                    f"ERROR 47: {bib} ({n}): invalid recTyp: b, "
+                    "leader = '01249nbcaa2200349   4500'\n"
+                )
+                continue
+            if b < 3:
+                written += out.write(
+                    f"WARNING: {bib} ({n}): no OCLC number in record\n"
+                )
+            elif b < 5:
+                written += out.write(
+                    f"WARNING: {bib} ({n}): OCLC number found in unspecified "
+                    f"035$(OcoLC) field: {oclcno(n)}\n"
+                )
+            cid += 1
+            written += out.write(f"INFO: {n + 1}: new cid = {cid}\n")
+        written += out.write(f"\n\nRUN REPORT\n\n{size} records read\n")
+    return written
+
+
+def sierra_export_row(seed: int, n: int) -> list[str]:
+    item = [
+        f"i{20000000 + n * 4}",
+        "-",
+        "33",
+        "rc2ma",
+        "-  ",
+        "-",
+        "2",
+        "214",
+        str(n % 7),
+        barcode(n),
+        "",
+        f"*EC.A{n % 1000}",
+        f"v. {n % 30}" if n % 3 else "",
+        "",
+        "",
+    ]
+    bibs = [
+        [
+            "s",
+            str(1850 + (n + b) % 150),
+            "9999",
+            EXTENTS[bucket(seed, n, 6 + b) % len(EXTENTS)],
+            TITLES[(n + b) % len(TITLES)],
+            "New York : [s.n.], 1888-",
+            f"*EC.A{n % 1000}",
+            f"*EC.A{n % 1000}",
+        ]
+        for b in range(2 if bucket(seed, n, 5) < 14 else 1)
+    ]
+    # values of linked bibs are interleaved in the export
+    return item + [value for values in zip(*bibs) for value in values]
+
+
+def write_sierra_export(fh: Union[str, Path], size: int, seed: int = 0) -> int:
+    """
+    Writes tab-delimited Sierra export of candidate items matching
+    `SIERRA_EXPORT_FIELDS`. About 14% of items are linked to two bibs.
+
+    Returns:
+        number of bytes written
+    """
+    written = 0
+    with open(fh, "w", encoding="utf-8", buffering=1024 * 1024) as out:
+        written += out.write("\t".join(SIERRA_EXPORT_FIELDS) + "\n")
+        for n in range(size):
+            written += out.write("\t".join(sierra_export_row(seed, n)) + "\n")
+    return written
+
+
+def write_candidates_tar(
+    fh: Union[str, Path], size: int, seed: int = 0, member_size: int = 100000
+) -> int:
+    """
+    Writes gzip compressed Google candidate list tar file with `size` items
+    split into `_combined-NNN.txt` members.
+
+    Returns:
+        number of bytes written
+    """
+    # no file name and fixed timestamp in gzip header keep the output reproducible
+    with (
+        open(fh, "wb") as out,
+        gzip.GzipFile(filename="", mode="wb", fileobj=out, mtime=0) as gz,
+        tarfile.open(fileobj=gz, mode="w") as tar,
+    ):
+        for start in range(0, size, member_size):
+            data = "".join(
+                f"{barcode(n)}\t.i{20000000 + n * 4}\tNYPL\n"
+                for n in range(start, min(start + member_size, size))
+            ).encode("utf-8")
+            info = tarfile.TarInfo(f"NYPL_combined-{start // member_size + 1:03d}.txt")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return Path(fh).stat().st_size
+
+
+# kind of input: writer
+GENERATORS: dict[str, Callable[[Union[str, Path], int, int], int]] = {
+    "marc21": write_marc21,
+    "marcxml": write_marcxml,
+    "zephir-errors": write_zephir_errors,
+    "grin": write_grin_report,
+    "zephir-report": write_zephir_report,
+    "sierra-export": write_sierra_export,
+    "candidates": write_candidates_tar,
+}
+
+
+def generate(kind: str, fh: Union[str, Path], size: int, seed: int = 0) -> int:
+    """
+    Writes synthetic input file of given kind.
+
+    Args:
+        kind:               one of `GENERATORS` keys
+        fh:                 path of the output file
+        size:               number of bibs (items for Sierra export and
+                            candidate lists)
+        seed:               seed; the same seed produces the same file
+
+    Returns:
+        number of bytes written
+    """
+    try:
+        writer = GENERATORS[kind]
+    except KeyError:
+        raise GoogleBooksToolError(f"Unknown kind of input `{kind}`.")
+    return writer(fh, size, seed)
@@ -0,0 +1,141 @@
+"""
+On-disk cache of parsed GRIN reports. The cache is saved next to the report
+(`_query.txt.cache`) and is used as long as the report has the same size and
+modification time, or the same content if it was only touched or copied.
+"""
+
+from array import array
+from collections import Counter
+import datetime
+import hashlib
+from pathlib import Path
+import struct
+from typing import NamedTuple, Optional
+import warnings
+
+from google_books.barcode_index import BarcodeIndex
+from google_books.utils import array_from_bytes, array_to_bytes, atomic_write
+
+
+CACHE_SUFFIX = ".cache"
+
+MAGIC = b"GRINIDX1"
+
+# magic, report size, mtime (ns), sha256 of the report, check-in range as
+# date ordinals, number of GRIN codes, and length of the barcode index
+HEADER = struct.Struct("<8sQq32sIIQQ")
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+class CacheKey(NamedTuple):
+    """Identity of the parsed report"""
+
+    size: int
+    mtime_ns: int
+    sha256: bytes
+
+
+class GrinReport(NamedTuple):
+    """Results of parsing GRIN report"""
+
+    rejected: BarcodeIndex
+    codes: Counter
+    checkin_range: tuple[datetime.date, datetime.date]
+
+
+def cache_fh(fh: Path) -> Path:
+    return fh.with_name(fh.name + CACHE_SUFFIX)
+
+
+def file_sha256(fh: Path) -> bytes:
+    sha256 = hashlib.sha256()
+    with open(fh, "rb") as f:
+        while chunk := f.read(HASH_BUFFER_SIZE):
+            sha256.update(chunk)
+    return sha256.digest()
+
+
+def cache_key(fh: Path) -> CacheKey:
+    """
+    Determines cache key of the report. Taken before the report is parsed.
+
+    Args:
+        fh:             path to GRIN report
+    """
+    stat = fh.stat()
+    return CacheKey(stat.st_size, stat.st_mtime_ns, file_sha256(fh))
+
+
+def read_cache(fh: Path) -> Optional[GrinReport]:
+    """
+    Loads parsed report from its cache.
+
+    Args:
+        fh:             path to GRIN report
+
+    Returns:
+        `GrinReport` instance or None if there is no valid cache of the report
+    """
+    try:
+        with open(cache_fh(fh), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    header = HEADER.unpack_from(data)
+    magic, size, mtime_ns, sha256, start, end, codes_no, index_len = header
+    stat = fh.stat()
+    if magic != MAGIC or size != stat.st_size:
+        return None
+    if mtime_ns != stat.st_mtime_ns:
+        # the report may have been touched or copied without changes
+        if sha256 != file_sha256(fh):
+            return None
+        try:
+            with open(cache_fh(fh), "r+b") as f:
+                f.write(HEADER.pack(*header[:2], stat.st_mtime_ns, *header[3:]))
+        except OSError as exc:
+            # the cache is still valid, it is only verified again next time
+            warnings.warn(f"Could not refresh cache of GRIN report {fh}: {exc}")
+
+    view = memoryview(data)[HEADER.size :]  # noqa: E203
+    rejected = BarcodeIndex.from_bytes(view[:index_len])
+    counts = array_from_bytes("Q", view[index_len:], codes_no)
+    names = bytes(view[index_len + codes_no * 8 :]).decode("utf-8")  # noqa: E203
+    codes = Counter(dict(zip(names.split("\n") if codes_no else (), counts)))
+    return GrinReport(
+        rejected,
+        codes,
+        (datetime.date.fromordinal(start), datetime.date.fromordinal(end)),
+    )
+
+
+def write_cache(fh: Path, report: GrinReport, key: CacheKey) -> None:
+    """
+    Saves parsed report to its cache. The cache is replaced atomically.
+
+    Args:
+        fh:             path to GRIN report
+        report:         parsed report
+        key:            cache key of the report taken before it was parsed
+    """
+    index = report.rejected.to_bytes()
+    start, end = report.checkin_range
+    data = (
+        HEADER.pack(
+            MAGIC,
+            key.size,
+            key.mtime_ns,
+            key.sha256,
+            start.toordinal(),
+            end.toordinal(),
+            len(report.codes),
+            len(index),
+        )
+        + index
+        + array_to_bytes(array("Q", report.codes.values()))
+        + "\n".join(report.codes).encode("utf-8")
+    )
+    atomic_write(cache_fh(fh), data, f"Could not cache GRIN report {fh}")
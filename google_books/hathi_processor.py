@@ -1,15 +1,46 @@
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import csv
 import datetime
-import os
+from itertools import chain
 from pathlib import Path
-
-from google_books.marc_manipulator import marcxml_reader, save2marcxml
-from google_books.utils import save2csv, shipment_date_obj, timestamp_str2date
+import re
+from typing import Container, Iterable, Iterator, NamedTuple, Optional, Union
+
+from pymarc import Record
+
+from google_books.barcode_index import BarcodeIndex
+from google_books.grin_cache import GrinReport, cache_key, read_cache, write_cache
+from google_books.marc_manipulator import (
+    RawMarcxmlReader,
+    RawMarcxmlRecord,
+    marcxml_datafields,
+    marcxml_reader,
+    save2marcxml,
+    save_raw_marcxml,
+    write_raw_stub_records,
+    write_stub_records,
+)
+from google_books.metrics import PipelineMetrics, file_size
+from google_books.status_store import StatusRow, StatusStore
+from google_books.utils import (
+    WRITE_BUFFER_SIZE,
+    CSVSink,
+    shipment_date_obj,
+    timestamp_str2date,
+)
 
 from google_books.errors import GoogleBooksToolError
 
 
+READ_BUFFER_SIZE = 1024 * 1024
+
+# first five characters of a Zephir report line that carries a message
+ZEPHIR_MESSAGE_KINDS = {"INFO:": "info", "WARNI": "warning", "ERROR": "error"}
+
+SHIPMENT_DIR_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})_(\w+)$")
+
+
 def available_for_download(row: list[str]) -> bool:
     """
     Checks if the item is marked as NOT_AVAILABLE_FOR_DOWNLOAD in the GRIN report.
@@ -22,7 +53,10 @@ def available_for_download(row: list[str]) -> bool:
 
 
 def clean_metadata_for_hathi_submission(
-    shipment_date: str, mat_source: str
+    shipment_date: str,
+    mat_source: str,
+    rejected_barcodes: Optional[Container[str]] = None,
+    raw: bool = True,
 ) -> tuple[int, int, int]:
     """
     Using GRIN's not scanned report removes from a given metadata file records
@@ -31,6 +65,13 @@ def clean_metadata_for_hathi_submission(
     Args:
         shipment_date:      date in the format YYYYMMDD
         mat_source:         source of the material (e.g. onsite, recap)
+        rejected_barcodes:  optional already parsed barcodes of rejected items;
+                            GRIN report is parsed when not given
+        raw:                copy kept records byte for byte from the shipment
+                            file; when False records are parsed and written
+                            again with pymarc, which is slower but does not
+                            rely on the light scan of the MARCXML, e.g. to
+                            cross-check the output
 
     Returns:
         tuple with number of saved records, number of rejected records, and file size
@@ -40,24 +81,195 @@ def clean_metadata_for_hathi_submission(
     grin_report = get_grin_report(date, mat_source)
     out = get_hathi_meta_destination(date, mat_source)
 
-    rejected_barcodes = google_reconciliation_to_barcodes_lst(grin_report)
-    rejected_count = 0
-    bibs = marcxml_reader(str(marcxml))
+    metrics = PipelineMetrics(
+        "clean_metadata_for_hathi_submission",
+        shipment_date=f"{date}",
+        mat_source=mat_source,
+    )
+    with metrics.timed("read") as read:
+        if rejected_barcodes is None:
+            rejected_barcodes = get_rejected_barcodes(grin_report)
+            read.bytes_read = file_size(grin_report)
+    read.bytes_read += file_size(marcxml)
+    stats = Counter()  # type: ignore
+    if raw:
+        with RawMarcxmlReader(marcxml) as reader:
+            bibs2keep = metrics.meter(
+                "filter",
+                filter_rejected_raw_items(
+                    metrics.meter("read", reader), rejected_barcodes, stats
+                ),
+            )
+            with metrics.timed("write") as write:
+                out_size = save_raw_marcxml(out, reader, bibs2keep)
+    else:
+        bibs = metrics.meter(
+            "filter",
+            filter_rejected_items(
+                metrics.meter("read", marcxml_reader(str(marcxml))),
+                rejected_barcodes,
+                stats,
+            ),
+        )
+        with metrics.timed("write") as write:
+            out_size = save2marcxml(out, bibs)
+    write.records, write.bytes_written = stats["saved"], out_size
+    metrics.save(out.parent)
+    return (stats["saved"], stats["rejected"], out_size)
+
+
+def clean_metadata_and_create_stubs(
+    shipment_date: str,
+    mat_source: str,
+    stubs_fh: Path,
+    rejected_barcodes: Optional[Container[str]] = None,
+    invalid_bibs: Container[str] = (),
+    raw: bool = True,
+) -> tuple[int, int, int, int]:
+    """
+    Does the work of `clean_metadata_for_hathi_submission` and
+    `create_stub_hathi_records` in a single pass over the shipment MARCXML.
+    Records with items going forward are written to the submission file and
+    their stub records with HathiTrust URLs to MARC21 file.
+
+    Args:
+        shipment_date:      date in the format YYYYMMDD
+        mat_source:         source of the material (e.g. onsite, recap)
+        stubs_fh:           `pathlib.Path` path of MARC21 file of stub records;
+                            overwritten if it exists
+        rejected_barcodes:  optional already parsed barcodes of rejected items;
+                            GRIN report is parsed when not given
+        invalid_bibs:       optional bib #s rejected by Zephir to create no
+                            stub records for
+        raw:                copy kept records byte for byte from the shipment
+                            file; when False records are parsed and written
+                            again with pymarc (see
+                            `clean_metadata_for_hathi_submission`)
+
+    Returns:
+        tuple with number of saved records, number of rejected records, file size,
+        and number of stub records
+    """
+    date = shipment_date_obj(shipment_date)
+    marcxml = get_marcxml(date, mat_source)
+    grin_report = get_grin_report(date, mat_source)
+    out = get_hathi_meta_destination(date, mat_source)
 
-    bibs2keep = []
+    metrics = PipelineMetrics(
+        "clean_metadata_and_create_stubs",
+        shipment_date=f"{date}",
+        mat_source=mat_source,
+    )
+    with metrics.timed("read") as read:
+        if rejected_barcodes is None:
+            rejected_barcodes = get_rejected_barcodes(grin_report)
+            read.bytes_read = file_size(grin_report)
+    read.bytes_read += file_size(marcxml)
+    stats = Counter()  # type: ignore
+    with (
+        open(stubs_fh, "wb", buffering=WRITE_BUFFER_SIZE) as stubs,
+        metrics.timed("write") as write,
+    ):
+        if raw:
+            with RawMarcxmlReader(marcxml) as reader:
+                records = metrics.meter(
+                    "transform",
+                    write_raw_stub_records(
+                        metrics.meter(
+                            "filter",
+                            filter_rejected_raw_items(
+                                metrics.meter("read", reader), rejected_barcodes, stats
+                            ),
+                        ),
+                        reader,
+                        stubs,
+                        invalid_bibs,
+                        stats,
+                    ),
+                )
+                out_size = save_raw_marcxml(out, reader, records)
+        else:
+            bibs = metrics.meter(
+                "transform",
+                write_stub_records(
+                    metrics.meter(
+                        "filter",
+                        filter_rejected_items(
+                            metrics.meter("read", marcxml_reader(str(marcxml))),
+                            rejected_barcodes,
+                            stats,
+                        ),
+                    ),
+                    stubs,
+                    invalid_bibs,
+                    stats,
+                ),
+            )
+            out_size = save2marcxml(out, bibs)
+    write.records = stats["saved"] + stats["stubs"]
+    write.bytes_written = out_size + file_size(stubs_fh)
+    metrics.save(out.parent)
+    return (stats["saved"], stats["rejected"], out_size, stats["stubs"])
+
+
+def filter_rejected_items(
+    bibs: Iterable[Record], rejected_barcodes: Container[str], stats: Counter
+) -> Iterator[Record]:
+    """
+    Lazily filters out items rejected by Google. A record is passed on once
+    for each of its 945 items that was not rejected. Used when records are
+    parsed with pymarc instead of being copied (see `filter_rejected_raw_items`).
+
+    Args:
+        bibs:               iterable of `pymarc.Record` instances
+        rejected_barcodes:  barcodes of items rejected by Google
+        stats:              `Counter` updated with number of saved and rejected
+                            items
+
+    Yields:
+        `pymarc.Record` instances to be submitted to Hathi
+    """
     for bib in bibs:
         for field in bib.get_fields("945"):
             try:
                 barcode = field.get("i").strip()
-                if barcode not in rejected_barcodes:
-                    bibs2keep.append(bib)
-                else:
-                    rejected_count += 1
             except AttributeError:
                 continue
+            if barcode not in rejected_barcodes:
+                stats["saved"] += 1
+                yield bib
+            else:
+                stats["rejected"] += 1
+
+
+def filter_rejected_raw_items(
+    records: Iterable[RawMarcxmlRecord],
+    rejected_barcodes: Container[str],
+    stats: Counter,
+) -> Iterator[RawMarcxmlRecord]:
+    """
+    Same as `filter_rejected_items` but for raw MARCXML records. Barcodes
+    (945$i) are found with a light scan of the record, which is not parsed.
 
-    save2marcxml(out, bibs2keep)
-    return (len(bibs2keep), rejected_count, os.path.getsize(out))
+    Args:
+        records:            iterable of raw MARCXML records
+        rejected_barcodes:  barcodes of items rejected by Google
+        stats:              `Counter` updated with number of saved and rejected
+                            items
+
+    Yields:
+        `RawMarcxmlRecord` instances to be submitted to Hathi
+    """
+    for record in records:
+        for subfields in marcxml_datafields(record.data, "945"):
+            barcode = next((value for code, value in subfields if code == "i"), None)
+            if barcode is None:
+                continue
+            if barcode.strip() not in rejected_barcodes:
+                stats["saved"] += 1
+                yield record
+            else:
+                stats["rejected"] += 1
 
 
 def find_bibno(line: str) -> str:
@@ -97,16 +309,16 @@ def get_checkin_range(values: set) -> tuple[datetime.date, datetime.date]:
     return (min(values), max(values))
 
 
-def google_reconciliation_to_barcodes_lst(fh: Path) -> list[str]:
+def parse_grin_report(fh: Path) -> GrinReport:
     """
-    Parses GRIN report of not scanned by Google items and returns a list.
-    The list is deduped.
+    Parses GRIN report of not scanned by Google items.
 
     Args:
         fh:             path to google reconciliation report
 
     Returns:
-        A list of rejected barcodes
+        `GrinReport` with index of rejected barcodes, counts of GRIN codes, and
+        check-in date range
     """
     barcodes = set()
     grin_codes = []
@@ -120,15 +332,57 @@ def google_reconciliation_to_barcodes_lst(fh: Path) -> list[str]:
             grin_codes.append((row[4]))
             checkin_dates.add(timestamp_str2date(row[1]))
 
-    c = Counter(grin_codes)
-    checkin_start, checkin_end = get_checkin_range(checkin_dates)
+    return GrinReport(
+        BarcodeIndex(barcodes), Counter(grin_codes), get_checkin_range(checkin_dates)
+    )
+
+
+def read_grin_report(fh: Path) -> GrinReport:
+    """
+    Returns parsed GRIN report. The report is parsed only if it has changed
+    since it was last parsed, otherwise results are loaded from its cache.
+
+    Args:
+        fh:             path to google reconciliation report
+    """
+    report = read_cache(fh)
+    if report is None:
+        key = cache_key(fh)
+        report = parse_grin_report(fh)
+        write_cache(fh, report, key)
+    return report
+
+
+def get_rejected_barcodes(fh: Path) -> BarcodeIndex:
+    """
+    Prints summary of GRIN report and returns index of rejected barcodes.
+
+    Args:
+        fh:             path to google reconciliation report
+    """
+    report = read_grin_report(fh)
+    checkin_start, checkin_end = report.checkin_range
     print(
         f"Most common scanning problems during period from {checkin_start} to "
-        f"{checkin_end} (total not scanned={len(barcodes)}):"
+        f"{checkin_end} (total not scanned={len(report.rejected)}):"
     )
-    for v, n in c.most_common():
+    for v, n in report.codes.most_common():
         print(f"{v} = {n}")
-    return sorted(list(barcodes))
+    return report.rejected
+
+
+def google_reconciliation_to_barcodes_lst(fh: Path) -> list[str]:
+    """
+    Parses GRIN report of not scanned by Google items and returns a list.
+    The list is deduped.
+
+    Args:
+        fh:             path to google reconciliation report
+
+    Returns:
+        A list of rejected barcodes
+    """
+    return list(get_rejected_barcodes(fh))
 
 
 def get_hathi_meta_destination(shipment_date: datetime.date, mat_source: str) -> Path:
@@ -186,6 +440,145 @@ def get_grin_report(shipment_date: datetime.date, mat_source: str) -> Path:
     return Path(f"files/shipments/{shipment_date:%Y-%m-%d}_{mat_source}/_query.txt")
 
 
+class HathiReportPaths(NamedTuple):
+    """Paths of Zephir processing report and reports derived from it"""
+
+    source: Path
+    success: Path
+    invalid_oclc: Path
+    missing_oclc: Path
+    error: Path
+
+    @property
+    def outputs(self) -> tuple[Path, ...]:
+        return self[1:]
+
+    def is_current(self) -> bool:
+        """
+        Checks if all output reports exist and are newer than the Zephir report.
+        """
+        if not all(fh.exists() for fh in self.outputs):
+            return False
+        source_mtime = self.source.stat().st_mtime
+        return all(fh.stat().st_mtime >= source_mtime for fh in self.outputs)
+
+
+class HathiReportSummary(NamedTuple):
+    """Results of parsing a single shipment's Zephir report"""
+
+    shipment_date: datetime.date
+    mat_source: str
+    success: int
+    invalid_oclc: int
+    missing_oclc: int
+    errors: int
+
+
+def get_hathi_report_paths(
+    parent_dir: Union[str, Path], shipment_date: datetime.date, mat_source: str
+) -> HathiReportPaths:
+    """
+    Determines paths of Zephir processing report and derived reports.
+
+    Args:
+        parent_dir:         directory of shipment folders (`files/shipments`)
+        shipment_date:      shipment date as `datetime.date` instance
+        mat_source:         source of the material (e.g. onsite, recap)
+    """
+    date = shipment_date
+    shipment_dir = Path(f"{parent_dir}/{date:%Y-%m-%d}_{mat_source}")
+    return HathiReportPaths(
+        shipment_dir / f"nyp_{date:%Y%m%d}_google_{mat_source}.txt",
+        shipment_dir / f"hathi-{date:%Y%m%d}-success.csv",
+        shipment_dir / f"hathi-{date:%Y%m%d}-unspecified-oclc.csv",
+        shipment_dir / f"hathi-{date:%Y%m%d}-missing-oclc.csv",
+        shipment_dir / f"hathi-{date:%Y%m%d}-errors.csv",
+    )
+
+
+def find_hathi_reports(
+    parent_dir: Union[str, Path],
+) -> Iterator[tuple[datetime.date, str, HathiReportPaths]]:
+    """
+    Finds `YYYY-MM-DD_<source>` shipment folders that include Zephir report.
+
+    Args:
+        parent_dir:         directory of shipment folders (`files/shipments`)
+
+    Yields:
+        tuples of shipment date, material source, and report paths
+    """
+    for shipment_dir in sorted(Path(parent_dir).iterdir()):
+        match = SHIPMENT_DIR_PATTERN.match(shipment_dir.name)
+        if not shipment_dir.is_dir() or not match:
+            continue
+        try:
+            date = datetime.date.fromisoformat(match.group(1))
+        except ValueError:
+            continue
+        mat_source = match.group(2)
+        paths = get_hathi_report_paths(parent_dir, date, mat_source)
+        if paths.source.exists():
+            yield (date, mat_source, paths)
+
+
+def run_hathi_report(
+    job: tuple[datetime.date, str, HathiReportPaths, Optional[str]],
+) -> HathiReportSummary:
+    """
+    Parses single shipment's Zephir report. Runs in a worker process of
+    `batch_parse_hathi_processing_reports`.
+
+    Args:
+        job:                tuple of shipment date, material source, report
+                            paths, and optional path to the status store
+    """
+    date, mat_source, paths, db = job
+    store = StatusStore(db) if db else None
+    try:
+        results = parse_hathi_processing_report(date, mat_source, *paths, store)
+    finally:
+        if store is not None:
+            store.close()
+    return HathiReportSummary(date, mat_source, *results)
+
+
+def batch_parse_hathi_processing_reports(
+    parent_dir: Union[str, Path],
+    workers: int = 1,
+    skip_current: bool = True,
+    db: Optional[str] = None,
+) -> tuple[list[HathiReportSummary], int]:
+    """
+    Parses Zephir reports of all shipment folders in a pool of processes.
+
+    Args:
+        parent_dir:         directory of shipment folders (`files/shipments`)
+        workers:            number of processes
+        skip_current:       skip shipments whose reports are newer than
+                            the Zephir report
+        db:                 optional path to the status store
+
+    Returns:
+        tuple of list of summaries ordered by shipment and number of skipped
+        shipments
+    """
+    jobs = []
+    skipped = 0
+    for date, mat_source, paths in find_hathi_reports(parent_dir):
+        if skip_current and paths.is_current():
+            skipped += 1
+        else:
+            jobs.append((date, mat_source, paths, db))
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            summaries = list(pool.map(run_hathi_report, jobs))
+    else:
+        summaries = [run_hathi_report(job) for job in jobs]
+    return (summaries, skipped)
+
+
 def parse_hathi_processing_report(
     date: datetime.date,
     mat_source: str,
@@ -194,6 +587,7 @@ def parse_hathi_processing_report(
     invalid_oclc_fh: Path,
     missing_oclc_fh: Path,
     error_fh: Path,
+    store: Optional[StatusStore] = None,
 ) -> tuple[int, int, int, int]:
     """
     Parses Hathi job report and filters the results into three separate
@@ -207,6 +601,7 @@ def parse_hathi_processing_report(
         invalid_oclc_fh:    path for invalid location of OCLC # report
         missing_oclc_fh:    path for missing OCLC # report
         error_fh:           path for error report
+        store:              optional `StatusStore` to record results in
 
     Returns:
         report statistics as tuple: success, invalid OCLC location, missing OCLC #,
@@ -214,59 +609,72 @@ def parse_hathi_processing_report(
     """
     success_count = 0
     invalid_oclc_loc = set()
-    invalid_oclc_count = 0
     missing_oclc = set()
-    missing_oclc_count = 0
     error_bibs = set()
-    error_count = 0
-
-    with open(source_fh, "r") as file:
-        for line in file.readlines():
-            if "new cid =" in line:
-                cid = find_cid(line)
-                save2csv(success_fh, ",", [cid])
-                success_count += 1
-            elif line.startswith("WARNING: .b"):
-                bibno = find_bibno(line)
-                if "OCLC number found in unspecified 035$" in line:
-                    invalid_oclc_count += 1
-                    invalid_oclc_loc.add(bibno)
-                elif "no OCLC number in record" in line:
-                    missing_oclc_count += 1
-                    missing_oclc.add(bibno)
-            elif line.startswith("ERROR"):
-                error_count += 1
-                bibno = find_bibno(line)
-                err_msg = find_err_msg(line)
-                error_bibs.add((bibno, err_msg))
+    success_cids = []
+
+    with (
+        open(source_fh, "r", buffering=READ_BUFFER_SIZE) as file,
+        CSVSink(success_fh, ",", mode="w") as success,
+    ):
+        success.open()  # create the report even if there are no rows
+        for line in file:
+            kind = ZEPHIR_MESSAGE_KINDS.get(line[:5])
+            if kind is None:
+                continue
+            elif kind == "info":
+                if "new cid =" in line:
+                    cid = find_cid(line)
+                    success.writerow([cid])
+                    success_count += 1
+                    if store is not None:
+                        success_cids.append(cid)
+            elif kind == "warning":
+                if line.startswith("WARNING: .b"):
+                    if "OCLC number found in unspecified 035$" in line:
+                        invalid_oclc_loc.add(find_bibno(line))
+                    elif "no OCLC number in record" in line:
+                        missing_oclc.add(find_bibno(line))
+            else:
+                error_bibs.add((find_bibno(line), find_err_msg(line)))
 
     # save results
-    data = list(invalid_oclc_loc)
-    with invalid_oclc_fh.open("w", newline="\n") as inv_fh:
-        writer = csv.writer(inv_fh)
-        for bibno in sorted(data):
-            writer.writerow([bibno])
-
-    data = list(missing_oclc)
-    with missing_oclc_fh.open("w", newline="\n") as mis_fh:
-        writer = csv.writer(mis_fh)
-        for bibno in sorted(data):
-            writer.writerow([bibno])
-
-    data = list(error_bibs)
-    with error_fh.open("w", newline="\n") as err_fh:
-        writer = csv.writer(err_fh)
-        for row in sorted(data):
-            writer.writerow(
+    for fh, rows in (
+        (invalid_oclc_fh, ([bibno] for bibno in sorted(invalid_oclc_loc))),
+        (missing_oclc_fh, ([bibno] for bibno in sorted(missing_oclc))),
+        (
+            error_fh,
+            (
                 [
-                    row[0],
+                    bibno,
                     f"{date}",
                     "Zephir validation",
                     f"nyp_{date}_google_{mat_source}.xml",
-                    row[1],
+                    err_msg,
                     "NO",
                 ]
-            )
+                for bibno, err_msg in sorted(error_bibs)
+            ),
+        ),
+    ):
+        # Zephir based reports use default `csv` dialect
+        with CSVSink(
+            fh, mode="w", newline="\n", quotechar='"', lineterminator="\r\n"
+        ) as sink:
+            sink.open()  # create the report even if there are no rows
+            sink.writerows(rows)
+
+    if store is not None:
+        store.upsert(
+            date,
+            mat_source,
+            chain(
+                (StatusRow("success", cid=cid) for cid in success_cids),
+                (StatusRow("unspecified-oclc", bibno=b) for b in invalid_oclc_loc),
+                (StatusRow("missing-oclc", bibno=b) for b in missing_oclc),
+                (StatusRow("error", bibno=b, message=m) for b, m in error_bibs),
+            ),
+        )
 
     return (success_count, len(invalid_oclc_loc), len(missing_oclc), len(error_bibs))
 
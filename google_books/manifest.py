@@ -5,8 +5,9 @@ Onsite & ReCAP manifest manipulation scripts
 import csv
 from pathlib import Path
 
+from google_books.metrics import PipelineMetrics, file_size
 from google_books.utils import (
-    save2csv,
+    CSVSink,
     get_directory,
     shipment_date_obj,
 )
@@ -25,13 +26,23 @@ def prep_onsite_manifest_for_google(shipment_date: str) -> Path:
     source_path = shipment_directory / f"SierraExportManifest_{date:%Y%m%d.txt}"
     out_path = shipment_directory / f"NYPL_{date:%Y%m%d}.txt"
 
-    with source_path.open("r") as csvfile:
+    metrics = PipelineMetrics(
+        "prep_onsite_manifest_for_google", shipment_date=f"{date}", mat_source="onsite"
+    )
+    out_size = file_size(out_path)
+    with (
+        source_path.open("r") as csvfile,
+        CSVSink(out_path, "\t") as sink,
+        metrics.timed("write") as write,
+    ):
         data = csv.reader(csvfile, delimiter="\t")
         next(data)  # skip the header
-        for row in data:
+        for row in metrics.meter("read", data):
             cart = row[0].split(" ")[-1]
             barcode = row[1]
-            save2csv(out_path, "\t", [cart, barcode])
+            sink.writerow([cart, barcode])
+        write.records = sink.rows_written
+    save_manifest_metrics(metrics, source_path, out_path, out_size)
     return out_path
 
 
@@ -52,9 +63,38 @@ def prep_recap_manifest_for_sierra_list(shipment_date: str) -> Path:
     out_path = Path(shipment_directory).joinpath(
         f"google-recap-barcodes-{date:%Y%m%d}.csv"
     )
-    with source_fh.open("r") as csvfile:
+    metrics = PipelineMetrics(
+        "prep_recap_manifest_for_sierra_list",
+        shipment_date=f"{date}",
+        mat_source="recap",
+    )
+    out_size = file_size(out_path)
+    with (
+        source_fh.open("r") as csvfile,
+        CSVSink(out_path, ",") as sink,
+        metrics.timed("write") as write,
+    ):
         manifest = csv.reader(csvfile, delimiter="\t")
-        for row in manifest:
+        for row in metrics.meter("read", manifest):
             barcode = row[1]
-            save2csv(out_path, ",", [barcode])
+            sink.writerow([barcode])
+        write.records = sink.rows_written
+    save_manifest_metrics(metrics, source_fh, out_path, out_size)
     return out_path
+
+
+def save_manifest_metrics(
+    metrics: PipelineMetrics, source_fh: Path, out_path: Path, out_size: int
+) -> None:
+    """
+    Saves metrics of manifest prep to the shipment directory.
+
+    Args:
+        metrics:        metrics of the manifest prep
+        source_fh:      path to the manifest
+        out_path:       path to the output file the rows were appended to
+        out_size:       size of the output file before the rows were appended
+    """
+    metrics.stage("read").bytes_read = file_size(source_fh)
+    metrics.stage("write").bytes_written = file_size(out_path) - out_size
+    metrics.save(out_path.parent)
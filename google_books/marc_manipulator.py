@@ -1,27 +1,303 @@
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import html
+from itertools import chain
+import mmap
+import os
 from pathlib import Path
-from typing import Optional, Iterator, Union
+import re
+from types import TracebackType
+from typing import (
+    BinaryIO,
+    Container,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Iterator,
+    Union,
+    cast,
+)
 import warnings
+import xml.etree.ElementTree as ET
 
-from pymarc import MARCReader, Record, Field, Subfield, XMLWriter, parse_xml_to_array
+from pymarc import Indicators, Leader, MARCReader, Record, Field, Subfield
+from pymarc.marcxml import record_to_xml_node
 
-from google_books.utils import fh_date
+from google_books.errors import GoogleBooksToolError
+from google_books.metrics import PipelineMetrics, file_size
+from google_books.status_store import StatusRow, StatusStore
+from google_books.utils import WRITE_BUFFER_SIZE, fh_date
 
 
-def manipulate_records(source_fh: str) -> None:
+MARCXML_HEADER = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<collection xmlns="http://www.loc.gov/MARC21/slim">'
+)
+MARCXML_FOOTER = b"</collection>"
+
+# MARCXML elements found in raw bytes, with or without namespace prefix
+MARCXML_RECORD_START = re.compile(rb"<(?:[\w.-]+:)?record[\s>]")
+MARCXML_RECORD_END = re.compile(rb"</(?:[\w.-]+:)?record\s*>")
+MARCXML_DATAFIELD = re.compile(
+    rb"<(?:[\w.-]+:)?datafield\s[^>]*?\btag=([\"'])([^\"']*)\1[^>]*?"
+    rb"(?:/>|>(.*?)</(?:[\w.-]+:)?datafield\s*>)",
+    re.S,
+)
+MARCXML_SUBFIELD = re.compile(
+    rb"<(?:[\w.-]+:)?subfield\s[^>]*?\bcode=([\"'])([^\"']*)\1[^>]*?"
+    rb"(?:/>|>(.*?)</(?:[\w.-]+:)?subfield\s*>)",
+    re.S,
+)
+
+HATHI_URL = "http://hdl.handle.net/2027/nyp."
+HATHI_URL_NOTE = "Content available via HathiTrust"
+
+# fields removed from records with OCLC # moved to the control field
+OCLC_FIX_REMOVED_TAGS = (
+    "001",
+    "003",
+    "852",
+    "907",
+    "910",
+    "945",
+    "949",
+    "991",
+    "997",
+    "959",
+    "998",
+)
+RAW_REMOVED_TAGS = frozenset(tag.encode("ascii") for tag in OCLC_FIX_REMOVED_TAGS)
+
+# raw data fields pymarc would not encode back to the same bytes: empty
+# subfields and non-ASCII subfield codes (UTF-8), or anything but printable
+# ASCII (MARC-8, which is converted to UTF-8)
+RAW_UTF8_ANOMALY = re.compile(rb"\x1f(?:[\x1f\x80-\xff]|\Z)")
+RAW_MARC8_ANOMALY = re.compile(rb"[^\x1f\x20-\x7e]|\x1f(?:\x1f|\Z)")
+
+
+def manipulate_records(source_fh: str, workers: int = 1, raw: bool = True) -> None:
     """
     Reads given MARC file and replaces 001 & 003 to indicate OCLC control number
     based on present identifier in 035 or 991.
     Deletes 991 if present.
+
+    Args:
+        source_fh:              path to MARC21 file
+        workers:                number of processes to fix records in; records
+                                are output in their original order
+        raw:                    fix records without decoding them when possible;
+                                when False all records are decoded by pymarc,
+                                which is slower but useful for cross-checking
     """
     date = fh_date(source_fh)
     fh_out = f"files/out/hathi-{date}-fixed-oclc.mrc"
-    for n, bib in get_bibs(source_fh):
-        msg = fix_oclc_info(bib)
-        if msg:
-            with open(fh_out, "ab") as out:
-                out.write(bib.as_marc())
-            print(f"{msg} (record {n})")
+    metrics = PipelineMetrics("manipulate_records", workers=workers)
+    if workers > 1:
+        results = fix_oclc_records_parallel(source_fh, workers, raw=raw)
+    else:
+        results = fix_oclc_records(source_fh, raw)
+    with (
+        open(fh_out, "ab", buffering=WRITE_BUFFER_SIZE) as out,
+        metrics.timed("write") as write,
+    ):
+        # records are decoded and fixed in one step (in worker processes
+        # when `workers` > 1), so reading is included in transform
+        for n, msg, data in metrics.meter("transform", results):
+            if msg:
+                write.bytes_written += out.write(data)  # type: ignore
+                write.records += 1
+                print(f"{msg} (record {n})")
+    metrics.stage("transform").bytes_read = file_size(source_fh)
+    metrics.save(Path(fh_out).parent)
+
+
+def fix_oclc_records(
+    source_fh: str, raw: bool = True
+) -> Iterator[tuple[int, Optional[str], Optional[bytes]]]:
+    """
+    Runs `fix_oclc_record` (or `fix_oclc_info`) on each record of given MARC file.
+
+    Args:
+        source_fh:              path to MARC21 file
+        raw:                    fix records without decoding them when possible
+
+    Yields:
+        tuples of record sequence number, processing message, and manipulated
+        record as MARC21 bytes (None if record was not manipulated)
+    """
+    if not raw:
+        for n, bib in get_bibs(source_fh):
+            msg = fix_oclc_info(bib)
+            yield (n, msg, bib.as_marc() if msg else None)
+        return
+    with open(source_fh, "rb") as marcfile:
+        for start, batch in batched_marc_records(marcfile, 1000):
+            for n, data in enumerate(batch, start=start):
+                yield (n, *fix_oclc_record(data))
+
+
+def fix_oclc_records_parallel(
+    source_fh: str, workers: int, batch_size: int = 1000, raw: bool = True
+) -> Iterator[tuple[int, Optional[str], Optional[bytes]]]:
+    """
+    Same as `fix_oclc_records` but splits the file on record boundaries into
+    batches processed in a pool of processes. Results are yielded in the
+    original order. Warnings raised by workers are re-emitted.
+
+    Args:
+        source_fh:              path to MARC21 file
+        workers:                number of processes
+        batch_size:             number of records sent to a process at once
+        raw:                    fix records without decoding them when possible
+
+    Yields:
+        tuples of record sequence number, processing message, and manipulated
+        record as MARC21 bytes (None if record was not manipulated)
+    """
+    with open(source_fh, "rb") as marcfile:
+        batches = batched_marc_records(marcfile, batch_size)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending: deque = deque()
+            for batch in batches:
+                pending.append(pool.submit(fix_oclc_batch, batch, raw))
+                if len(pending) >= workers * 2:
+                    yield from unpack_batch_results(pending.popleft().result())
+            while pending:
+                yield from unpack_batch_results(pending.popleft().result())
+
+
+def unpack_batch_results(
+    results: list[tuple[int, Optional[str], Optional[bytes], list[str]]],
+) -> Iterator[tuple[int, Optional[str], Optional[bytes]]]:
+    for n, msg, data, messages in results:
+        for message in messages:
+            warnings.warn(message)
+        yield (n, msg, data)
+
+
+def fix_oclc_batch(
+    batch: tuple[int, list[bytes]], raw: bool = True
+) -> list[tuple[int, Optional[str], Optional[bytes], list[str]]]:
+    """
+    Decodes and fixes a batch of raw MARC21 records. Runs in a worker process.
+
+    Args:
+        batch:                  tuple of sequence number of the first record in
+                                the batch and list of raw records
+        raw:                    fix records without decoding them when possible
+
+    Returns:
+        list of tuples of record sequence number, processing message, manipulated
+        record as MARC21 bytes, and raised warning messages
+    """
+    start, records = batch
+    results = []
+    for n, data in enumerate(records, start=start):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            if raw:
+                msg, out = fix_oclc_record(data)
+            else:
+                bib = Record(data, hide_utf8_warnings=True)
+                msg = fix_oclc_info(bib)
+                out = bib.as_marc() if msg else None
+        results.append((n, msg, out, [str(w.message) for w in caught]))
+    return results
+
+
+def batched_marc_records(
+    marcfile: BinaryIO, batch_size: int
+) -> Iterator[tuple[int, list[bytes]]]:
+    """
+    Splits MARC21 file into batches of raw records using record length
+    encoded in the first five bytes of the leader.
+
+    Args:
+        marcfile:               MARC21 file opened in binary mode
+        batch_size:             number of records in a batch
+
+    Yields:
+        tuples of sequence number of the first record in the batch and list of
+        raw records
+    """
+    start = 1
+    batch: list[bytes] = []
+    while first5 := marcfile.read(5):
+        if not first5.isdigit():
+            raise GoogleBooksToolError(
+                f"Error. Invalid record length in record {start + len(batch)}."
+            )
+        batch.append(first5 + marcfile.read(int(first5) - 5))
+        if len(batch) == batch_size:
+            yield (start, batch)
+            start += batch_size
+            batch = []
+    if batch:
+        yield (start, batch)
+
+
+class RawRecord(NamedTuple):
+    """Raw MARC21 record in a memory-mapped file"""
+
+    n: int
+    offset: int
+    data: memoryview
+
+    def as_record(self) -> Record:
+        """Decodes the record into `pymarc.Record`."""
+        return Record(bytes(self.data), hide_utf8_warnings=True)
+
+
+def mmap_marc_records(source_fh: Union[str, Path]) -> Iterator[RawRecord]:
+    """
+    Walks memory-mapped MARC21 file by record length encoded in the first five
+    bytes of the leader. Records are not copied nor decoded, so counting,
+    filtering, or copying them to another file costs no more than the I/O.
+
+    A record with invalid length (not a number, not ending with the end of
+    record byte) is skipped with a warning up to the next end of record byte,
+    where the following record starts.
+
+    Slices of the file are valid only until the iteration is over. A slice
+    kept longer keeps the file mapped; use `bytes(record.data)` to keep a copy.
+
+    Args:
+        source_fh:              path to MARC21 file
+
+    Yields:
+        `RawRecord` tuples of record sequence number, byte offset of the
+        record, and the record as `memoryview` slice of the file
+    """
+    with open(source_fh, "rb") as marcfile:
+        if not os.fstat(marcfile.fileno()).st_size:
+            return
+        mm = mmap.mmap(marcfile.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    size = len(mm)
+    offset = 0
+    n = 0
+    try:
+        while offset < size:
+            n += 1
+            first5 = mm[offset : offset + 5]  # noqa: E203
+            end = offset + int(first5) if first5.isdigit() else 0
+            if end <= offset + 24 or end > size or mm[end - 1] != 0x1D:
+                terminator = mm.find(b"\x1d", offset)
+                end = size if terminator == -1 else terminator + 1
+                warnings.warn(
+                    f"Skipping record {n} with invalid length at byte {offset}."
+                )
+            else:
+                yield RawRecord(n, offset, view[offset:end])
+            offset = end
+    finally:
+        view.release()
+        try:
+            mm.close()
+        except BufferError:
+            # slices still referenced by the caller keep the file mapped
+            pass
 
 
 def get_bibs(source_fh: str) -> Iterator[tuple[int, Record]]:
@@ -64,9 +340,7 @@ def fix_oclc_info(bib: Record) -> Optional[str]:
     oclcno = find_oclcno(bib)
     bibno = bib["907"]["a"]
     if oclcno:
-        bib.remove_fields(
-            "001", "003", "852", "907", "910", "945", "949", "991", "997", "959", "998"
-        )
+        bib.remove_fields(*OCLC_FIX_REMOVED_TAGS)
         bib.add_ordered_field(Field(tag="001", data=oclcno))
         bib.add_ordered_field(Field(tag="003", data="OCoLC"))
         bib.add_ordered_field(
@@ -86,6 +360,205 @@ def fix_oclc_info(bib: Record) -> Optional[str]:
         return None
 
 
+def fix_oclc_record(data: bytes) -> tuple[Optional[str], Optional[bytes]]:
+    """
+    Fixes OCLC data of a raw MARC21 record. Records are fixed without being
+    decoded by `fix_oclc_raw` and fall back to `pymarc.Record` and
+    `fix_oclc_info` when they cannot be safely fixed that way.
+
+    Args:
+        data:                   raw MARC21 record
+
+    Returns:
+        tuple of processing message and manipulated record as MARC21 bytes
+        (None if record was not manipulated)
+    """
+    result = fix_oclc_raw(data)
+    if result is None:
+        bib = Record(data, hide_utf8_warnings=True)
+        msg = fix_oclc_info(bib)
+        result = (msg, bib.as_marc() if msg else None)
+    return result
+
+
+def fix_oclc_raw(data: bytes) -> Optional[tuple[Optional[str], Optional[bytes]]]:
+    """
+    Same as `fix_oclc_info` but works on raw MARC21 record. Only the leader and
+    directory are parsed and only 035, 991, & 907 data are decoded. The record
+    is rebuilt from raw data of kept fields and is the same as
+    `pymarc.Record.as_marc` outputs after `fix_oclc_info`.
+
+    Args:
+        data:                   raw MARC21 record
+
+    Returns:
+        tuple of processing message and manipulated record as MARC21 bytes
+        (None if record was not manipulated), or None if the record has to be
+        decoded by pymarc to be fixed (malformed, MARC-8 with other than
+        printable ASCII characters, or without 907$a)
+    """
+    fields = split_raw_record(data)
+    if fields is None:
+        return None
+    marc8 = data[9:10] != b"a"
+    pattern = RAW_MARC8_ANOMALY if marc8 else RAW_UTF8_ANOMALY
+    for tag, value in fields:
+        if tag < b"010" and tag.isdigit():
+            if marc8 and not value.isascii():
+                return None
+        elif (
+            len(value) < 2
+            or not value[:2].isascii()
+            or b"\x1f" in value[:2]
+            or value[2:3] not in (b"", b"\x1f")
+            or pattern.search(value, 2)
+        ):
+            return None
+
+    try:
+        # bib # comes from the first 907 only
+        t907 = [field for field in fields if field[0] == b"907"][:1]
+        bibno = next(raw_subfields(t907, b"907", b"a"), None)
+        if bibno is None:
+            return None
+        candidates = chain(
+            (
+                s[7:].strip()
+                for s in raw_subfields(fields, b"035", b"a")
+                if s.startswith("(OCoLC)")
+            ),
+            (s.strip() for s in raw_subfields(fields, b"991", b"y")),
+        )
+        oclcno = None
+        invalid = []
+        for candidate in candidates:
+            if candidate.isdigit():
+                oclcno = candidate
+                break
+            invalid.append(candidate)
+    except UnicodeDecodeError:
+        return None
+
+    # warnings are raised only once the record is not passed on to pymarc
+    for candidate in invalid:
+        warnings.warn(f"Encountered invalid OCLC #: {candidate}.")
+    if not oclcno:
+        warnings.warn(
+            f"Unable to manipulate bib ({bibno}). No suitable OCLC # was found in bib."
+        )
+        return (None, None)
+
+    kept = [
+        (tag, value + b"\x1e") for tag, value in fields if tag not in RAW_REMOVED_TAGS
+    ]
+    for tag, value in (
+        (b"001", oclcno.encode("utf-8")),
+        (b"003", b"OCoLC"),
+        (b"945", b"  \x1fa" + bibno.encode("utf-8")),
+        (b"949", b"  \x1fa*bn=xxx;"),
+    ):
+        add_ordered_raw_field(kept, tag, value + b"\x1e")
+    return (f"Processed bib {bibno}", encode_raw_record(data[:24], kept))
+
+
+def split_raw_record(data: bytes) -> Optional[list[tuple[bytes, bytes]]]:
+    """
+    Splits raw MARC21 record into fields using its directory.
+
+    Args:
+        data:                   raw MARC21 record
+
+    Returns:
+        list of tuples of tag and field data without the field terminator, or
+        None if the leader or directory is malformed
+    """
+    leader = data[:24]
+    if len(leader) < 24 or not leader.isascii() or data[-1:] != b"\x1d":
+        return None
+    try:
+        base_address = int(leader[12:17])
+    except ValueError:
+        return None
+    directory = data[24 : base_address - 1]  # noqa: E203
+    if not directory or len(directory) % 12 or not directory.isascii():
+        return None
+    fields = []
+    for entry in range(0, len(directory), 12):
+        try:
+            length = int(directory[entry + 3 : entry + 7])  # noqa: E203
+            offset = base_address + int(directory[entry + 7 : entry + 12])  # noqa: E203
+        except ValueError:
+            return None
+        fields.append(
+            (
+                directory[entry : entry + 3],  # noqa: E203
+                data[offset : offset + length - 1],  # noqa: E203
+            )
+        )
+    return fields
+
+
+def raw_subfields(
+    fields: list[tuple[bytes, bytes]], tag: bytes, code: bytes
+) -> Iterator[str]:
+    """
+    Yields decoded values of given subfield of raw fields with given tag.
+    Values of MARC-8 records are expected to be already checked to be printable
+    ASCII, which is the same in UTF-8.
+
+    Raises:
+        UnicodeDecodeError
+    """
+    for field_tag, value in fields:
+        if field_tag == tag:
+            for subfield in value.split(b"\x1f")[1:]:
+                if subfield[:1] == code:
+                    yield subfield[1:].decode("utf-8")
+
+
+def add_ordered_raw_field(
+    fields: list[tuple[bytes, bytes]], tag: bytes, value: bytes
+) -> None:
+    """
+    Inserts raw field before the first field with a greater or non-numeric
+    tag, the same as `pymarc.Record.add_ordered_field` does.
+    """
+    for i, (field_tag, _) in enumerate(fields):
+        if not field_tag.isdigit() or int(field_tag) > int(tag):
+            fields.insert(i, (tag, value))
+            return
+    fields.append((tag, value))
+
+
+def encode_raw_record(leader: bytes, fields: list[tuple[bytes, bytes]]) -> bytes:
+    """
+    Encodes raw fields as UTF-8 MARC21 record, the same as
+    `pymarc.Record.as_marc` does.
+
+    Args:
+        leader:                 leader of the source record
+        fields:                 list of tuples of tag and field data ending
+                                with the field terminator
+    """
+    directory = []
+    offset = 0
+    for tag, value in fields:
+        directory.append(b"%s%04d%05d" % (tag, len(value), offset))
+        offset += len(value)
+    base_address = 24 + 12 * len(fields) + 1
+    record_length = base_address + offset + 1
+    return b"".join(
+        [
+            b"%05d%sa%s%05d%s"
+            % (record_length, leader[5:9], leader[10:12], base_address, leader[17:]),
+            *directory,
+            b"\x1e",
+            *(value for _, value in fields),
+            b"\x1d",
+        ]
+    )
+
+
 def generate_hathi_url(
     barcode: Optional[str], volume: Optional[str]
 ) -> Optional[Field]:
@@ -105,14 +578,14 @@ def generate_hathi_url(
         volume = volume.strip()
 
     if barcode:
-        subfields.append(Subfield("u", f"http://hdl.handle.net/2027/nyp.{barcode}"))
+        subfields.append(Subfield("u", f"{HATHI_URL}{barcode}"))
     else:
         return None
 
     if volume:
-        subfields.append(Subfield("z", f"Content available via HathiTrust--{volume}"))
+        subfields.append(Subfield("z", f"{HATHI_URL_NOTE}--{volume}"))
     else:
-        subfields.append(Subfield("z", "Content available via HathiTrust"))
+        subfields.append(Subfield("z", HATHI_URL_NOTE))
 
     return Field(tag="856", indicators=["4", "1"], subfields=subfields)
 
@@ -133,7 +606,257 @@ def is_item_field(field: Field) -> bool:
             return False
 
 
-def create_stub_hathi_records(submitted_fh: Path, errors_fh: Path, out_fh: Path):
+class StubRecord:
+    """
+    Stub record that includes only LDR, 245, 856, & 907 fields. A lighter
+    alternative to `pymarc.Record` that keeps fields already encoded and
+    serializes to the same MARC21 bytes as `pymarc.Record.as_marc`.
+
+    Args:
+        leader:                 leader of the source record
+        t245:                   245 field of the source record
+        t907:                   907 field of the source record
+    """
+
+    __slots__ = ("leader", "t245", "t907", "t856s")
+
+    def __init__(self, leader: Union[str, Leader], t245: Field, t907: Field) -> None:
+        self.leader = str(leader)
+        self.t245 = t245.as_marc("utf-8")
+        self.t907 = t907.as_marc("utf-8")
+        self.t856s: list[bytes] = []
+
+    def add_hathi_url(self, barcode: Optional[str], volume: Optional[str]) -> bool:
+        """
+        Adds 856 field with HathiTrust URL, the same as `generate_hathi_url`
+        creates.
+
+        Args:
+            barcode:            NYPL RL barcode
+            volume:             value of the 945$c
+
+        Returns:
+            whether the field was added (there is no URL without barcode)
+        """
+        if not barcode:
+            return False
+        if isinstance(volume, str):
+            volume = volume.strip()
+        note = f"{HATHI_URL_NOTE}--{volume}" if volume else HATHI_URL_NOTE
+        self.t856s.append(f"41\x1fu{HATHI_URL}{barcode}\x1fz{note}\x1e".encode("utf-8"))
+        return True
+
+    def as_marc(self) -> bytes:
+        """
+        Encodes the record as MARC21. The directory is built from lengths of
+        the encoded fields and all parts are joined into a single buffer.
+        """
+        t856s = self.t856s
+        # leader, directory of 12 byte entries ending with an end of field
+        base_address = 24 + 12 * (len(t856s) + 2) + 1
+        offset = len(self.t245)
+        directory = [b"245%04d00000" % offset]
+        for data in t856s:
+            directory.append(b"856%04d%05d" % (len(data), offset))
+            offset += len(data)
+        directory.append(b"907%04d%05d\x1e" % (len(self.t907), offset))
+        # field data ends with an end of record
+        record_length = base_address + offset + len(self.t907) + 1
+        leader = self.leader
+        return b"".join(
+            [
+                f"{record_length:05d}{leader[5:9]}a{leader[10:12]}"
+                f"{base_address:05d}{leader[17:]}".encode("utf-8"),
+                *directory,
+                self.t245,
+                *t856s,
+                self.t907,
+                b"\x1d",
+            ]
+        )
+
+
+def make_stub_record(bib: Record) -> tuple[StubRecord, list[str]]:
+    """
+    Creates stub record that includes only LDR, 245, 856, & 907 fields.
+    856 fields with HathiTrust URLs are generated from item 945 fields.
+
+    Args:
+        bib:                    `pymarc.Record` instance submitted to Hathi
+
+    Returns:
+        tuple of stub record and barcodes of items it has HathiTrust URLs for
+    """
+    stub_bib = StubRecord(bib.leader, bib.get("245"), bib.get("907"))  # type: ignore
+    barcodes = []
+
+    # construct 856s with Hathi URLs
+    for f in bib.get_fields("945"):
+        barcode = f.get("i")
+        # there is no URL without barcode
+        if barcode and is_item_field(f) and stub_bib.add_hathi_url(barcode, f.get("c")):
+            barcodes.append(barcode)
+    return (stub_bib, barcodes)
+
+
+def write_stub_records(
+    bibs: Iterable[Record],
+    out: BinaryIO,
+    invalid_bibs: Container[str],
+    stats: Counter,
+) -> Iterator[Record]:
+    """
+    Passes records on unchanged while writing their stub records with
+    HathiTrust URLs to MARC21 file, so stubs are created in the same pass
+    that writes the submission to Hathi.
+
+    Args:
+        bibs:                   iterable of `pymarc.Record` instances
+        out:                    MARC21 file of stub records opened in binary mode
+        invalid_bibs:           bib #s rejected by Zephir
+        stats:                  `Counter` updated with number of stub records
+
+    Yields:
+        `pymarc.Record` instances
+    """
+    for bib in bibs:
+        write_stub_record(bib, out, invalid_bibs, stats)
+        yield bib
+
+
+def write_raw_stub_records(
+    records: Iterable["RawMarcxmlRecord"],
+    reader: "RawMarcxmlReader",
+    out: BinaryIO,
+    invalid_bibs: Container[str],
+    stats: Counter,
+) -> Iterator["RawMarcxmlRecord"]:
+    """
+    Same as `write_stub_records` but passes on raw MARCXML records. Records
+    are decoded only to create their stub records.
+
+    Args:
+        records:                iterable of raw records
+        reader:                 reader of the file the records come from
+        out:                    MARC21 file of stub records opened in binary mode
+        invalid_bibs:           bib #s rejected by Zephir
+        stats:                  `Counter` updated with number of stub records
+
+    Yields:
+        `RawMarcxmlRecord` instances
+    """
+    for record in records:
+        write_stub_record(reader.decode(record), out, invalid_bibs, stats)
+        yield record
+
+
+def write_stub_record(
+    bib: Record, out: BinaryIO, invalid_bibs: Container[str], stats: Counter
+) -> None:
+    bibno = bib.get("907").get("a")  # type: ignore
+    if bibno not in invalid_bibs:
+        stub_bib, barcodes = make_stub_record(bib)
+        if not barcodes:
+            warnings.warn(
+                f"{bibno} has no barcode in 945 field. Skipping.", UserWarning
+            )
+        else:
+            out.write(stub_bib.as_marc())
+            stats["stubs"] += 1
+
+
+def stub_record_keys(record: RawRecord) -> tuple[Optional[str], list[str]]:
+    """
+    Reads 907$a bib # and 856$u HathiTrust URLs of raw stub record without
+    decoding it.
+
+    Args:
+        record:                 `RawRecord` of stub record
+
+    Returns:
+        tuple of bib # (None if missing) and URLs
+    """
+    fields = split_raw_record(bytes(record.data))
+    if fields is not None:
+        try:
+            bibno = next(raw_subfields(fields, b"907", b"a"), None)
+            return (bibno, list(raw_subfields(fields, b"856", b"u")))
+        except UnicodeDecodeError:
+            pass
+    # malformed records are left to pymarc
+    bib = record.as_record()
+    t907 = bib.get("907")
+    return (
+        t907.get("a") if t907 else None,
+        [url for f in bib.get_fields("856") for url in f.get_subfields("u")],
+    )
+
+
+def filter_stub_records(
+    stubs_fh: Path,
+    out_fh: Path,
+    invalid_bibs: Container[str],
+    store: Optional[StatusStore] = None,
+    shipment_date: Optional[datetime.date] = None,
+    mat_source: str = "",
+) -> int:
+    """
+    Copies stub records created by `write_stub_records` leaving out bibs
+    rejected by Zephir. Output is the same as of `create_stub_hathi_records`,
+    but the submitted MARCXML does not have to be parsed again.
+
+    Args:
+        stubs_fh:           `pathlib.Path` path of MARC21 file of stub records
+        out_fh:             `pathlib.Path` path of MARC21 output file
+        invalid_bibs:       bib #s rejected by Zephir
+        store:              optional `StatusStore` to record items with
+                            generated Hathi URLs in
+        shipment_date:      shipment date, required when `store` is given
+        mat_source:         source of the material (e.g. onsite, recap)
+
+    Returns:
+        number of output stub records
+    """
+    if store is not None and shipment_date is None:
+        raise ValueError("Shipment date is required to record statuses.")
+    metrics = PipelineMetrics(
+        "filter_stub_records",
+        shipment_date=f"{shipment_date or ''}",
+        mat_source=mat_source,
+    )
+    created_urls: list[StatusRow] = []
+    with (
+        open(out_fh, "wb", buffering=WRITE_BUFFER_SIZE) as out,
+        metrics.timed("write") as write,
+    ):
+        for record in metrics.meter("read", mmap_marc_records(stubs_fh)):
+            bibno, urls = stub_record_keys(record)
+            if bibno not in invalid_bibs:
+                write.bytes_written += out.write(record.data)
+                write.records += 1
+                created_urls.extend(
+                    StatusRow("url-created", bibno or "", url.rsplit(".", 1)[1])
+                    for url in urls
+                    # URLs end with the barcode (see `generate_hathi_url`)
+                    if "." in url
+                )
+    metrics.stage("read").bytes_read = file_size(stubs_fh)
+    if store is not None and shipment_date is not None:
+        store.upsert(shipment_date, mat_source, created_urls)
+    metrics.save(out_fh.parent)
+    print(f"Output {write.records} stub records.")
+    return write.records
+
+
+def create_stub_hathi_records(
+    submitted_fh: Path,
+    errors_fh: Path,
+    out_fh: Path,
+    store: Optional[StatusStore] = None,
+    shipment_date: Optional[datetime.date] = None,
+    mat_source: str = "",
+    invalid_bibs: Optional[Container[str]] = None,
+):
     """
     Creates stub records that include only LDR, 245, 856, & 907 fields.
     Generates 856 fields with HathiTrust URLs.
@@ -142,44 +865,62 @@ def create_stub_hathi_records(submitted_fh: Path, errors_fh: Path, out_fh: Path)
         error_fh:           `pathlib.Path` path of Zephir's error report in MARCXML
                             format
         out_fh:             `pathlib.Path` path of MARC21 output file
+        store:              optional `StatusStore` to record items with
+                            generated Hathi URLs in
+        shipment_date:      shipment date, required when `store` is given
+        mat_source:         source of the material (e.g. onsite, recap)
+        invalid_bibs:       optional already parsed bib #s rejected by Zephir;
+                            `errors_fh` is parsed when not given
     """
-    if errors_fh.exists():
-        invalid_bibs = get_invalid_bib_nos(errors_fh)
-        print(f"Found {len(invalid_bibs)} rejected record(s) by Zephir.")
-    else:
-        print(f"No Zephir error report was found in {errors_fh.parent}.")
-        invalid_bibs = []
+    if store is not None and shipment_date is None:
+        raise ValueError("Shipment date is required to record statuses.")
+    metrics = PipelineMetrics(
+        "create_stub_hathi_records",
+        shipment_date=f"{shipment_date or ''}",
+        mat_source=mat_source,
+    )
+    created_urls: list[StatusRow] = []
+    if invalid_bibs is None:
+        with metrics.timed("read") as read:
+            if errors_fh.exists():
+                invalid_bibs = set(get_invalid_bib_nos(errors_fh))
+                print(f"Found {len(invalid_bibs)} rejected record(s) by Zephir.")
+                read.bytes_read = file_size(errors_fh)
+            else:
+                print(f"No Zephir error report was found in {errors_fh.parent}.")
+                invalid_bibs = set()
+    metrics.stage("read").bytes_read += file_size(submitted_fh)
     total_out_bibs = Counter()  # type: ignore
 
-    for bib in marcxml_reader(submitted_fh):
-
-        bibno = bib.get("907").get("a")  # type: ignore
-        if bibno not in invalid_bibs:
-            # create new stub records
-            stub_bib = Record()
-            stub_bib.leader = bib.leader
-            stub_bib.add_ordered_field(bib.get("245"))
-            stub_bib.add_ordered_field(bib.get("907"))
-            has_item_field = False
+    with (
+        open(out_fh, "ab", buffering=WRITE_BUFFER_SIZE) as out,
+        metrics.timed("transform") as transform,
+    ):
+        for bib in metrics.meter("read", marcxml_reader(submitted_fh)):
+            transform.records += 1
 
-            # construct 856s with Hathi URLs
-            for f in bib.get_fields("945"):
-                barcode = f.get("i")
-                volume = f.get("c")
-                t856 = generate_hathi_url(barcode, volume)
+            bibno = bib.get("907").get("a")  # type: ignore
+            if bibno not in invalid_bibs:
+                stub_bib, barcodes = make_stub_record(bib)
+                created_urls.extend(
+                    StatusRow("url-created", bibno or "", barcode)
+                    for barcode in barcodes
+                )
 
-                if t856 and is_item_field(f):
-                    has_item_field = True
-                    stub_bib.add_ordered_field(t856)
+                if not barcodes:
+                    warnings.warn(
+                        f"{bibno} has no barcode in 945 field. Skipping.", UserWarning
+                    )
+                else:
+                    # output bibs in MARC21 format
+                    total_out_bibs.update(bibno=1)
+                    with metrics.timed("write") as write:
+                        write.bytes_written += out.write(stub_bib.as_marc())
+                        write.records += 1
 
-            if not has_item_field:
-                warnings.warn(
-                    f"{bibno} has no barcode in 945 field. Skipping.", UserWarning
-                )
-            else:
-                # output bibs in MARC21 format
-                total_out_bibs.update(bibno=1)
-                append2marc(stub_bib, out_fh)
+    if store is not None and shipment_date is not None:
+        store.upsert(shipment_date, mat_source, created_urls)
+    metrics.save(out_fh.parent)
 
     print(f"Output {total_out_bibs.total()} stub records.")
 
@@ -202,16 +943,328 @@ def get_invalid_bib_nos(errors_fh: Path) -> list[str]:
 
 
 def marcxml_reader(fh: Union[str, Path]) -> Iterator[Record]:
-    reader = parse_xml_to_array(fh)
-    for bib in reader:
-        yield bib
+    """
+    Reads MARCXML file incrementally and yields one record at a time.
+    Parsed elements are discarded as soon as the record is built, so memory
+    use stays flat regardless of the size of the file.
 
+    Args:
+        fh:                     path to MARCXML file
 
-def save2marcxml(marcxml: Union[str, Path], bibs: list[Record]) -> None:
-    writer = XMLWriter(open(marcxml, "ab"))
-    for bib in bibs:
-        writer.write(bib)
-    writer.close()
+    Yields:
+        `pymarc.Record` instance
+    """
+    root = None
+    for event, elem in ET.iterparse(fh, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "end" and local_name(elem.tag) == "record":
+            yield element_to_record(elem)
+            root.clear()
+
+
+def scan_marcxml_records(
+    data: Union[bytes, mmap.mmap], pos: int = 0
+) -> Iterator[tuple[int, int]]:
+    """
+    Finds `<record>` elements in raw MARCXML without parsing it.
+
+    Args:
+        data:                   MARCXML file content
+        pos:                    byte offset to start the scan at
+
+    Yields:
+        tuples of start and end byte offsets of each record element
+    """
+    while start := MARCXML_RECORD_START.search(data, pos):
+        end = MARCXML_RECORD_END.search(data, start.end())
+        if end is None:
+            raise GoogleBooksToolError(
+                f"Error. Unclosed MARCXML record at byte {start.start()}."
+            )
+        yield (start.start(), end.end())
+        pos = end.end()
+
+
+def marcxml_records_end(data: Union[bytes, mmap.mmap]) -> Optional[int]:
+    """
+    Finds where the last `<record>` element of raw MARCXML ends, scanning
+    back from the end of the file (see `scan_marcxml_records`).
+
+    Args:
+        data:                   MARCXML file content
+
+    Returns:
+        end byte offset of the last record element or None if there is none
+    """
+    pos = len(data)
+    while (pos := data.rfind(b"</", 0, pos)) != -1:
+        end = MARCXML_RECORD_END.match(data, pos)
+        if end is not None:
+            return end.end()
+    return None
+
+
+def marcxml_datafields(record: bytes, tag: str) -> Iterator[list[tuple[str, str]]]:
+    """
+    Finds data fields with given tag with a light scan of raw MARCXML record
+    (see `scan_marcxml_records`).
+
+    Args:
+        record:                 raw `<record>` element
+        tag:                    MARC tag
+
+    Yields:
+        list of tuples of subfield code and value of each field
+    """
+    tag_bytes = tag.encode("ascii")
+    for field in MARCXML_DATAFIELD.finditer(record):
+        if field.group(2) == tag_bytes:
+            yield [
+                (
+                    subfield.group(2).decode("utf-8"),
+                    html.unescape((subfield.group(3) or b"").decode("utf-8")),
+                )
+                for subfield in MARCXML_SUBFIELD.finditer(field.group(3) or b"")
+            ]
+
+
+def marcxml_subfields(record: bytes, tag: str, code: str) -> Iterator[str]:
+    """
+    Yields values of given subfield of data fields with given tag found with a
+    light scan of raw MARCXML record (see `scan_marcxml_records`).
+
+    Args:
+        record:                 raw `<record>` element
+        tag:                    MARC tag
+        code:                   subfield code
+    """
+    for subfields in marcxml_datafields(record, tag):
+        yield from (
+            value for subfield_code, value in subfields if subfield_code == code
+        )
+
+
+class RawMarcxmlRecord(NamedTuple):
+    """`<record>` element of MARCXML file as raw bytes"""
+
+    # whatever is between the previous record and this one, e.g. white space
+    separator: bytes
+    data: bytes
+
+
+class RawMarcxmlReader:
+    """
+    Reads MARCXML file as raw `<record>` elements found with a light scan
+    (see `scan_marcxml_records`), so records can be filtered and copied to
+    another file byte for byte without being parsed. Records are scanned as
+    they are read. They can still be decoded into `pymarc.Record` on request,
+    in the order of the file.
+
+    Args:
+        marcxml:                path to MARCXML file
+    """
+
+    def __init__(self, marcxml: Union[str, Path]) -> None:
+        self.marcxml = marcxml
+        self._data: Union[bytes, mmap.mmap] = b""
+        with open(marcxml, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # XML declaration, opening collection tag, and closing tag of the file
+        first = MARCXML_RECORD_START.search(self._data)
+        if first is None:
+            self.head, self.tail = self._data[:], b""
+        else:
+            end = marcxml_records_end(self._data)
+            if end is None or end <= first.start():
+                self.close()
+                raise GoogleBooksToolError(
+                    f"Error. Unclosed MARCXML record at byte {first.start()}."
+                )
+            self.head = self._data[: first.start()]
+            self.tail = self._data[end:]
+        self._parser: Optional[ET.XMLPullParser] = None
+        self._root: Optional[ET.Element] = None
+
+    def __enter__(self) -> "RawMarcxmlReader":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[RawMarcxmlRecord]:
+        previous_end = len(self.head)
+        for start, end in scan_marcxml_records(self._data, previous_end):
+            yield RawMarcxmlRecord(
+                self._data[previous_end:start], self._data[start:end]
+            )
+            previous_end = end
+
+    def decode(self, record: RawMarcxmlRecord) -> Record:
+        """
+        Parses raw record into `pymarc.Record`, the same as `marcxml_reader`
+        does. The parser is fed the head of the file first, so namespace
+        prefixes declared on the collection are resolved.
+
+        Args:
+            record:             raw record of this file
+        """
+        if self._parser is None:
+            self._parser = ET.XMLPullParser(events=("start", "end"))
+            self._parser.feed(self.head)
+        self._parser.feed(record.data)
+        # only start and end events are requested, so all carry elements
+        events = cast(Iterator[tuple[str, ET.Element]], self._parser.read_events())
+        for event, elem in events:
+            if self._root is None:
+                self._root = elem
+            if event == "end" and local_name(elem.tag) == "record":
+                bib = element_to_record(elem)
+                self._root.clear()
+                return bib
+        raise GoogleBooksToolError(
+            f"Error. Unable to decode MARCXML record of {self.marcxml}."
+        )
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+def save_raw_marcxml(
+    marcxml: Union[str, Path],
+    reader: RawMarcxmlReader,
+    records: Iterable[RawMarcxmlRecord],
+) -> int:
+    """
+    Copies raw records to a new MARCXML file between the head and tail of
+    the file they come from. Records are written as they arrive from the
+    given iterable. Overwrites the file if it already exists.
+
+    Args:
+        marcxml:                path to output MARCXML file
+        reader:                 reader of the source file
+        records:                iterable of raw records of the source file
+
+    Returns:
+        number of bytes written
+    """
+    with open(marcxml, "wb", buffering=WRITE_BUFFER_SIZE) as out:
+        written = out.write(reader.head)
+        for separator, data in records:
+            written += out.write(separator) + out.write(data)
+        written += out.write(reader.tail)
+    return written
+
+
+def local_name(tag: str) -> str:
+    """Returns XML element name stripped of its namespace"""
+    return tag.rpartition("}")[2]
+
+
+def element_to_record(elem: ET.Element) -> Record:
+    """
+    Converts MARCXML `<record>` element to `pymarc.Record`. Mirrors
+    `pymarc.marcxml.XmlHandler` so records are identical to those produced by
+    `pymarc.parse_xml_to_array`.
+
+    Args:
+        elem:                   `xml.etree.ElementTree.Element` of a record
+
+    Returns:
+        `pymarc.Record` instance
+    """
+    bib = Record()
+    for child in elem:
+        name = local_name(child.tag)
+        if name == "leader":
+            bib.leader = Leader(child.text or "")
+        elif name == "controlfield":
+            bib.add_field(Field(tag=child.attrib["tag"], data=child.text or ""))
+        elif name == "datafield":
+            bib.add_field(
+                Field(
+                    tag=child.attrib["tag"],
+                    indicators=Indicators(
+                        child.attrib.get("ind1", " "), child.attrib.get("ind2", " ")
+                    ),
+                    subfields=[
+                        Subfield(sub.attrib["code"], sub.text or "")
+                        for sub in child
+                        if local_name(sub.tag) == "subfield"
+                    ],
+                )
+            )
+    return bib
+
+
+class MARCXMLWriter:
+    """
+    Streams records to a MARCXML collection through a single buffered handle.
+    The collection header is written on open and the footer on close, so the
+    output is always a single valid MARCXML document. Output is the same as
+    `pymarc.XMLWriter` produces.
+
+    Args:
+        marcxml:                path to output MARCXML file
+        buffering:              size of the write buffer in bytes
+    """
+
+    def __init__(
+        self, marcxml: Union[str, Path], buffering: int = WRITE_BUFFER_SIZE
+    ) -> None:
+        self.marcxml = marcxml
+        self._file: Optional[BinaryIO] = open(marcxml, "wb", buffering=buffering)
+        self.records_written = 0
+        self.bytes_written = self._file.write(MARCXML_HEADER)
+
+    def __enter__(self) -> "MARCXMLWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def write(self, record: Record) -> None:
+        if self._file is None:
+            raise ValueError(f"Writing to closed MARCXML file {self.marcxml}.")
+        node = record_to_xml_node(record)
+        self.bytes_written += self._file.write(ET.tostring(node, encoding="utf-8"))
+        self.records_written += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.bytes_written += self._file.write(MARCXML_FOOTER)
+            self._file.close()
+            self._file = None
+
+
+def save2marcxml(marcxml: Union[str, Path], bibs: Iterable[Record]) -> int:
+    """
+    Writes records to MARCXML file as they arrive from the given iterable.
+    Overwrites the file if it already exists.
+
+    Args:
+        marcxml:                path to output MARCXML file
+        bibs:                   iterable of `pymarc.Record` instances
+
+    Returns:
+        number of bytes written
+    """
+    with MARCXMLWriter(marcxml) as writer:
+        for bib in bibs:
+            writer.write(bib)
+    return writer.bytes_written
 
 
 def append2marc(record: Record, out: Union[str, Path]) -> None:
@@ -0,0 +1,167 @@
+"""
+A module with methods to record per-stage throughput of pipelines (records,
+bytes read and written, wall time) and log it as JSON lines.
+"""
+
+from contextlib import contextmanager
+import datetime
+import json
+import os
+from pathlib import Path
+import time
+from typing import Iterable, Iterator, Optional, TypeVar, Union
+
+
+METRICS_LOG = "metrics.jsonl"
+
+# stages are reported in this order, followed by any other stages
+STAGES = ("read", "filter", "transform", "write")
+
+T = TypeVar("T")
+
+
+def file_size(fh: Union[str, Path]) -> int:
+    """Returns size of the file in bytes or 0 if it does not exist"""
+    try:
+        return os.path.getsize(fh)
+    except OSError:
+        return 0
+
+
+class StageMetrics:
+    """Counters of a single pipeline stage"""
+
+    __slots__ = ("records", "bytes_read", "bytes_written", "seconds")
+
+    def __init__(self) -> None:
+        self.records = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.seconds = 0.0
+
+    @property
+    def records_per_sec(self) -> float:
+        return self.records / self.seconds if self.seconds else 0.0
+
+
+class PipelineMetrics:
+    """
+    Records metrics of stages (e.g. read, filter, transform, write) of a
+    streaming pipeline. Stages interleave, so time spent in nested stages is
+    subtracted from the stage that called them and each stage reports only
+    its own time.
+
+    Args:
+        pipeline:           name of the pipeline (e.g. function name)
+        context:            values saved with every metrics row, e.g.
+                            shipment date and material source
+    """
+
+    def __init__(self, pipeline: str, **context: Union[str, int]) -> None:
+        self.pipeline = pipeline
+        self.context = context
+        self.stages: dict[str, StageMetrics] = {}
+        # the running stage and when the last switch between stages happened
+        self._current: Optional[StageMetrics] = None
+        self._last = 0.0
+
+    def stage(self, name: str) -> StageMetrics:
+        """Returns metrics of the stage; creates it on first use"""
+        try:
+            return self.stages[name]
+        except KeyError:
+            stage = self.stages[name] = StageMetrics()
+            return stage
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[StageMetrics]:
+        """
+        Times the block as the stage. Counters of the yielded stage metrics
+        are updated by the caller.
+        """
+        stage = self.stage(name)
+        caller = self._switch(stage)
+        try:
+            yield stage
+        finally:
+            self._switch(caller)
+
+    def meter(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """
+        Counts and times items produced by the iterable as the stage.
+        """
+        return self._metered(self.stage(name), iter(iterable))
+
+    def _metered(self, stage: StageMetrics, iterator: Iterator[T]) -> Iterator[T]:
+        # runs once per record, so `_switch` is inlined
+        clock = time.perf_counter
+        while True:
+            caller = self._current
+            now = clock()
+            if caller is not None:
+                caller.seconds += now - self._last
+            self._last = now
+            self._current = stage
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                now = clock()
+                stage.seconds += now - self._last
+                self._last = now
+                self._current = caller
+            stage.records += 1
+            yield item
+
+    def _switch(self, stage: Optional[StageMetrics]) -> Optional[StageMetrics]:
+        """
+        Charges time since the last switch to the running stage and makes the
+        given stage the running one.
+
+        Returns:
+            previously running stage
+        """
+        now = time.perf_counter()
+        current = self._current
+        if current is not None:
+            current.seconds += now - self._last
+        self._last = now
+        self._current = stage
+        return current
+
+    def rows(self) -> list[dict]:
+        timestamp = f"{datetime.datetime.now():%Y-%m-%dT%H:%M:%S}"
+        return [
+            dict(
+                timestamp=timestamp,
+                pipeline=self.pipeline,
+                **self.context,
+                stage=name,
+                records=stage.records,
+                bytes_read=stage.bytes_read,
+                bytes_written=stage.bytes_written,
+                seconds=round(stage.seconds, 6),
+                records_per_sec=round(stage.records_per_sec, 1),
+            )
+            for name, stage in sorted(
+                self.stages.items(),
+                key=lambda s: STAGES.index(s[0]) if s[0] in STAGES else len(STAGES),
+            )
+        ]
+
+    def save(self, out_dir: Union[str, Path]) -> Path:
+        """
+        Appends metrics of all stages to `metrics.jsonl` log in the directory.
+
+        Args:
+            out_dir:            directory of the log, e.g. shipment directory
+
+        Returns:
+            path of the log
+        """
+        log = Path(out_dir) / METRICS_LOG
+        with open(log, "a", encoding="utf-8") as out:
+            for row in self.rows():
+                out.write(json.dumps(row) + "\n")
+        return log
@@ -3,13 +3,21 @@ A module with methods to unpack Google Candidate List and create
 NYPL pick list.
 """
 
+import codecs
 import csv
-import glob
-import tarfile
+from fnmatch import fnmatch
+from functools import lru_cache
 from itertools import islice
+import json
+import os
+from pathlib import PurePosixPath
 import re
+import tarfile
+from typing import BinaryIO, Iterator, NamedTuple, Optional
 
-from google_books.utils import fh_date, save2csv
+from google_books.errors import GoogleBooksToolError
+from google_books.metrics import PipelineMetrics, file_size
+from google_books.utils import CSVSink, fh_date
 
 SIERRA_EXPORT_FIELDS = [
     "RECORD #(ITEM)",
@@ -37,16 +45,44 @@ SIERRA_EXPORT_FIELDS = [
     "STAFFCALL#",
 ]
 
+# rows of the Sierra export cleaned between checkpoints of a resumable run
+CHECKPOINT_EVERY = 100000
+
+# Google guidelines (cm)
+MAX_HEIGHT = 32
+MAX_WIDTH = 46
+MAX_THICKNESS = 13
+
+# height is the leading number (range like "27-36" uses its first value),
+# width and thickness follow the first and second "x"
+DIMENSIONS_PATTERN = re.compile(
+    r"^(\d{1,2})?[^x×]*(?:[x×]\s*(\d{1,2})[^x×]*(?:[x×]\s*(\d{1,2}))?)?",
+    re.IGNORECASE,
+)
+
 
-def extract_candidate_list(tar_file: str) -> None:
+def candidate_list_rows(tar_file: str) -> Iterator[list[str]]:
     """
-    Extracts the candidate list from the tar file.
+    Streams rows of `_combined-*.txt` members of the candidate list tar file
+    without extracting them to disk. Plain, gzip, and bz2 compressed tar files
+    are supported.
 
     Args:
         tar_file (str): The tar file containing the candidate list.
+
+    Yields:
+        rows of the candidate list
     """
-    with tarfile.open(tar_file, "r") as tar:
-        tar.extractall("files/picklist")
+    with tarfile.open(tar_file, "r|*") as tar:
+        for member in tar:
+            if not member.isfile() or not fnmatch(
+                PurePosixPath(member.name).name, "*_combined-*.txt"
+            ):
+                continue
+            candidates = tar.extractfile(member)
+            yield from csv.reader(
+                codecs.iterdecode(candidates, "utf-8"), delimiter="\t"  # type: ignore
+            )
 
 
 def prep_item_list_for_sierra(tar_file: str, list_size: int) -> None:
@@ -60,25 +96,67 @@ def prep_item_list_for_sierra(tar_file: str, list_size: int) -> None:
         list_size (int): The number of items to include in the list.
     """
     date = fh_date(tar_file)
+    metrics = PipelineMetrics("prep_item_list_for_sierra", date=f"{date}")
 
-    extract_candidate_list(tar_file)
-
-    # read each extracted .txt file, find item #, and write it to a new file
-    files = glob.glob("files/picklist/*_combined-*.txt")
+    # read each _combined .txt member, find item #, and write it to a new file
     n = -1
     s = 1
+    # output files are appended to, so their sizes before the run are subtracted
+    out_size = file_size(candidate_items_fh(date, s))
     print(f"Outputting to file: {str(s).zfill(3)}...")
-    for f in files:
-        reader = csv.reader(open(f, "r", encoding="utf-8"), delimiter="\t")
-        for row in reader:
+    with (
+        CSVSink(candidate_items_fh(date, s), ",") as sink,
+        metrics.timed("write") as write,
+    ):
+        for row in metrics.meter("read", candidate_list_rows(tar_file)):
             n += 1
             if n >= list_size:
                 n = 0
                 s += 1
                 print(f"Outputting to file: {str(s).zfill(3)}...")
+                out_size += file_size(candidate_items_fh(date, s))
+                sink.rollover(candidate_items_fh(date, s))
             item = row[1][1:]
-            out = f"files/picklist/nypl-{date}-candidate-items-{str(s).zfill(3)}.csv"
-            save2csv(out, ",", [item])
+            sink.writerow([item])
+        write.records = sink.rows_written
+    write.bytes_written = (
+        sum(file_size(candidate_items_fh(date, n)) for n in range(1, s + 1)) - out_size
+    )
+    metrics.stage("read").bytes_read = file_size(tar_file)
+    metrics.save("files/picklist")
+
+
+def candidate_items_fh(date: Optional[str], sequence: int) -> str:
+    """
+    Returns path of the n-th candidate items output file.
+
+    Args:
+        date (str): The date element of the candidate list tar file name
+        sequence (int): The sequence number of the output file
+    """
+    return f"files/picklist/nypl-{date}-candidate-items-{str(sequence).zfill(3)}.csv"
+
+
+@lru_cache(maxsize=65536)
+def parse_dimensions(value: str) -> tuple[Optional[int], Optional[int], Optional[int]]:
+    """
+    Extracts height, width, and thickness (in cm) from the 300 $c in a single
+    pass. Dimensions are separated by "x" with or without spaces around it.
+    Results are memoized since the same values repeat across the export.
+
+    Args:
+        value (str): The value of the 300 $c
+
+    Returns:
+        tuple of height, width, and thickness; missing dimensions are None
+    """
+    # the pattern has only optional groups so it always matches
+    height, width, thickness = DIMENSIONS_PATTERN.match(value).groups()  # type: ignore
+    return (
+        int(height) if height else None,
+        int(width) if width else None,
+        int(thickness) if thickness else None,
+    )
 
 
 def too_tall(value: str) -> bool:
@@ -88,10 +166,8 @@ def too_tall(value: str) -> bool:
     Args:
         value (str): The value of the 300 $c
     """
-    pattern = re.compile(r"^(\d{1,2})(.*)")
-    if match := pattern.match(value):
-        return int(match.group(1)) >= 32
-    return False
+    height = parse_dimensions(value)[0]
+    return height is not None and height >= MAX_HEIGHT
 
 
 def too_wide(value: str) -> bool:
@@ -101,10 +177,8 @@ def too_wide(value: str) -> bool:
     Args:
         value (str): The value of the 300 $c
     """
-    pattern = re.compile(r"^(.*x\s?)(\d{1,2})(.*)")
-    if match := pattern.match(value):
-        return int(match.group(2)) >= 46
-    return False
+    width = parse_dimensions(value)[1]
+    return width is not None and width >= MAX_WIDTH
 
 
 def too_thick(value: str) -> bool:
@@ -114,29 +188,27 @@ def too_thick(value: str) -> bool:
     Args:
         value (str): The value of the 300 $c
     """
-    pattern = re.compile(r"^(.*x.*x\s)(\d{1,2})(.*)")
-    if match := pattern.match(value):
-        return int(match.group(2)) >= 13
-    return False
+    thickness = parse_dimensions(value)[2]
+    return thickness is not None and thickness >= MAX_THICKNESS
 
 
 def is_oversized(value: str) -> bool:
     """
     Checks if extend in 300 $c indicates oversized item that Google won't be able
     to scan.
-        + length is 46 cm or above
+        + height is 32 cm or above
+        + width is 46 cm or above
         + thickness is 13 cm or above
 
     Args:
         value (str): The value of the 300 $c
     """
-
-    results = []
-    results.append(too_tall(value))
-    results.append(too_wide(value))
-    results.append(too_thick(value))
-
-    return any(results)
+    height, width, thickness = parse_dimensions(value)
+    return (
+        (height is not None and height >= MAX_HEIGHT)
+        or (width is not None and width >= MAX_WIDTH)
+        or (thickness is not None and thickness >= MAX_THICKNESS)
+    )
 
 
 def get_number_of_linked_bibs(row: list) -> int:
@@ -160,17 +232,228 @@ def get_clean_bib_values(row: list, linked_bibs_no: int) -> list:
     return [i for i in islice(row[15:], 0, None, linked_bibs_no)]
 
 
-def prep_sierra_export_for_dataframe(fh: str, date: str) -> None:
+def clean_sierra_export_rows(
+    reader: Iterator[list[str]], longrows: CSVSink
+) -> Iterator[list]:
+    """
+    Reshapes rows of the Sierra export. Each row is extended with the oversized
+    flag and the number of linked bibs, and interleaved values of linked bibs
+    are replaced with values of the first bib.
+
+    Args:
+        reader: An iterator of rows of the Sierra export (without the header)
+        longrows: `CSVSink` for rows with unexpected number of bib values
+
+    Yields:
+        cleaned rows
+    """
+    for row in reader:
+        try:
+            assert len(row[15:]) % 8 == 0
+        except AssertionError:
+            longrows.writerow([row[0], len(row), len(row[15])])
+        new_row: list = row[:15]
+        new_row.append(is_oversized(row[18]))
+        linked_bibs_no = get_number_of_linked_bibs(row)
+        new_row.append(linked_bibs_no)
+
+        # move clean_bib_values to its own function for testing
+        try:
+            clean_bib_values = get_clean_bib_values(row, linked_bibs_no)
+        except ValueError:
+            print(f"Error in {row[0]}. Step: {linked_bibs_no}")
+            raise
+        new_row.extend(clean_bib_values)
+        yield new_row
+
+
+def write_sierra_export_columnar(
+    rows: Iterator[list], out: str, fmt: str, batch_size: int = 65536
+) -> int:
+    """
+    Writes cleaned Sierra export rows to Parquet or Arrow IPC file in record
+    batches with explicit column types. Requires `pyarrow`.
+
+    Args:
+        rows: An iterator of cleaned rows
+        out: The path to the output file
+        fmt: `parquet` or `arrow`
+        batch_size: The number of rows in a record batch
+
+    Returns:
+        number of written rows
+    """
+    try:
+        import pyarrow as pa  # type: ignore[import-untyped]
+        import pyarrow.ipc  # type: ignore[import-untyped]
+        import pyarrow.parquet as pq  # type: ignore[import-untyped]
+    except ImportError:
+        raise GoogleBooksToolError(
+            "Error. Parquet and Arrow output requires pyarrow. "
+            "Install it with `pip install pyarrow`."
+        )
+
+    schema = pa.schema(
+        [(name, pa.string()) for name in SIERRA_EXPORT_FIELDS[:15]]
+        + [("OVERSIZED", pa.bool_()), ("LINKED BIBS", pa.int32())]
+        + [(name, pa.string()) for name in SIERRA_EXPORT_FIELDS[15:]]
+    )
+    width = len(schema)
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(out, schema)
+    elif fmt == "arrow":
+        writer = pa.ipc.new_file(out, schema)
+    else:
+        raise ValueError(f"Unsupported output format `{fmt}`.")
+
+    total = 0
+    with writer:
+        while batch := list(islice(rows, batch_size)):
+            # rows with unexpected number of bib values are padded or truncated
+            columns = zip(*(row[:width] + [None] * (width - len(row)) for row in batch))
+            writer.write_batch(
+                pa.RecordBatch.from_arrays(
+                    [pa.array(col, type=f.type) for col, f in zip(columns, schema)],
+                    schema=schema,
+                )
+            )
+            total += len(batch)
+    return total
+
+
+class ExportCheckpoint(NamedTuple):
+    """
+    Consistent point of a Sierra export cleaning run: input up to the offset
+    has been cleaned and output files end exactly after its rows.
+    """
+
+    source_size: int
+    input_offset: int
+    rows: int
+    output_bytes: int
+    longrows_bytes: int
+
+
+class ExportLines:
+    """
+    Iterates over decoded lines of Sierra export opened in binary mode and
+    keeps the byte offset of the end of the last line read.
+
+    Args:
+        export: Sierra export file opened in binary mode
+    """
+
+    def __init__(self, export: BinaryIO) -> None:
+        self.export = export
+        self.offset = export.tell()
+
+    def __iter__(self) -> "ExportLines":
+        return self
+
+    def __next__(self) -> str:
+        line = self.export.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode("utf-8", errors="replace")
+
+    def seek(self, offset: int) -> None:
+        self.export.seek(offset)
+        self.offset = offset
+
+
+def load_checkpoint(fh: str) -> Optional[ExportCheckpoint]:
+    """
+    Reads checkpoint of an unfinished run.
+
+    Args:
+        fh (str): The path to the checkpoint file
+
+    Returns:
+        `ExportCheckpoint` instance or None if there is no checkpoint
+    """
+    try:
+        with open(fh, "r", encoding="utf-8") as f:
+            return ExportCheckpoint(**json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(fh: str, checkpoint: ExportCheckpoint) -> None:
+    """
+    Saves the checkpoint. The previous checkpoint is replaced atomically, so
+    an interrupted save leaves it intact.
+
+    Args:
+        fh (str): The path to the checkpoint file
+        checkpoint (ExportCheckpoint): The checkpoint to save
+    """
+    with open(f"{fh}.tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint._asdict(), f)
+    os.replace(f"{fh}.tmp", fh)
+
+
+def truncate(fh: str, size: int) -> None:
+    """Truncates the file to the size unless it does not exist"""
+    try:
+        os.truncate(fh, size)
+    except FileNotFoundError:
+        pass
+
+
+def prep_sierra_export_for_dataframe(
+    fh: str,
+    date: str,
+    fmt: str = "tsv",
+    resume: bool = False,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+) -> None:
     """
     Transforms a given Sierra export file to a format that can be used to create
     `pandas.DataFrame` object. Will append data to the out file if already exists.
+    Parquet and Arrow IPC output (requires `pyarrow`) is typed and overwrites
+    the out file.
+
+    Progress of tsv output is saved to a checkpoint file next to the out file
+    every `checkpoint_every` rows. An interrupted run can be resumed: out files
+    are truncated to the last checkpoint and cleaning continues from the
+    matching row of the export.
 
     Args:
         fh (str): The path to the Sierra export file
         date (str): The date of the export in the format YYYY-MM-DD
+        fmt (str): The output format: `tsv`, `parquet`, or `arrow`
+        resume (bool): Continue an interrupted run from its last checkpoint
+        checkpoint_every (int): The number of rows between checkpoints
     """
-    with open(fh, "r", encoding="utf-8", errors="replace") as f:
-        reader = csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+    ext = "csv" if fmt == "tsv" else fmt
+    out_fh = f"files/picklist/candidates-sierra-export-clean-{date}.{ext}"
+    longrows_fh = f"files/picklist/candidates-siera-export-longrows-{date}.csv"
+    checkpoint_fh = f"{out_fh}.checkpoint"
+    source_size = file_size(fh)
+
+    checkpoint = None
+    if resume:
+        if fmt != "tsv":
+            raise GoogleBooksToolError("Error. Only tsv output can be resumed.")
+        checkpoint = load_checkpoint(checkpoint_fh)
+        if checkpoint is None:
+            raise GoogleBooksToolError(
+                f"Error. No checkpoint of an unfinished run found ({checkpoint_fh})."
+            )
+        if checkpoint.source_size != source_size:
+            raise GoogleBooksToolError(
+                "Error. Sierra export has changed since the checkpoint was saved."
+            )
+    elif fmt == "tsv" and os.path.exists(checkpoint_fh):
+        print(
+            "Warning. Found checkpoint of an unfinished run. "
+            "Use resume to continue it instead of appending to its output."
+        )
+
+    with open(fh, "rb") as f:
+        lines = ExportLines(f)
+        reader = csv.reader(lines, delimiter="\t", quoting=csv.QUOTE_NONE)
         header = next(reader)
 
         try:
@@ -182,30 +465,58 @@ def prep_sierra_export_for_dataframe(fh: str, date: str) -> None:
             )
             raise
 
-        for row in reader:
-            try:
-                assert len(row[15:]) % 8 == 0
-            except AssertionError:
-                save2csv(
-                    f"files/picklist/candidates-siera-export-longrows-{date}.csv",
-                    "\t",
-                    [row[0], len(row), len(row[15])],
-                )
-            new_row = row[:15]
-            oversized = str(is_oversized(row[18]))
-            new_row.append(oversized)
-            linked_bibs_no = get_number_of_linked_bibs(row)
-            new_row.append(linked_bibs_no)
-
-            # move clean_bib_values to its own function for testing
-            try:
-                clean_bib_values = get_clean_bib_values(row, linked_bibs_no)
-            except ValueError:
-                print(f"Error in {row[0]}. Step: {linked_bibs_no}")
-                raise
-            new_row.extend(clean_bib_values)
-            save2csv(
-                f"files/picklist/candidates-sierra-export-clean-{date}.csv",
-                "\t",
-                new_row,
+        done = 0
+        if checkpoint is not None:
+            truncate(out_fh, checkpoint.output_bytes)
+            truncate(longrows_fh, checkpoint.longrows_bytes)
+            lines.seek(checkpoint.input_offset)
+            done = checkpoint.rows
+            print(f"Resuming after {done} rows.")
+
+        metrics = PipelineMetrics("prep_sierra_export_for_dataframe", date=date)
+        start_offset = lines.offset
+        out_size = file_size(out_fh)
+        with CSVSink(longrows_fh, "\t") as longrows:
+            rows = metrics.meter(
+                "transform",
+                clean_sierra_export_rows(metrics.meter("read", reader), longrows),
             )
+            with metrics.timed("write") as write:
+                if fmt == "tsv":
+                    with CSVSink(out_fh, "\t") as out:
+                        # an interrupted run resumes at least from here
+                        save_checkpoint(
+                            checkpoint_fh,
+                            ExportCheckpoint(
+                                source_size,
+                                lines.offset,
+                                done,
+                                out_size,
+                                file_size(longrows_fh),
+                            ),
+                        )
+                        for n, row in enumerate(rows, start=1):
+                            out.writerow(row)
+                            if n % checkpoint_every == 0:
+                                out.flush()
+                                longrows.flush()
+                                save_checkpoint(
+                                    checkpoint_fh,
+                                    ExportCheckpoint(
+                                        source_size,
+                                        lines.offset,
+                                        done + out.rows_written,
+                                        file_size(out_fh),
+                                        file_size(longrows_fh),
+                                    ),
+                                )
+                    write.records = out.rows_written
+                else:
+                    write.records = write_sierra_export_columnar(rows, out_fh, fmt)
+
+    if fmt == "tsv":
+        os.remove(checkpoint_fh)
+    metrics.stage("read").bytes_read = source_size - start_offset
+    # tsv output is appended to
+    write.bytes_written = file_size(out_fh) - (out_size if fmt == "tsv" else 0)
+    metrics.save("files/picklist")
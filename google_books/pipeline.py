@@ -0,0 +1,225 @@
+"""
+End-to-end processing of a shipment: HathiTrust metadata prep, Zephir report
+analysis, and stub records with HathiTrust URLs. Stages share indexes parsed
+once per run and are skipped when their outputs are newer than their inputs.
+"""
+
+from functools import cached_property
+import os
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+from google_books.barcode_index import BarcodeIndex
+from google_books.errors import GoogleBooksToolError
+from google_books.hathi_processor import (
+    HathiReportPaths,
+    clean_metadata_and_create_stubs,
+    get_grin_report,
+    get_hathi_meta_destination,
+    get_hathi_report_paths,
+    get_marcxml,
+    get_rejected_barcodes,
+    parse_hathi_processing_report,
+)
+from google_books.marc_manipulator import (
+    create_stub_hathi_records,
+    filter_stub_records,
+    get_invalid_bib_nos,
+)
+from google_books.status_store import StatusStore
+from google_books.utils import shipment_date_obj
+
+
+class Stage(NamedTuple):
+    """A step of the shipment pipeline with its input and output files"""
+
+    name: str
+    inputs: tuple[Path, ...]
+    outputs: tuple[Path, ...]
+    run: Callable[[], str]
+    optional_inputs: tuple[Path, ...] = ()
+
+    def missing_inputs(self) -> list[Path]:
+        return [fh for fh in self.inputs if not fh.exists()]
+
+    def is_current(self) -> bool:
+        """
+        Checks if all outputs exist and are newer than all inputs.
+        """
+        if not all(fh.exists() for fh in self.outputs):
+            return False
+        inputs = [fh for fh in self.inputs + self.optional_inputs if fh.exists()]
+        newest_input = max(fh.stat().st_mtime for fh in inputs)
+        return all(fh.stat().st_mtime >= newest_input for fh in self.outputs)
+
+
+class StageResult(NamedTuple):
+    """Outcome of a pipeline stage: `done`, `skipped`, or `waiting` for input"""
+
+    stage: str
+    status: str
+    message: str
+
+
+class ShipmentPipeline:
+    """
+    Runs the shipment workflow (`hathi-metadata-prep`, `hathi-report`, and
+    `hathi-urls`) in one go. All files are read from and written to the
+    shipment folder (`files/shipments/YYYY-MM-DD_<source>`). Each input file
+    is parsed at most once per run: GRIN's rejected barcodes and Zephir's
+    invalid bibs are indexed on first use and shared by the stages.
+
+    Args:
+        shipment_date:      date in the format YYYYMMDD
+        mat_source:         source of the material (e.g. onsite, recap)
+        store:              optional `StatusStore` to record results in
+        force:              run stages even if their outputs are up to date
+    """
+
+    def __init__(
+        self,
+        shipment_date: str,
+        mat_source: str,
+        store: Optional[StatusStore] = None,
+        force: bool = False,
+    ) -> None:
+        self.shipment_date = shipment_date
+        self.date = shipment_date_obj(shipment_date)
+        self.mat_source = mat_source
+        self.store = store
+        self.force = force
+
+        self.shipment_dir = Path(
+            f"files/shipments/{self.date:%Y-%m-%d}_{self.mat_source}"
+        )
+        if not self.shipment_dir.is_dir():
+            raise GoogleBooksToolError(
+                f"Error. Shipment folder {self.shipment_dir} does not exist."
+            )
+        self.grin_report = get_grin_report(self.date, mat_source)
+        self.submitted = get_hathi_meta_destination(self.date, mat_source)
+        self.report_paths: HathiReportPaths = get_hathi_report_paths(
+            "files/shipments", self.date, mat_source
+        )
+        self.zephir_errors = (
+            self.shipment_dir / f"nyp_{self.date:%Y%m%d}_google_error.xml"
+        )
+        self.stubs = self.shipment_dir / f"hathi-stub-urls_{self.date:%Y%m%d}.mrc"
+        # stub records of all submitted bibs, created with the submission
+        self.stub_candidates = (
+            self.shipment_dir / f"hathi-stub-candidates_{self.date:%Y%m%d}.mrc"
+        )
+
+    @property
+    def marcxml(self) -> Path:
+        try:
+            return get_marcxml(self.date, self.mat_source)
+        except GoogleBooksToolError:
+            return self.shipment_dir / f"NYPL_{self.date:%Y%m%d}.xml"
+
+    @cached_property
+    def rejected_barcodes(self) -> BarcodeIndex:
+        return get_rejected_barcodes(self.grin_report)
+
+    @cached_property
+    def invalid_bibs(self) -> frozenset[str]:
+        if not self.zephir_errors.exists():
+            return frozenset()
+        return frozenset(get_invalid_bib_nos(self.zephir_errors))
+
+    def stages(self) -> list[Stage]:
+        return [
+            Stage(
+                "hathi-metadata-prep",
+                (self.marcxml, self.grin_report),
+                (self.submitted, self.stub_candidates),
+                self.prep_metadata,
+            ),
+            Stage(
+                "hathi-report",
+                (self.report_paths.source,),
+                self.report_paths.outputs,
+                self.parse_report,
+            ),
+            Stage(
+                "hathi-urls",
+                # URLs are created only for a submission Zephir has processed
+                (self.submitted, self.report_paths.source),
+                (self.stubs,),
+                self.create_stubs,
+                optional_inputs=(self.zephir_errors, self.stub_candidates),
+            ),
+        ]
+
+    def prep_metadata(self) -> str:
+        saved, rejected, size, stubs = clean_metadata_and_create_stubs(
+            self.shipment_date,
+            self.mat_source,
+            self.stub_candidates,
+            self.rejected_barcodes,
+        )
+        return (
+            f"Scanned items: {saved}, rejected items: {rejected}, {size} bytes, "
+            f"{stubs} stub records."
+        )
+
+    def parse_report(self) -> str:
+        suc, inv, mis, err = parse_hathi_processing_report(
+            self.date, self.mat_source, *self.report_paths, self.store
+        )
+        return (
+            f"Successfully processed {suc}, OCLC in 035 only {inv}, "
+            f"missing OCLC # {mis}, rejected {err}."
+        )
+
+    def create_stubs(self) -> str:
+        if (
+            self.stub_candidates.exists()
+            and self.stub_candidates.stat().st_mtime >= self.submitted.stat().st_mtime
+        ):
+            # stubs were created with the submission, so MARCXML is not parsed
+            filter_stub_records(
+                self.stub_candidates,
+                self.stubs,
+                self.invalid_bibs,
+                store=self.store,
+                shipment_date=self.date,
+                mat_source=self.mat_source,
+            )
+            return f"Stub records saved to {self.stubs}."
+
+        # stub records are appended, so a stale file is removed first
+        if self.stubs.exists():
+            os.remove(self.stubs)
+        create_stub_hathi_records(
+            self.submitted,
+            self.zephir_errors,
+            self.stubs,
+            store=self.store,
+            shipment_date=self.date,
+            mat_source=self.mat_source,
+            invalid_bibs=self.invalid_bibs,
+        )
+        # an empty output still marks the stage as done
+        self.stubs.touch()
+        return f"Stub records saved to {self.stubs}."
+
+    def run(self) -> list[StageResult]:
+        """
+        Runs stages in order. A stage waits if any of its inputs is missing and
+        is skipped if its outputs are newer than its inputs.
+
+        Returns:
+            list of results of each stage
+        """
+        results = []
+        for stage in self.stages():
+            missing = stage.missing_inputs()
+            if missing:
+                message = "Missing " + ", ".join(fh.name for fh in missing)
+                results.append(StageResult(stage.name, "waiting", message))
+            elif not self.force and stage.is_current():
+                results.append(StageResult(stage.name, "skipped", "Up to date."))
+            else:
+                results.append(StageResult(stage.name, "done", stage.run()))
+        return results
@@ -0,0 +1,128 @@
+"""
+A module with methods to profile CLI commands with cProfile and tracemalloc.
+Nothing here is imported or enabled unless profiling is requested.
+"""
+
+import cProfile
+import datetime
+from pathlib import Path
+import pstats
+import tracemalloc
+from typing import Union
+
+
+def profile_fh(
+    out_dir: Union[str, Path], command: str, suffix: str, started: datetime.datetime
+) -> Path:
+    """
+    Determines path of a profiling output file, e.g.
+    `files/out/profile-hathi-urls-20240102-120000.prof`. Creates the directory
+    if needed.
+
+    Args:
+        out_dir:            directory of profiling output
+        command:            name of the profiled command
+        suffix:             file extension
+        started:            when the command started
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    return out / f"profile-{command}-{started:%Y%m%d-%H%M%S}{suffix}"
+
+
+def start_profiler() -> cProfile.Profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def function_name(func: tuple[str, int, str]) -> str:
+    """
+    Formats function key of profiler stats the same way pstats reports do,
+    e.g. `marc_manipulator.py:42(fix_oclc_info)` or `{built-in method len}`.
+
+    Args:
+        func:               tuple of file name, line number, and function name
+    """
+    filename, line, name = func
+    if (filename, line) == ("~", 0):
+        # built-in functions
+        return f"{{{name[1:-1]}}}" if name[:1] == "<" and name[-1:] == ">" else name
+    return f"{filename}:{line}({name})"
+
+
+def save_profile(profiler: cProfile.Profile, out_fh: Path, top: int = 15) -> str:
+    """
+    Stops profiler and saves its stats in pstats format (readable by
+    `python -m pstats`, snakeviz, or flameprof) and as a text file sorted by
+    cumulative time.
+
+    Args:
+        profiler:           running `cProfile.Profile` instance
+        out_fh:             path of the pstats file; text report is saved
+                            next to it with `.txt` extension
+        top:                number of functions in the returned summary
+
+    Returns:
+        summary of the hot spots
+    """
+    profiler.disable()
+    profiler.dump_stats(out_fh)
+    with open(out_fh.with_suffix(".txt"), "w") as report:
+        pstats.Stats(profiler, stream=report).sort_stats(
+            "cumulative", "tottime"
+        ).print_stats()
+
+    # function: (primitive calls, calls, own time, cumulative time, callers)
+    stats = pstats.Stats(profiler).stats  # type: ignore
+    hot_spots = sorted(stats.items(), key=lambda s: s[1][2], reverse=True)
+    return "\n".join(
+        [
+            f"Profile saved to {out_fh}. Top {top} functions by own time:",
+            f"{'tottime':>9}{'cumtime':>9}{'ncalls':>10}  function",
+            *(
+                f"{tt:>9.3f}{ct:>9.3f}{nc:>10}  {function_name(func)}"
+                for func, (_, nc, tt, ct, _) in hot_spots[:top]
+            ),
+        ]
+    )
+
+
+def start_memory_trace(frames: int = 1) -> None:
+    tracemalloc.start(frames)
+
+
+def save_memory_trace(out_fh: Path, top: int = 10) -> str:
+    """
+    Stops memory tracing and saves allocations still held at the end of the
+    command grouped by source line, largest first.
+
+    Args:
+        out_fh:             path of the text report
+        top:                number of source lines in the returned summary
+
+    Returns:
+        summary of peak memory use and the largest allocations
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    statistics = snapshot.statistics("lineno")
+    with open(out_fh, "w") as report:
+        report.write(
+            f"Peak traced memory: {peak / 1024:.1f} KiB\n"
+            f"Traced memory at exit: {current / 1024:.1f} KiB\n\n"
+        )
+        for stat in statistics:
+            report.write(f"{stat}\n")
+
+    return "\n".join(
+        [
+            f"Memory trace saved to {out_fh}. Peak traced memory: "
+            f"{peak / 1024:.1f} KiB. Largest allocations at exit:",
+            *(f"{stat}" for stat in statistics[:top]),
+        ]
+    )
@@ -0,0 +1,336 @@
+"""
+Byte-offset index of records in binary MARC21 and MARCXML files. The index is
+saved next to the file (`.idx`) and maps 907$a bib #s and 945$i barcodes to
+offsets and lengths of records, so records can be fetched from a large file
+with a seek instead of a scan. The index is rebuilt when the file's size or
+modification time changes.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+import mmap
+import os
+from pathlib import Path
+import struct
+from typing import BinaryIO, Iterable, Iterator, Optional, Union
+import warnings
+
+from pymarc import Record
+
+from google_books.marc_manipulator import (
+    MARCXML_FOOTER,
+    MARCXML_HEADER,
+    marcxml_subfields,
+    mmap_marc_records,
+    raw_subfields,
+    scan_marcxml_records,
+    split_raw_record,
+)
+from google_books.status_store import normalize_bibno
+from google_books.utils import array_from_bytes, array_to_bytes, atomic_write
+
+
+INDEX_SUFFIX = ".idx"
+
+MAGIC = b"RECIDX01"
+
+FORMATS = ("marc21", "marcxml")
+
+# magic, file size, mtime (ns), format, number of records, and number of keys
+HEADER = struct.Struct("<8sQqBQQ")
+
+
+class RecordIndex:
+    """
+    Byte offsets and lengths of records in a file with their 907$a bib #s and
+    945$i barcodes. Keys are kept sorted and looked up with a binary search.
+
+    Args:
+        fmt:                format of the file, "marc21" or "marcxml"
+        offsets:            byte offsets of records
+        lengths:            byte lengths of records
+        keys:               tuples of key and position of its record
+    """
+
+    __slots__ = ("fmt", "offsets", "lengths", "keys", "positions")
+
+    def __init__(
+        self,
+        fmt: str,
+        offsets: Iterable[int] = (),
+        lengths: Iterable[int] = (),
+        keys: Iterable[tuple[str, int]] = (),
+    ) -> None:
+        self.fmt = fmt
+        self.offsets = array("Q", offsets)
+        self.lengths = array("I", lengths)
+        pairs = sorted({(normalize_bibno(key), n) for key, n in keys if key.strip()})
+        self.keys = [key for key, _ in pairs]
+        self.positions = array("I", [n for _, n in pairs])
+
+    @classmethod
+    def from_bytes(
+        cls, fmt: str, data: Union[bytes, memoryview], records: int, keys: int
+    ) -> "RecordIndex":
+        """
+        Restores index serialized with `to_bytes`.
+
+        Args:
+            fmt:            format of the file
+            data:           serialized index
+            records:        number of records
+            keys:           number of keys
+        """
+        index = cls(fmt)
+        index.offsets = array_from_bytes("Q", data, records)
+        end = records * index.offsets.itemsize
+        index.lengths = array_from_bytes("I", data[end:], records)
+        end += records * index.lengths.itemsize
+        index.positions = array_from_bytes("I", data[end:], keys)
+        end += keys * index.positions.itemsize
+        index.keys = bytes(data[end:]).decode("utf-8").split("\n") if keys else []
+        return index
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the index: record offsets and lengths, and record positions
+        of keys as little-endian integers followed by keys separated by new
+        lines.
+        """
+        return b"".join(
+            [
+                *map(array_to_bytes, (self.offsets, self.lengths, self.positions)),
+                "\n".join(self.keys).encode("utf-8"),
+            ]
+        )
+
+    def lookup(self, key: str) -> list[int]:
+        """
+        Finds positions of records with given bib # or barcode.
+
+        Args:
+            key:            907$a bib # (with or without the leading period)
+                            or 945$i barcode
+        """
+        key = normalize_bibno(key)
+        start = bisect_left(self.keys, key)
+        end = bisect_right(self.keys, key, start)
+        return list(self.positions[start:end])
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __repr__(self) -> str:
+        return f"<RecordIndex fmt={self.fmt} records={len(self)} keys={len(self.keys)}>"
+
+
+def index_fh(fh: Path) -> Path:
+    return fh.with_name(fh.name + INDEX_SUFFIX)
+
+
+def detect_format(start: bytes) -> str:
+    """Tells MARCXML from binary MARC21 by the first character of the file."""
+    start = start.lstrip(b"\xef\xbb\xbf \t\r\n")
+    return "marcxml" if start[:1] == b"<" else "marc21"
+
+
+def marc21_keys(data: bytes) -> list[str]:
+    """
+    Reads 907$a bib #s and 945$i barcodes of raw MARC21 record.
+
+    Args:
+        data:               raw MARC21 record
+    """
+    fields = split_raw_record(data)
+    if fields is not None:
+        try:
+            return [
+                *raw_subfields(fields, b"907", b"a"),
+                *raw_subfields(fields, b"945", b"i"),
+            ]
+        except UnicodeDecodeError:
+            pass
+    # malformed and MARC-8 records are left to pymarc
+    bib = Record(data, hide_utf8_warnings=True)
+    return [
+        value
+        for tag, code in (("907", "a"), ("945", "i"))
+        for field in bib.get_fields(tag)
+        for value in field.get_subfields(code)
+    ]
+
+
+def build_index(fh: Path) -> RecordIndex:
+    """
+    Scans MARC21 or MARCXML file for record boundaries and keys.
+
+    Args:
+        fh:                 path to MARC21 or MARCXML file
+    """
+    offsets = []
+    lengths = []
+    keys: list[tuple[str, int]] = []
+    with open(fh, "rb") as source:
+        fmt = detect_format(source.read(1024))
+        if fmt == "marcxml":
+            with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for n, (start, end) in enumerate(scan_marcxml_records(data)):
+                    record = data[start:end]
+                    offsets.append(start)
+                    lengths.append(end - start)
+                    for tag, code in (("907", "a"), ("945", "i")):
+                        keys.extend(
+                            (key, n) for key in marcxml_subfields(record, tag, code)
+                        )
+    if fmt == "marc21":
+        for n, raw in enumerate(mmap_marc_records(fh)):
+            offsets.append(raw.offset)
+            lengths.append(len(raw.data))
+            keys.extend((key, n) for key in marc21_keys(bytes(raw.data)))
+    return RecordIndex(fmt, offsets, lengths, keys)
+
+
+def read_index(fh: Path) -> Optional[RecordIndex]:
+    """
+    Loads index of the file from its sidecar.
+
+    Args:
+        fh:                 path to MARC21 or MARCXML file
+
+    Returns:
+        `RecordIndex` instance or None if there is no valid index of the file
+    """
+    try:
+        with open(index_fh(fh), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, size, mtime_ns, fmt, records, keys = HEADER.unpack_from(data)
+    stat = fh.stat()
+    if (
+        magic != MAGIC
+        or size != stat.st_size
+        or mtime_ns != stat.st_mtime_ns
+        or fmt >= len(FORMATS)
+    ):
+        return None
+    return RecordIndex.from_bytes(
+        FORMATS[fmt], memoryview(data)[HEADER.size :], records, keys  # noqa: E203
+    )
+
+
+def write_index(fh: Path, index: RecordIndex, stat: os.stat_result) -> None:
+    """
+    Saves index to its sidecar. The sidecar is replaced atomically.
+
+    Args:
+        fh:                 path to MARC21 or MARCXML file
+        index:              index of the file
+        stat:               stat of the file taken before it was indexed
+    """
+    data = (
+        HEADER.pack(
+            MAGIC,
+            stat.st_size,
+            stat.st_mtime_ns,
+            FORMATS.index(index.fmt),
+            len(index),
+            len(index.keys),
+        )
+        + index.to_bytes()
+    )
+    atomic_write(index_fh(fh), data, f"Could not save index of {fh}")
+
+
+def load_index(fh: Union[str, Path]) -> RecordIndex:
+    """
+    Loads index of the file, building and saving it first if the file has
+    changed since it was indexed.
+
+    Args:
+        fh:                 path to MARC21 or MARCXML file
+    """
+    fh = Path(fh)
+    index = read_index(fh)
+    if index is None:
+        stat = fh.stat()
+        index = build_index(fh)
+        write_index(fh, index, stat)
+    return index
+
+
+def read_records(
+    source: BinaryIO, index: RecordIndex, keys: Iterable[str]
+) -> Iterator[bytes]:
+    """
+    Reads records with given keys. Each record is read once, in order of the
+    keys. Keys that are not in the index are reported with a warning.
+
+    Args:
+        source:             indexed file opened in binary mode
+        index:              index of the file
+        keys:               907$a bib #s or 945$i barcodes
+    """
+    seen = set()
+    for key in keys:
+        positions = index.lookup(key)
+        if not positions:
+            warnings.warn(f"No record found for {key}.")
+        for n in positions:
+            if n not in seen:
+                seen.add(n)
+                source.seek(index.offsets[n])
+                yield source.read(index.lengths[n])
+
+
+def fetch_records(fh: Union[str, Path], keys: Iterable[str]) -> list[bytes]:
+    """
+    Fetches raw records by 907$a bib # or 945$i barcode.
+
+    Args:
+        fh:                 path to MARC21 or MARCXML file
+        keys:               bib #s or barcodes
+
+    Returns:
+        list of raw MARC21 records or MARCXML `<record>` elements
+    """
+    index = load_index(fh)
+    with open(fh, "rb") as source:
+        return list(read_records(source, index, keys))
+
+
+def write_records(
+    fh: Union[str, Path], keys: Iterable[str], out_fh: Union[str, Path]
+) -> int:
+    """
+    Copies records with given bib #s or barcodes to a new file of the same
+    format. MARCXML records are written between the XML declaration and
+    collection tags of the source file, so namespace prefixes stay bound.
+
+    Args:
+        fh:                 path to MARC21 or MARCXML file
+        keys:               907$a bib #s or 945$i barcodes
+        out_fh:             path to output file
+
+    Returns:
+        number of written records
+    """
+    index = load_index(fh)
+    written = 0
+    with open(fh, "rb") as source, open(out_fh, "wb") as out:
+        if index.fmt == "marcxml":
+            if len(index):
+                head = source.read(index.offsets[0])
+                source.seek(index.offsets[-1] + index.lengths[-1])
+                tail = source.read()
+            else:
+                head, tail = MARCXML_HEADER, MARCXML_FOOTER
+            out.write(head)
+        for record in read_records(source, index, keys):
+            out.write(record)
+            written += 1
+        if index.fmt == "marcxml":
+            out.write(tail)
+    return written
@@ -0,0 +1,163 @@
+"""
+Persistent, cross-shipment store of HathiTrust/Zephir processing results.
+"""
+
+import datetime
+from pathlib import Path
+import sqlite3
+from types import TracebackType
+from typing import Iterable, NamedTuple, Optional, Union
+
+
+DEFAULT_STORE = Path("files/hathi-status.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hathi_status (
+    shipment_date TEXT NOT NULL,
+    mat_source TEXT NOT NULL,
+    bibno TEXT NOT NULL,
+    barcode TEXT NOT NULL,
+    cid TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    PRIMARY KEY (shipment_date, mat_source, status, bibno, barcode, cid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS hathi_status_bibno ON hathi_status (bibno);
+CREATE INDEX IF NOT EXISTS hathi_status_barcode ON hathi_status (barcode);
+CREATE INDEX IF NOT EXISTS hathi_status_cid ON hathi_status (cid);
+CREATE INDEX IF NOT EXISTS hathi_status_shipment_date
+    ON hathi_status (shipment_date);
+"""
+
+UPSERT = """
+INSERT INTO hathi_status VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (shipment_date, mat_source, status, bibno, barcode, cid)
+DO UPDATE SET message = excluded.message, updated = excluded.updated
+"""
+
+KEY_COLUMNS = ("bibno", "barcode", "cid", "shipment_date")
+
+
+class StatusRow(NamedTuple):
+    """Single processing result of a bib, item, or Hathi CID"""
+
+    status: str
+    bibno: str = ""
+    barcode: str = ""
+    cid: str = ""
+    message: str = ""
+
+
+class StatusRecord(NamedTuple):
+    """Status of a bib/item as stored in the database"""
+
+    shipment_date: str
+    mat_source: str
+    bibno: str
+    barcode: str
+    cid: str
+    status: str
+    message: str
+    updated: str
+
+
+def normalize_bibno(bibno: str) -> str:
+    """Strips the leading period of Sierra bib # (.b12345678x -> b12345678x)"""
+    return bibno.strip().lstrip(".")
+
+
+class StatusStore:
+    """
+    SQLite-backed store of statuses of bibs and items sent to HathiTrust.
+    Results are upserted in bulk, one transaction per call.
+
+    Args:
+        db:                 path to the SQLite database file
+    """
+
+    def __init__(self, db: Union[str, Path] = DEFAULT_STORE) -> None:
+        Path(db).parent.mkdir(parents=True, exist_ok=True)
+        self.db = db
+        self.conn = sqlite3.connect(db, timeout=30)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self) -> "StatusStore":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def upsert(
+        self,
+        shipment_date: datetime.date,
+        mat_source: str,
+        rows: Iterable[StatusRow],
+    ) -> int:
+        """
+        Inserts or updates statuses of given shipment in a single transaction.
+
+        Args:
+            shipment_date:  shipment date as `datetime.date` instance
+            mat_source:     source of the material (e.g. onsite, recap)
+            rows:           iterable of `StatusRow` instances
+
+        Returns:
+            number of upserted rows
+        """
+        updated = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.conn:
+            cursor = self.conn.executemany(
+                UPSERT,
+                (
+                    (
+                        f"{shipment_date:%Y-%m-%d}",
+                        mat_source,
+                        normalize_bibno(row.bibno),
+                        row.barcode.strip(),
+                        row.cid.strip(),
+                        row.status,
+                        row.message,
+                        updated,
+                    )
+                    for row in rows
+                ),
+            )
+        return cursor.rowcount
+
+    def query(self, key: str, values: Iterable[str]) -> list[StatusRecord]:
+        """
+        Returns stored statuses for given bib #s, barcodes, CIDs, or shipment
+        dates ordered by the key and shipment date.
+
+        Args:
+            key:            one of: bibno, barcode, cid, shipment_date
+            values:         values to look up
+
+        Returns:
+            list of `StatusRecord` instances
+        """
+        if key not in KEY_COLUMNS:
+            raise ValueError(f"Invalid key `{key}`. Use one of: {KEY_COLUMNS}.")
+        if key == "bibno":
+            values = (normalize_bibno(v) for v in values)
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (value TEXT)")
+            self.conn.execute("DELETE FROM lookup")
+            self.conn.executemany(
+                "INSERT INTO lookup VALUES (?)", ((v.strip(),) for v in values)
+            )
+            cursor = self.conn.execute(
+                "SELECT hathi_status.* FROM hathi_status "
+                f"JOIN (SELECT DISTINCT value FROM lookup) ON {key} = value "
+                f"ORDER BY {key}, shipment_date, status"
+            )
+            return [StatusRecord(*row) for row in cursor]
+
+    def close(self) -> None:
+        self.conn.close()
@@ -1,33 +1,145 @@
+from array import array
 import csv
 import datetime
+import os
 from pathlib import Path
 import re
-from typing import Optional, Union
+import sys
+from types import TracebackType
+from typing import IO, TYPE_CHECKING, Any, Iterable, Optional, Union
 import warnings
 
 from .errors import FileNameError, GoogleBooksToolError
 
+if TYPE_CHECKING:
+    from _csv import Writer
 
-def save2csv(dst_fh, delimiter, row):
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class CSVSink:
     """
-    Appends a list with data to a dst_fh csv
-    args:
-        dst_fh: str, output file
-        row: list, list of values to write in a row
+    Keeps a single buffered handle to a csv file open for the duration of a run.
+    Rows are formatted the same way `save2csv` formats them. The file is opened
+    lazily on the first write, so no empty files are created.
+
+    Args:
+        dst_fh:             path to the output file
+        delimiter:          field delimiter
+        mode:               file mode, `a` (append) by default
+        buffering:          size of the write buffer in bytes
+        newline:            passed to `open`
+        fmtparams:          any additional `csv.writer` formatting parameters
     """
 
-    with open(dst_fh, "a", encoding="utf-8") as csvfile:
-        out = csv.writer(
-            csvfile,
+    def __init__(
+        self,
+        dst_fh: Union[str, Path],
+        delimiter: str = ",",
+        mode: str = "a",
+        buffering: int = WRITE_BUFFER_SIZE,
+        newline: Optional[str] = None,
+        **fmtparams: Any,
+    ) -> None:
+        self.dst_fh = dst_fh
+        self.mode = mode
+        self.buffering = buffering
+        self.newline = newline
+        self.fmtparams: dict[str, Any] = dict(
             delimiter=delimiter,
             lineterminator="\n",
             quotechar="@",
             quoting=csv.QUOTE_MINIMAL,
         )
+        self.fmtparams.update(fmtparams)
+        self.rows_written = 0
+        self._file: Optional[IO[str]] = None
+        self._writer: Optional["Writer"] = None
+
+    def __enter__(self) -> "CSVSink":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def open(self) -> "Writer":
+        """
+        Opens the file unless already open.
+
+        Returns:
+            `csv.writer` of the file
+        """
+        if self._writer is not None:
+            return self._writer
+        file: IO[str] = open(
+            self.dst_fh,
+            self.mode,
+            encoding="utf-8",
+            buffering=self.buffering,
+            newline=self.newline,
+        )
+        self._file = file
+        self._writer = csv.writer(file, **self.fmtparams)
+        return self._writer
+
+    def writerow(self, row: list) -> None:
+        """
+        Writes a row to the file. Rows that cannot be encoded are skipped
+        with a warning.
+
+        Args:
+            row:            list of values to write in a row
+        """
+        writer = self._writer
+        if writer is None:
+            writer = self.open()
         try:
-            out.writerow(row)
+            writer.writerow(row)
+            self.rows_written += 1
         except UnicodeEncodeError:
-            warnings.warn(f"Could not write `{row[0]}` to {dst_fh}")
+            warnings.warn(f"Could not write `{row[0]}` to {self.dst_fh}")
+
+    def writerows(self, rows: Iterable[list]) -> None:
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self) -> None:
+        """Writes buffered rows to the file"""
+        if self._file is not None:
+            self._file.flush()
+
+    def rollover(self, dst_fh: Union[str, Path]) -> None:
+        """
+        Closes the current file and directs any following rows to a new one.
+
+        Args:
+            dst_fh:         path to the new output file
+        """
+        self.close()
+        self.dst_fh = dst_fh
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+
+def save2csv(dst_fh, delimiter, row):
+    """
+    Appends a list with data to a dst_fh csv
+    args:
+        dst_fh: str, output file
+        row: list, list of values to write in a row
+    """
+    with CSVSink(dst_fh, delimiter) as sink:
+        sink.writerow(row)
 
 
 def get_directory(dir_parent: Union[str, Path], dir_name: str) -> Path:
@@ -97,3 +209,66 @@ def timestamp_str2date(timestamp: str) -> datetime.date:
         raise GoogleBooksToolError(
             f"Error. Encountered invalid timestamp: `{timestamp}`."
         )
+
+
+def atomic_write(fh: Path, data: bytes, warning: str) -> bool:
+    """
+    Replaces the file with given data atomically. The data is written to a
+    temporary file next to it first. Failures are reported with a warning,
+    since the files written this way are caches that are rebuilt when missing.
+
+    Args:
+        fh:             path to the file
+        data:           new content of the file
+        warning:        message of the warning issued when the file cannot be
+                        written
+
+    Returns:
+        whether the file was written
+    """
+    tmp = fh.with_suffix(".tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, fh)
+    except OSError as exc:
+        warnings.warn(f"{warning}: {exc}")
+        return False
+    return True
+
+
+def array_to_bytes(values: array) -> bytes:
+    """
+    Serializes array of integers as little-endian, so the files it is saved to
+    can be read on any platform.
+
+    Args:
+        values:         array to serialize
+    """
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def array_from_bytes(
+    typecode: str, data: Union[bytes, memoryview], count: Optional[int] = None
+) -> array:
+    """
+    Restores array serialized with `array_to_bytes`.
+
+    Args:
+        typecode:       type code of the array
+        data:           serialized array followed by any other data
+        count:          number of items to read; the whole data is read if
+                        not given
+
+    Returns:
+        `array.array` instance
+    """
+    values = array(typecode)
+    end = len(data) if count is None else count * values.itemsize
+    values.frombytes(data[:end])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
@@ -0,0 +1,51 @@
+import pytest
+
+from google_books.barcode_index import BarcodeIndex, encode_barcode
+
+
+@pytest.mark.parametrize(
+    "arg,expectation",
+    [
+        ("33433010141525", 33433010141525),
+        ("033433010141525", None),
+        ("3343301014152x", None),
+        ("3343301014152²", None),
+        ("1234567890123456789", None),
+    ],
+)
+def test_encode_barcode(arg, expectation):
+    assert encode_barcode(arg) == expectation
+
+
+def test_barcode_index_membership():
+    index = BarcodeIndex(["33433124886338", "33433119947368", "CU12345", "0123"])
+    assert "33433124886338" in index
+    assert "33433119947368" in index
+    assert "CU12345" in index
+    assert "0123" in index
+    assert "123" not in index
+    assert "33433010141525" not in index
+    assert "CU1234" not in index
+    assert None not in index
+
+
+def test_barcode_index_dedups_and_iterates_sorted():
+    index = BarcodeIndex(["33433124886338", "33433119947368", "33433124886338", "B1"])
+    assert len(index) == 3
+    assert list(index) == ["33433119947368", "33433124886338", "B1"]
+
+
+def test_barcode_index_empty():
+    index = BarcodeIndex()
+    assert len(index) == 0
+    assert "33433124886338" not in index
+
+
+@pytest.mark.parametrize(
+    "barcodes",
+    [[], ["33433124886338", "33433119947368"], ["CU12345", "0123", ""], ["1", "x"]],
+)
+def test_barcode_index_bytes(barcodes):
+    index = BarcodeIndex.from_bytes(BarcodeIndex(barcodes).to_bytes())
+    assert list(index) == sorted(barcodes)
+    assert all(barcode in index for barcode in barcodes)
@@ -1,9 +1,22 @@
+from datetime import date
 from pathlib import Path
+import shutil
+import subprocess
+import sys
 
 from click.testing import CliRunner
 import pytest
 
 from google_books import cli
+from google_books.generator import (
+    GENERATORS,
+    barcode,
+    bibno,
+    write_marc21,
+    write_marcxml,
+    write_zephir_errors,
+)
+from google_books.status_store import StatusRow, StatusStore
 
 
 @pytest.mark.parametrize(
@@ -42,3 +55,233 @@ def test_new_shipment_invalid_mat_source(tmp_path):
 
         # verify that no new directory was created
         assert not (s / "1999-12-31_foobar").exists()
+
+
+def test_hathi_urls_records_mat_source(tmp_path):
+    runner = CliRunner()
+    with runner.isolated_filesystem(temp_dir=tmp_path):
+        shipment_dir = Path("files/shipments/2024-01-02")
+        shipment_dir.mkdir(parents=True)
+        write_marcxml(shipment_dir / "nyp_20240102_google.xml", 5)
+        write_zephir_errors(shipment_dir / "nyp_20240102_google_error.xml", 5)
+        result = runner.invoke(
+            cli,
+            ["hathi-urls", "20240102", "--mat-source", "recap", "--db", "status.db"],
+        )
+        assert result.exit_code == 0
+        with StatusStore("status.db") as store:
+            records = store.query("shipment_date", ["2024-01-02"])
+    assert records
+    assert {record.mat_source for record in records} == {"recap"}
+
+
+def test_hathi_urls_without_mat_source(tmp_path):
+    runner = CliRunner()
+    with runner.isolated_filesystem(temp_dir=tmp_path):
+        shipment_dir = Path("files/shipments/2024-01-02")
+        shipment_dir.mkdir(parents=True)
+        write_marcxml(shipment_dir / "nyp_20240102_google.xml", 5)
+        result = runner.invoke(cli, ["hathi-urls", "20240102", "--db", "status.db"])
+        assert (shipment_dir / "hathi-stub-urls_20240102.mrc").exists()
+        assert not Path("status.db").exists()
+    assert result.exit_code == 0
+    assert "Use --mat-source to record them." in result.output
+
+
+def test_hathi_urls_invalid_mat_source(tmp_path):
+    runner = CliRunner()
+    with runner.isolated_filesystem(temp_dir=tmp_path):
+        result = runner.invoke(
+            cli,
+            ["hathi-urls", "20240102", "--mat-source", "foobar", "--db", "status.db"],
+        )
+        assert not Path("status.db").exists()
+    assert result.exit_code == 2
+    assert "Invalid value for '--mat-source'" in result.output
+
+
+@pytest.mark.parametrize("options", [[], ["--pymarc"]])
+def test_hathi_metadata_prep(tmp_path, options):
+    runner = CliRunner()
+    with runner.isolated_filesystem(temp_dir=tmp_path):
+        shipment = Path("files/shipments/2024-01-02_onsite")
+        shipment.mkdir(parents=True)
+        write_marcxml(shipment / "NYPL_20240102.xml", 10)
+        runner.invoke(cli, ["generate", "grin", "10", f"{shipment}/_query.txt"])
+        result = runner.invoke(
+            cli, ["hathi-metadata-prep", "20240102", "onsite", *options]
+        )
+        size = (shipment / "nyp_20240102_google.xml").stat().st_size
+    assert result.exit_code == 0
+    assert f"File size: {size} (bytes)" in result.output
+
+
+def test_hathi_status(tmp_path):
+    db = tmp_path / "status.db"
+    with StatusStore(db) as store:
+        store.upsert(
+            date(2024, 8, 16),
+            "onsite",
+            [StatusRow("error", bibno="b103615325", message="invalid recTyp")],
+        )
+    lookup = tmp_path / "bibs.txt"
+    lookup.write_text("b16006420x\n")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["hathi-status", ".b103615325", "--file", str(lookup), "--db", str(db)]
+    )
+    assert result.exit_code == 0
+    assert result.stdout == (
+        "2024-08-16\tonsite\tb103615325\t\t\terror\tinvalid recTyp\n"
+    )
+    assert "Found 1 status(es) for 1 bibno(s)." in result.stderr
+
+
+def test_fetch_records(tmp_path):
+    source = tmp_path / "catalog.mrc"
+    write_marc21(source, 20)
+    lookup = tmp_path / "keys.txt"
+    lookup.write_text(f"{barcode(5)}\n\n")
+    out = tmp_path / "fetched.mrc"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["fetch-records", str(source), bibno(1), "--file", str(lookup)]
+        + ["--out", str(out)],
+    )
+    assert result.exit_code == 0
+    assert result.stdout == f"Fetched 2 record(s) to {out}.\n"
+    assert (tmp_path / "catalog.mrc.idx").exists()
+    assert out.read_bytes().count(b"\x1d") == 2
+
+
+def test_hathi_report_batch(tmp_path):
+    parent = tmp_path / "shipments"
+    (parent / "2024-08-16_onsite").mkdir(parents=True)
+    shutil.copy(
+        "tests/hathi-report-sample.txt",
+        parent / "2024-08-16_onsite/nyp_20240816_google_onsite.txt",
+    )
+    db = tmp_path / "status.db"
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ["hathi-report-batch", str(parent), "--db", str(db)])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "Shipment    Source       Success  035 only  Missing OCLC  Rejected",
+        "2024-08-16  onsite             4         0             2         1",
+        "Total                          4         0             2         1",
+    ]
+
+    result = runner.invoke(cli, ["hathi-report-batch", str(parent), "--db", str(db)])
+    assert result.output.splitlines()[-1] == "Skipped 1 up-to-date shipment(s)."
+
+
+def test_generate(tmp_path):
+    out = tmp_path / "_query.txt"
+    runner = CliRunner()
+    result = runner.invoke(cli, ["generate", "grin", "10", str(out), "--seed", "3"])
+    assert result.exit_code == 0
+    assert result.output == (
+        f"Generated grin file with 10 record(s) ({out.stat().st_size} bytes): {out}\n"
+    )
+    assert out.read_text().startswith("Barcode\tCheck-In Date\t")
+
+
+@pytest.mark.parametrize(
+    "options,reports",
+    [
+        (["--profile"], [".prof", ".txt"]),
+        (["--trace-memory"], ["-memory.txt"]),
+        (["--profile", "--trace-memory"], [".prof", ".txt", "-memory.txt"]),
+    ],
+)
+def test_cli_profiling(tmp_path, options, reports):
+    out = tmp_path / "profile"
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        [*options, "--profile-dir", str(out), "generate", "grin", "10"]
+        + [str(tmp_path / "_query.txt")],
+    )
+    assert result.exit_code == 0
+    assert sorted(fh.name[32:] for fh in out.iterdir()) == sorted(reports)
+    assert all(fh.name.startswith("profile-generate-") for fh in out.iterdir())
+    assert ("Profile saved to" in result.output) is ("--profile" in options)
+    assert ("Memory trace saved to" in result.output) is ("--trace-memory" in options)
+
+
+def test_cli_no_profiling(tmp_path):
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["--profile-dir", str(tmp_path / "profile"), "generate", "grin", "10"]
+        + [str(tmp_path / "_query.txt")],
+    )
+    assert result.exit_code == 0
+    assert not (tmp_path / "profile").exists()
+
+
+def test_cli_imports_are_lazy():
+    # modules of commands and their dependencies load only when a command runs
+    heavy_modules = (
+        "pymarc",
+        "pyarrow",
+        "xml.etree",
+        "tarfile",
+        "concurrent.futures",
+        "google_books.generator",
+        "google_books.hathi_processor",
+        "google_books.manifest",
+        "google_books.marc_manipulator",
+        "google_books.picklist",
+        "google_books.record_index",
+    )
+    code = (
+        "import sys, google_books; "
+        f"print(*(m for m in sys.modules if m.startswith({heavy_modules!r})))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    )
+    assert result.stdout.split() == []
+
+
+def test_generate_kinds():
+    kinds = next(p for p in cli.commands["generate"].params if p.name == "kind")
+    assert list(kinds.type.choices) == list(GENERATORS)
+
+
+def test_process_shipment(tmp_path):
+    runner = CliRunner()
+    with runner.isolated_filesystem(temp_dir=tmp_path):
+        shipment = Path("files/shipments/2024-01-02_onsite")
+        shipment.mkdir(parents=True)
+        runner.invoke(
+            cli, ["generate", "marcxml", "10", f"{shipment}/NYPL_20240102.xml"]
+        )
+        runner.invoke(cli, ["generate", "grin", "10", f"{shipment}/_query.txt"])
+
+        result = runner.invoke(
+            cli, ["process-shipment", "20240102", "onsite", "--db", "status.db"]
+        )
+        assert result.exit_code == 0
+        summary = result.output.splitlines()[-3:]
+        assert summary[0].startswith("hathi-metadata-prep   done")
+        assert summary[1] == (
+            "hathi-report          waiting  Missing nyp_20240102_google_onsite.txt"
+        )
+
+
+def test_process_shipment_missing_folder(tmp_path):
+    runner = CliRunner()
+    with runner.isolated_filesystem(temp_dir=tmp_path):
+        result = runner.invoke(
+            cli, ["process-shipment", "20240102", "onsite", "--db", "status.db"]
+        )
+    assert result.exit_code == 0
+    assert result.output == (
+        "Error. Shipment folder files/shipments/2024-01-02_onsite does not exist.\n"
+    )
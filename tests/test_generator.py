@@ -0,0 +1,108 @@
+import csv
+
+from pymarc import MARCReader
+import pytest
+
+from google_books.errors import GoogleBooksToolError
+from google_books.generator import (
+    GENERATORS,
+    bibno,
+    generate,
+    write_candidates_tar,
+    write_grin_report,
+    write_marc21,
+    write_marcxml,
+    write_sierra_export,
+    write_zephir_errors,
+)
+from google_books.hathi_processor import (
+    google_reconciliation_to_barcodes_lst,
+    parse_hathi_processing_report,
+)
+from google_books.marc_manipulator import find_oclcno, marcxml_reader
+from google_books.picklist import SIERRA_EXPORT_FIELDS, candidate_list_rows
+
+
+@pytest.mark.parametrize("kind", list(GENERATORS))
+def test_generate_is_deterministic(tmp_path, kind):
+    first, second, other = tmp_path / "1", tmp_path / "2", tmp_path / "3"
+    written = generate(kind, first, 300, seed=7)
+    generate(kind, second, 300, seed=7)
+    generate(kind, other, 300, seed=8)
+    assert written == first.stat().st_size
+    assert first.read_bytes() == second.read_bytes()
+    if kind not in ("candidates", "zephir-errors"):
+        assert first.read_bytes() != other.read_bytes()
+
+
+def test_generate_unknown_kind(tmp_path):
+    with pytest.raises(GoogleBooksToolError):
+        generate("foo", tmp_path / "foo", 1)
+
+
+@pytest.mark.parametrize(
+    "n,expectation",
+    [(5237308, ".b152373081"), (6006420, ".b16006420x"), (361532, ".b103615325")],
+)
+def test_bibno(n, expectation):
+    assert bibno(n) == expectation
+
+
+def test_write_marc21(tmp_path):
+    fh = tmp_path / "NYPL_20240102.mrc"
+    write_marc21(fh, 200)
+    with open(fh, "rb") as f:
+        bibs = list(MARCReader(f))
+    assert len(bibs) == 200
+    assert bibs[1]["907"]["a"] == bibno(1)
+    assert bibs[1]["945"]["i"] == "33433000000004"
+    found = [find_oclcno(bib) for bib in bibs]
+    assert 0 < found.count(None) < 20
+    assert found[1] in (None, "100000001")
+
+
+def test_generated_shipment_is_consistent(tmp_path):
+    marcxml, grin = tmp_path / "NYPL_20240102.xml", tmp_path / "_query.txt"
+    write_marcxml(marcxml, 500, seed=1)
+    write_grin_report(grin, 500, seed=1)
+
+    barcodes = {
+        field["i"] for bib in marcxml_reader(marcxml) for field in bib.get_fields("945")
+    }
+    rejected = google_reconciliation_to_barcodes_lst(grin)
+    assert len(barcodes) > 500
+    assert 0 < len(rejected) < 100
+    assert set(rejected) <= barcodes
+
+
+def test_generated_zephir_reports(tmp_path):
+    report, errors = tmp_path / "report.txt", tmp_path / "errors.xml"
+    generate("zephir-report", report, 1000)
+    write_zephir_errors(errors, 1000)
+    outs = [tmp_path / f"{n}.csv" for n in range(4)]
+
+    success, invalid, missing, rejected = parse_hathi_processing_report(
+        "2024-01-02", "onsite", report, *outs
+    )
+    rejected_bibs = [bib["907"]["a"] for bib in marcxml_reader(errors)]
+    assert success + rejected == 1000
+    assert invalid > 0 and missing > 0
+    assert rejected == len(rejected_bibs)
+    assert outs[3].read_text().split(",")[0] == min(rejected_bibs)[1:]
+
+
+def test_write_sierra_export(tmp_path):
+    fh = tmp_path / "export.txt"
+    write_sierra_export(fh, 100)
+    with open(fh) as f:
+        rows = list(csv.reader(f, delimiter="\t"))
+    assert rows[0] == SIERRA_EXPORT_FIELDS
+    assert {len(row) for row in rows[1:]} == {23, 31}
+
+
+def test_write_candidates_tar(tmp_path):
+    fh = tmp_path / "NYPL_20240102_combined.tar.gz"
+    write_candidates_tar(fh, 25, member_size=10)
+    rows = list(candidate_list_rows(str(fh)))
+    assert len(rows) == 25
+    assert rows[-1][:2] == ["33433000000096", ".i20000096"]
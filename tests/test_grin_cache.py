@@ -0,0 +1,100 @@
+from collections import Counter
+from datetime import date
+import os
+import shutil
+
+import pytest
+
+from google_books import grin_cache, hathi_processor
+from google_books.grin_cache import cache_fh, read_cache
+from google_books.hathi_processor import parse_grin_report, read_grin_report
+
+
+@pytest.fixture
+def grin_report(tmp_path):
+    fh = tmp_path / "_query.txt"
+    shutil.copy("tests/_grin_query_sample.txt", fh)
+    return fh
+
+
+@pytest.fixture
+def parse_calls(monkeypatch):
+    calls = []
+
+    def parse(fh):
+        calls.append(fh)
+        return parse_grin_report(fh)
+
+    monkeypatch.setattr(hathi_processor, "parse_grin_report", parse)
+    return calls
+
+
+def test_read_grin_report_cache(grin_report, parse_calls):
+    report = read_grin_report(grin_report)
+    assert cache_fh(grin_report).exists()
+    cached = read_grin_report(grin_report)
+    assert parse_calls == [grin_report]
+
+    assert list(cached.rejected) == list(report.rejected)
+    assert len(cached.rejected) == 4
+    assert cached.codes == report.codes
+    assert list(cached.codes) == list(report.codes)
+    assert cached.checkin_range == report.checkin_range
+    assert isinstance(cached.checkin_range[0], date)
+
+
+def test_read_grin_report_touched(grin_report, parse_calls):
+    read_grin_report(grin_report)
+    mtime = grin_report.stat().st_mtime + 10
+    os.utime(grin_report, (mtime, mtime))
+
+    # same content is not parsed again and the cache is refreshed
+    read_grin_report(grin_report)
+    assert parse_calls == [grin_report]
+    assert read_cache(grin_report) is not None
+
+
+def test_read_grin_report_touched_read_only_cache(
+    grin_report, parse_calls, monkeypatch
+):
+    report = read_grin_report(grin_report)
+    cache = cache_fh(grin_report)
+    cache.chmod(0o444)
+
+    # file modes are not enforced for root, so opening for update fails either way
+    def read_only_open(fh, mode="r", *args, **kwargs):
+        if mode == "r+b":
+            raise PermissionError(13, "Permission denied", str(fh))
+        return open(fh, mode, *args, **kwargs)
+
+    monkeypatch.setattr(grin_cache, "open", read_only_open, raising=False)
+    mtime = grin_report.stat().st_mtime + 10
+    os.utime(grin_report, (mtime, mtime))
+
+    with pytest.warns(UserWarning, match="Could not refresh cache"):
+        cached = read_grin_report(grin_report)
+    assert parse_calls == [grin_report]
+    assert list(cached.rejected) == list(report.rejected)
+    assert cached.codes == report.codes
+
+
+def test_read_grin_report_changed(grin_report, parse_calls):
+    read_grin_report(grin_report)
+    lines = grin_report.read_text().splitlines(keepends=True)
+    grin_report.write_text("".join(lines[:-1]))
+
+    report = read_grin_report(grin_report)
+    assert parse_calls == [grin_report, grin_report]
+    assert sum(report.codes.values()) == len(lines) - 2
+
+
+def test_read_cache_missing_or_invalid(grin_report):
+    assert read_cache(grin_report) is None
+    cache_fh(grin_report).write_bytes(b"foo")
+    assert read_cache(grin_report) is None
+
+
+def test_parse_grin_report(grin_report):
+    report = parse_grin_report(grin_report)
+    assert isinstance(report.codes, Counter)
+    assert report.checkin_range[0] <= report.checkin_range[1]
@@ -1,18 +1,39 @@
+from collections import Counter
+import json
 from pathlib import Path
 from datetime import date
+import shutil
 
 import pytest
+from pymarc import MARCReader
 
 from google_books.hathi_processor import (
+    batch_parse_hathi_processing_reports,
+    clean_metadata_and_create_stubs,
+    clean_metadata_for_hathi_submission,
+    find_hathi_reports,
+    get_hathi_report_paths,
+    filter_rejected_items,
+    filter_rejected_raw_items,
     find_bibno,
     find_cid,
     find_err_msg,
     get_hathi_meta_destination,
     get_checkin_range,
     google_reconciliation_to_barcodes_lst,
+    parse_grin_report,
+    parse_hathi_processing_report,
     available_for_download,
     scannable,
 )
+from google_books.generator import write_grin_report, write_marcxml
+from google_books.marc_manipulator import (
+    RawMarcxmlReader,
+    create_stub_hathi_records,
+    marcxml_reader,
+    save2marcxml,
+)
+from google_books.status_store import StatusStore
 
 
 @pytest.mark.parametrize(
@@ -65,8 +86,9 @@ def test_get_checkin_range():
     assert get_checkin_range(values) == (date(2024, 1, 1), date(2024, 12, 31))
 
 
-def test_google_reconciliation_to_barcodes_lst():
-    sample_report = Path("tests/_grin_query_sample.txt")
+def test_google_reconciliation_to_barcodes_lst(tmp_path):
+    sample_report = tmp_path / "_query.txt"
+    shutil.copy("tests/_grin_query_sample.txt", sample_report)
     assert google_reconciliation_to_barcodes_lst(sample_report) == sorted(
         ["33433124886338", "33433119947368", "33433116658661", "33433090371893"]
     )
@@ -100,3 +122,266 @@ def test_available_for_download(arg, expectation):
 )
 def test_scannable(arg, expectation):
     assert scannable(arg) == expectation
+
+
+def test_filter_rejected_items():
+    stats = Counter()
+    bibs = filter_rejected_items(
+        marcxml_reader("tests/marcxml-sample.xml"), ["33433010141525"], stats
+    )
+    assert [bib["907"]["a"] for bib in bibs] == [".b122759692"]
+    assert stats == Counter(saved=1, rejected=1)
+
+
+def test_filter_rejected_raw_items():
+    stats = Counter()
+    with RawMarcxmlReader("tests/marcxml-sample.xml") as reader:
+        records = list(filter_rejected_raw_items(reader, ["33433010141525"], stats))
+        assert [reader.decode(r)["907"]["a"] for r in records] == [".b122759692"]
+    assert stats == Counter(saved=1, rejected=1)
+
+
+def test_clean_metadata_for_hathi_submission(tmp_path, monkeypatch):
+    shipment_dir = tmp_path / "files/shipments/2024-12-31_onsite"
+    shipment_dir.mkdir(parents=True)
+    shutil.copy("tests/marcxml-sample.xml", shipment_dir / "NYPL_20241231.xml")
+    shutil.copy("tests/_grin_query_sample.txt", shipment_dir / "_query.txt")
+    monkeypatch.chdir(tmp_path)
+
+    saved, rejected, file_size = clean_metadata_for_hathi_submission(
+        "20241231", "onsite"
+    )
+    out = shipment_dir / "nyp_20241231_google.xml"
+    assert (saved, rejected) == (2, 0)
+    assert file_size == out.stat().st_size
+    assert len(list(marcxml_reader(out))) == 2
+
+    metrics = [
+        json.loads(line)
+        for line in (shipment_dir / "metrics.jsonl").read_text().splitlines()
+    ]
+    assert [(m["stage"], m["records"]) for m in metrics] == [
+        ("read", 2),
+        ("filter", 2),
+        ("write", 2),
+    ]
+    assert metrics[-1]["bytes_written"] == file_size
+    assert {m["shipment_date"] for m in metrics} == {"2024-12-31"}
+    # kept records are copied, not re-serialized
+    assert out.read_bytes() == (shipment_dir / "NYPL_20241231.xml").read_bytes()
+
+
+def test_clean_metadata_for_hathi_submission_matches_pymarc(tmp_path, monkeypatch):
+    shipment_dir = tmp_path / "files/shipments/2024-01-02_onsite"
+    shipment_dir.mkdir(parents=True)
+    write_marcxml(shipment_dir / "NYPL_20240102.xml", 200)
+    write_grin_report(shipment_dir / "_query.txt", 200)
+    monkeypatch.chdir(tmp_path)
+
+    saved, rejected, _ = clean_metadata_for_hathi_submission("20240102", "onsite")
+    stats = Counter()
+    expected = tmp_path / "expected.xml"
+    save2marcxml(
+        expected,
+        filter_rejected_items(
+            marcxml_reader(shipment_dir / "NYPL_20240102.xml"),
+            parse_grin_report(shipment_dir / "_query.txt").rejected,
+            stats,
+        ),
+    )
+    assert (saved, rejected) == (stats["saved"], stats["rejected"])
+    assert rejected > 0
+    out = shipment_dir / "nyp_20240102_google.xml"
+    assert [bib.as_marc() for bib in marcxml_reader(out)] == [
+        bib.as_marc() for bib in marcxml_reader(expected)
+    ]
+
+
+def test_clean_metadata_for_hathi_submission_pymarc_fallback(tmp_path, monkeypatch):
+    shipment_dir = tmp_path / "files/shipments/2024-01-02_onsite"
+    shipment_dir.mkdir(parents=True)
+    write_marcxml(shipment_dir / "NYPL_20240102.xml", 200)
+    write_grin_report(shipment_dir / "_query.txt", 200)
+    monkeypatch.chdir(tmp_path)
+    out = shipment_dir / "nyp_20240102_google.xml"
+
+    saved, rejected, _ = clean_metadata_for_hathi_submission("20240102", "onsite")
+    passthrough = [bib.as_marc() for bib in marcxml_reader(out)]
+    results = clean_metadata_for_hathi_submission("20240102", "onsite", raw=False)
+    assert results[:2] == (saved, rejected)
+    assert rejected > 0
+    assert results[2] == out.stat().st_size
+    assert [bib.as_marc() for bib in marcxml_reader(out)] == passthrough
+
+
+def test_clean_metadata_and_create_stubs(tmp_path, monkeypatch):
+    shipment_dir = tmp_path / "files/shipments/2024-01-02_onsite"
+    shipment_dir.mkdir(parents=True)
+    write_marcxml(shipment_dir / "NYPL_20240102.xml", 200)
+    write_grin_report(shipment_dir / "_query.txt", 200)
+    monkeypatch.chdir(tmp_path)
+    out = shipment_dir / "nyp_20240102_google.xml"
+
+    # output matches that of the two separate passes
+    saved, rejected, file_size = clean_metadata_for_hathi_submission(
+        "20240102", "onsite"
+    )
+    submission = out.read_bytes()
+    expected = tmp_path / "expected.mrc"
+    create_stub_hathi_records(out, tmp_path / "no-errors.xml", expected)
+
+    stubs = tmp_path / "stubs.mrc"
+    results = clean_metadata_and_create_stubs("20240102", "onsite", stubs)
+    assert results[:3] == (saved, rejected, file_size)
+    assert rejected > 0
+    assert out.read_bytes() == submission
+    assert stubs.read_bytes() == expected.read_bytes()
+    assert results[3] == len(list(MARCReader(stubs.read_bytes())))
+
+
+def test_clean_metadata_and_create_stubs_pymarc_fallback(tmp_path, monkeypatch):
+    shipment_dir = tmp_path / "files/shipments/2024-01-02_onsite"
+    shipment_dir.mkdir(parents=True)
+    write_marcxml(shipment_dir / "NYPL_20240102.xml", 200)
+    write_grin_report(shipment_dir / "_query.txt", 200)
+    monkeypatch.chdir(tmp_path)
+    out = shipment_dir / "nyp_20240102_google.xml"
+
+    stubs = tmp_path / "stubs.mrc"
+    results = clean_metadata_and_create_stubs("20240102", "onsite", stubs)
+    passthrough = [bib.as_marc() for bib in marcxml_reader(out)]
+    expected = stubs.read_bytes()
+
+    results_pymarc = clean_metadata_and_create_stubs(
+        "20240102", "onsite", stubs, raw=False
+    )
+    assert results[1] > 0
+    assert (results_pymarc[0], results_pymarc[1], results_pymarc[3]) == (
+        results[0],
+        results[1],
+        results[3],
+    )
+    assert [bib.as_marc() for bib in marcxml_reader(out)] == passthrough
+    assert stubs.read_bytes() == expected
+
+
+def test_clean_metadata_and_create_stubs_invalid_bibs(tmp_path, monkeypatch):
+    shipment_dir = tmp_path / "files/shipments/2024-12-31_onsite"
+    shipment_dir.mkdir(parents=True)
+    shutil.copy("tests/marcxml-sample.xml", shipment_dir / "NYPL_20241231.xml")
+    shutil.copy("tests/_grin_query_sample.txt", shipment_dir / "_query.txt")
+    monkeypatch.chdir(tmp_path)
+
+    stubs = tmp_path / "stubs.mrc"
+    results = clean_metadata_and_create_stubs(
+        "20241231", "onsite", stubs, invalid_bibs={".b122759692"}
+    )
+    assert results[:2] == (2, 0)
+    assert results[3] == 1
+    bib = next(MARCReader(stubs.read_bytes()))
+    assert bib.get("907").get("a") != ".b122759692"
+
+
+def test_parse_hathi_processing_report(tmp_path):
+    with StatusStore(tmp_path / "status.db") as store:
+        results = parse_hathi_processing_report(
+            date(2024, 8, 16),
+            "onsite",
+            Path("tests/hathi-report-sample.txt"),
+            tmp_path / "success.csv",
+            tmp_path / "unspecified-oclc.csv",
+            tmp_path / "missing-oclc.csv",
+            tmp_path / "errors.csv",
+            store,
+        )
+        statuses = store.query("shipment_date", ["2024-08-16"])
+
+    assert results == (4, 0, 2, 1)
+    assert (tmp_path / "success.csv").read_text() == (
+        "109999996\n109999997\n109999998\n109999999\n"
+    )
+    assert (tmp_path / "missing-oclc.csv").read_bytes() == (
+        b"b103615325\r\nb16006420x\r\n"
+    )
+    assert (tmp_path / "errors.csv").read_bytes() == (
+        b"b103615325,2024-08-16,Zephir validation,nyp_2024-08-16_google_onsite.xml,"
+        b"\"invalid recTyp:  , leader = '01364s   a2200313 a 4500'\",NO\r\n"
+    )
+    assert sorted((s.status, s.bibno, s.cid) for s in statuses) == [
+        ("error", "b103615325", ""),
+        ("missing-oclc", "b103615325", ""),
+        ("missing-oclc", "b16006420x", ""),
+        ("success", "", "109999996"),
+        ("success", "", "109999997"),
+        ("success", "", "109999998"),
+        ("success", "", "109999999"),
+    ]
+
+
+def test_parse_hathi_processing_report_empty_report(tmp_path):
+    report = tmp_path / "report.txt"
+    report.write_text("Processing messages:\n\nRUN REPORT\n")
+    outputs = [tmp_path / f"{name}.csv" for name in ("suc", "inv", "mis", "err")]
+    results = parse_hathi_processing_report(
+        date(2024, 8, 16), "onsite", report, *outputs
+    )
+    assert results == (0, 0, 0, 0)
+    assert all(fh.exists() and fh.stat().st_size == 0 for fh in outputs)
+
+
+@pytest.fixture
+def shipments_with_reports(tmp_path):
+    parent = tmp_path / "shipments"
+    for folder, name in [
+        ("2024-08-16_onsite", "nyp_20240816_google_onsite.txt"),
+        ("2024-09-01_recap", "nyp_20240901_google_recap.txt"),
+    ]:
+        (parent / folder).mkdir(parents=True)
+        shutil.copy("tests/hathi-report-sample.txt", parent / folder / name)
+    # folders without report or with unexpected names are ignored
+    (parent / "2024-10-01_onsite").mkdir()
+    (parent / "2024-13-01_onsite").mkdir()
+    (parent / "misc").mkdir()
+    return parent
+
+
+def test_get_hathi_report_paths():
+    paths = get_hathi_report_paths("files/shipments", date(2024, 8, 16), "onsite")
+    shipment_dir = Path("files/shipments/2024-08-16_onsite")
+    assert paths.source == shipment_dir / "nyp_20240816_google_onsite.txt"
+    assert paths.outputs == (
+        shipment_dir / "hathi-20240816-success.csv",
+        shipment_dir / "hathi-20240816-unspecified-oclc.csv",
+        shipment_dir / "hathi-20240816-missing-oclc.csv",
+        shipment_dir / "hathi-20240816-errors.csv",
+    )
+
+
+def test_find_hathi_reports(shipments_with_reports):
+    assert [(d, s) for d, s, _ in find_hathi_reports(shipments_with_reports)] == [
+        (date(2024, 8, 16), "onsite"),
+        (date(2024, 9, 1), "recap"),
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_parse_hathi_processing_reports(shipments_with_reports, workers):
+    summaries, skipped = batch_parse_hathi_processing_reports(
+        shipments_with_reports, workers
+    )
+    assert skipped == 0
+    assert summaries == [
+        (date(2024, 8, 16), "onsite", 4, 0, 2, 1),
+        (date(2024, 9, 1), "recap", 4, 0, 2, 1),
+    ]
+
+    # outputs are now newer than the Zephir reports
+    summaries, skipped = batch_parse_hathi_processing_reports(
+        shipments_with_reports, workers
+    )
+    assert (summaries, skipped) == ([], 2)
+
+    summaries, skipped = batch_parse_hathi_processing_reports(
+        shipments_with_reports, workers, skip_current=False
+    )
+    assert (len(summaries), skipped) == (2, 0)
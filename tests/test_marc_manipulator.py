@@ -1,17 +1,58 @@
+from collections import Counter
+from datetime import date
+import json
 from pathlib import Path
 import pytest
 
-from pymarc import Record, Field, Subfield, MARCReader
+from io import BytesIO
+import warnings
+
+from pymarc import (
+    Field,
+    Indicators,
+    Leader,
+    MARCReader,
+    Record,
+    Subfield,
+    XMLWriter,
+    parse_xml_to_array,
+)
 
+from google_books import marc_manipulator
+from google_books.errors import GoogleBooksToolError
+from google_books.generator import write_marc21
 from google_books.marc_manipulator import (
+    batched_marc_records,
     create_stub_hathi_records,
+    filter_stub_records,
     find_oclcno,
     fix_oclc_info,
+    fix_oclc_raw,
+    fix_oclc_record,
+    fix_oclc_records,
+    fix_oclc_records_parallel,
     generate_hathi_url,
     get_bibs,
+    get_invalid_bib_nos,
+    HATHI_URL,
     is_item_field,
+    manipulate_records,
+    make_stub_record,
+    MARCXML_FOOTER,
+    MARCXML_HEADER,
+    marcxml_datafields,
     marcxml_reader,
+    mmap_marc_records,
+    RawMarcxmlReader,
+    RawRecord,
+    save2marcxml,
+    save_raw_marcxml,
+    scan_marcxml_records,
+    StubRecord,
+    stub_record_keys,
+    write_stub_records,
 )
+from google_books.status_store import StatusStore
 
 
 def test_create_stub_hathi_records(tmp_path):
@@ -34,6 +75,48 @@ def test_create_stub_hathi_records(tmp_path):
             assert bib.get("907").get("a") == ".b122759692"
 
 
+def test_create_stub_hathi_records_appends(tmp_path):
+    src = Path("tests/marcxml-sample.xml")
+    err = Path("tests/marcxml-sample-one-bib.xml")
+    out = tmp_path / "out-test.mrc"
+    create_stub_hathi_records(src, err, out)
+    size = out.stat().st_size
+    create_stub_hathi_records(src, err, out)
+
+    assert out.read_bytes() == out.read_bytes()[:size] * 2
+    metrics = [
+        json.loads(line)
+        for line in (tmp_path / "metrics.jsonl").read_text().splitlines()
+    ]
+    written = [m["bytes_written"] for m in metrics if m["stage"] == "write"]
+    assert written == [size, size]
+
+
+def test_create_stub_hathi_records_records_statuses(tmp_path):
+    src = Path("tests/marcxml-sample.xml")
+    err = Path("tests/marcxml-sample-one-bib.xml")
+    out = tmp_path / "out-test.mrc"
+    with StatusStore(tmp_path / "status.db") as store:
+        create_stub_hathi_records(
+            src, err, out, store=store, shipment_date=date(2024, 8, 16)
+        )
+        records = store.query("shipment_date", ["2024-08-16"])
+    assert [(r.bibno, r.barcode, r.status) for r in records] == [
+        ("b122759692", "33433010140428", "url-created")
+    ]
+
+
+def test_create_stub_hathi_records_store_requires_date(tmp_path):
+    with StatusStore(tmp_path / "status.db") as store:
+        with pytest.raises(ValueError):
+            create_stub_hathi_records(
+                Path("tests/marcxml-sample.xml"),
+                Path("tests/marcxml-sample-one-bib.xml"),
+                tmp_path / "out-test.mrc",
+                store=store,
+            )
+
+
 def test_create_stub_hathi_records_no_barcode_warning(tmp_path):
     src = Path("tests/marcxml-sample-no-barcode.xml")
     err = Path("tests/marcxml-sample-one-bib.xml")
@@ -48,6 +131,139 @@ def test_create_stub_hathi_records_no_barcode_warning(tmp_path):
         )
 
 
+def test_make_stub_record():
+    bib = next(marcxml_reader("tests/marcxml-sample-one-bib.xml"))
+    stub, barcodes = make_stub_record(bib)
+    assert barcodes == [bib.get("945").get("i")]
+    reader = MARCReader(stub.as_marc())
+    stub_bib = next(reader)
+    assert [f.tag for f in stub_bib.fields] == ["245", "856", "907"]
+    assert str(stub_bib.leader)[5:12] == str(bib.leader)[5:12]
+
+
+@pytest.mark.parametrize(
+    "leader", ["00000cam  2200000 a 4500", "00000nam a2200000Ia 4500"]
+)
+@pytest.mark.parametrize(
+    "items",
+    [[], [("33433010140428", None)], [("1", " v. 1 "), ("2", ""), ("3", "v.3")]],
+)
+def test_stub_record_as_marc(leader, items):
+    t245 = Field(
+        tag="245",
+        indicators=Indicators("1", "0"),
+        subfields=[Subfield("a", "Zażółć gęślą jaźń /"), Subfield("c", "Foo.")],
+    )
+    t907 = Field(
+        tag="907", indicators=Indicators(" ", " "), subfields=[Subfield("a", ".b1")]
+    )
+    bib = Record()
+    bib.leader = Leader(leader)
+    bib.add_ordered_field(t245)
+    bib.add_ordered_field(t907)
+    stub = StubRecord(leader, t245, t907)
+    for barcode, volume in items:
+        bib.add_ordered_field(generate_hathi_url(barcode, volume))
+        assert stub.add_hathi_url(barcode, volume)
+    assert not stub.add_hathi_url(None, "v. 1")
+    assert not stub.add_hathi_url("", None)
+
+    assert stub.as_marc() == bib.as_marc()
+
+
+def marc8_bibs():
+    for bib in marcxml_reader("tests/marcxml-sample.xml"):
+        bib.leader = Leader(bib.leader[:9] + " " + bib.leader[10:])
+        yield bib
+
+
+def test_write_stub_records_passes_records_unchanged():
+    expected = [str(bib.leader) for bib in marc8_bibs()]
+    stats = Counter()
+    bibs = list(write_stub_records(marc8_bibs(), BytesIO(), (), stats))
+    assert stats["stubs"] == 2
+    # encoding stubs as MARC21 (UTF-8) does not change leaders of the bibs
+    assert [str(bib.leader) for bib in bibs] == expected
+
+
+def test_filter_stub_records(tmp_path):
+    src = Path("tests/marcxml-sample.xml")
+    err = Path("tests/marcxml-sample-one-bib.xml")
+    expected = tmp_path / "expected.mrc"
+    create_stub_hathi_records(src, err, expected)
+
+    candidates = tmp_path / "candidates.mrc"
+    stats = Counter()
+    with open(candidates, "wb") as out:
+        assert len(list(write_stub_records(marcxml_reader(src), out, (), stats))) == 2
+    assert stats["stubs"] == 2
+
+    out = tmp_path / "out-test.mrc"
+    with StatusStore(tmp_path / "status.db") as store:
+        n = filter_stub_records(
+            candidates,
+            out,
+            set(get_invalid_bib_nos(err)),
+            store=store,
+            shipment_date=date(2024, 8, 16),
+        )
+        records = store.query("shipment_date", ["2024-08-16"])
+    assert n == 1
+    assert out.read_bytes() == expected.read_bytes()
+    assert [(r.bibno, r.barcode, r.status) for r in records] == [
+        ("b122759692", "33433010140428", "url-created")
+    ]
+
+
+def test_filter_stub_records_skips_urls_without_barcode(tmp_path):
+    bib = next(marcxml_reader("tests/marcxml-sample.xml"))
+    stub_bib, barcodes = make_stub_record(bib)
+    # 856 without $u and with $u that does not end with a barcode
+    stub_bib.t856s += [b"41\x1fzfoo\x1e", b"41\x1fuhttp://example\x1e"]
+    candidates = tmp_path / "candidates.mrc"
+    candidates.write_bytes(stub_bib.as_marc())
+
+    out = tmp_path / "out-test.mrc"
+    with StatusStore(tmp_path / "status.db") as store:
+        n = filter_stub_records(
+            candidates, out, set(), store=store, shipment_date=date(2024, 8, 16)
+        )
+        records = store.query("shipment_date", ["2024-08-16"])
+    assert n == 1
+    assert [r.barcode for r in records] == barcodes
+
+
+def test_filter_stub_records_does_not_decode_stubs(tmp_path, monkeypatch):
+    candidates = tmp_path / "candidates.mrc"
+    with open(candidates, "wb") as out:
+        list(
+            write_stub_records(
+                marcxml_reader("tests/marcxml-sample.xml"), out, (), Counter()
+            )
+        )
+
+    def as_record(self):
+        raise AssertionError("stub record was decoded")
+
+    monkeypatch.setattr(RawRecord, "as_record", as_record)
+    out = tmp_path / "out-test.mrc"
+    assert filter_stub_records(candidates, out, set()) == 2
+    assert out.read_bytes() == candidates.read_bytes()
+
+
+def test_stub_record_keys(monkeypatch):
+    bib = next(marcxml_reader("tests/marcxml-sample.xml"))
+    stub_bib, barcodes = make_stub_record(bib)
+    data = stub_bib.as_marc()
+    raw = RawRecord(0, 0, memoryview(data))
+    expected = (bib["907"]["a"], [f"{HATHI_URL}{barcode}" for barcode in barcodes])
+    assert stub_record_keys(raw) == expected
+
+    # records that cannot be split are decoded with pymarc
+    monkeypatch.setattr(marc_manipulator, "split_raw_record", lambda data: None)
+    assert stub_record_keys(raw) == expected
+
+
 @pytest.mark.parametrize("arg,expectation", [("(OCoLC)1234", "1234"), ("1234", None)])
 def test_find_oclcno_in_035(arg, expectation, stub_bib):
     stub_bib.add_field(
@@ -199,3 +415,323 @@ def test_marcxml_reader():
     for n, bib in enumerate(bibs):  # n starts with 0!
         assert isinstance(bib, Record)
     assert n == 1
+
+
+@pytest.mark.parametrize(
+    "arg",
+    [
+        "tests/marcxml-sample.xml",
+        "tests/marcxml-sample-one-bib.xml",
+        "tests/marcxml-sample-no-barcode.xml",
+    ],
+)
+def test_marcxml_reader_matches_pymarc_parser(arg):
+    expectation = [bib.as_marc() for bib in parse_xml_to_array(arg)]
+    assert [bib.as_marc() for bib in marcxml_reader(arg)] == expectation
+
+
+def test_marcxml_datafields():
+    record = (
+        b'<marc:record><marc:datafield tag="945" ind1=" " ind2=" ">'
+        b'<marc:subfield code="c">v. 1 &amp; 2</marc:subfield>'
+        b"<marc:subfield code='i'>33433</marc:subfield>"
+        b'<marc:subfield code="z"/>'
+        b'</marc:datafield><marc:datafield tag="946" ind1=" " ind2=" "/>'
+        b'<marc:datafield tag="945" ind1=" " ind2=" "/></marc:record>'
+    )
+    assert list(marcxml_datafields(record, "945")) == [
+        [("c", "v. 1 & 2"), ("i", "33433"), ("z", "")],
+        [],
+    ]
+    assert list(marcxml_datafields(record, "946")) == [[]]
+
+
+@pytest.mark.parametrize(
+    "arg", ["tests/marcxml-sample.xml", "tests/marcxml-sample-no-barcode.xml"]
+)
+def test_raw_marcxml_reader_decode_matches_marcxml_reader(arg):
+    with RawMarcxmlReader(arg) as reader:
+        bibs = [reader.decode(record) for record in reader]
+    assert [bib.as_marc() for bib in bibs] == [
+        bib.as_marc() for bib in marcxml_reader(arg)
+    ]
+
+
+def test_raw_marcxml_reader_copies_records(tmp_path):
+    source = Path("tests/marcxml-sample.xml").read_bytes()
+    out = tmp_path / "out.xml"
+    with RawMarcxmlReader("tests/marcxml-sample.xml") as reader:
+        records = list(reader)
+        assert reader.head.endswith(b">\n    ")
+        assert reader.tail.strip() == b"</marc:collection>"
+        assert save_raw_marcxml(out, reader, records) == len(source)
+        assert out.read_bytes() == source
+
+        # records after a skipped one are still decoded
+        assert reader.decode(records[1])["907"]["a"] == ".b122759692"
+        save_raw_marcxml(out, reader, records[1:])
+    assert [bib["907"]["a"] for bib in marcxml_reader(out)] == [".b122759692"]
+
+
+def test_raw_marcxml_reader_scans_lazily(monkeypatch):
+    scanned = []
+
+    def scan(data, pos=0):
+        for span in scan_marcxml_records(data, pos):
+            scanned.append(span)
+            yield span
+
+    monkeypatch.setattr(marc_manipulator, "scan_marcxml_records", scan)
+    with RawMarcxmlReader("tests/marcxml-sample.xml") as reader:
+        assert scanned == []
+        records = iter(reader)
+        assert reader.decode(next(records))["907"]["a"] == ".b122776471"
+        assert len(scanned) == 1
+
+
+def test_raw_marcxml_reader_unclosed_record(tmp_path):
+    fh = tmp_path / "unclosed.xml"
+    fh.write_bytes(MARCXML_HEADER + b"<record><leader>")
+    with pytest.raises(GoogleBooksToolError, match="Unclosed MARCXML record"):
+        RawMarcxmlReader(fh)
+
+
+def test_raw_marcxml_reader_no_records(tmp_path):
+    fh = tmp_path / "empty.xml"
+    fh.write_bytes(MARCXML_HEADER + MARCXML_FOOTER)
+    with RawMarcxmlReader(fh) as reader:
+        assert list(reader) == []
+        save_raw_marcxml(tmp_path / "out.xml", reader, reader)
+    assert (tmp_path / "out.xml").read_bytes() == MARCXML_HEADER + MARCXML_FOOTER
+
+
+def test_save2marcxml_matches_pymarc_writer(tmp_path):
+    out = tmp_path / "out-test.xml"
+    bibs = parse_xml_to_array("tests/marcxml-sample.xml")
+    expectation = BytesIO()
+    writer = XMLWriter(expectation)
+    for bib in bibs:
+        writer.write(bib)
+    writer.close(close_fh=False)
+
+    written = save2marcxml(out, (bib for bib in bibs))
+    assert out.read_bytes() == expectation.getvalue()
+    assert written == out.stat().st_size
+
+
+def test_save2marcxml_overwrites_existing_file(tmp_path):
+    out = tmp_path / "out-test.xml"
+    save2marcxml(out, marcxml_reader("tests/marcxml-sample.xml"))
+    save2marcxml(out, marcxml_reader("tests/marcxml-sample.xml"))
+    assert len(parse_xml_to_array(str(out))) == 2
+
+
+@pytest.fixture
+def rlin_marc_file(tmp_path):
+    # five copies of two sample records
+    fh = tmp_path / "SierraExport4Google_20240131.mrc"
+    fh.write_bytes(Path("tests/sample-rlin-bibs.mrc").read_bytes() * 5)
+    return fh
+
+
+def test_batched_marc_records(rlin_marc_file):
+    with open(rlin_marc_file, "rb") as marcfile:
+        batches = list(batched_marc_records(marcfile, 3))
+    assert [(start, len(batch)) for start, batch in batches] == [
+        (1, 3),
+        (4, 3),
+        (7, 3),
+        (10, 1),
+    ]
+    assert all(record.endswith(b"\x1d") for _, batch in batches for record in batch)
+
+
+def test_batched_marc_records_invalid_length(tmp_path):
+    fh = tmp_path / "invalid.mrc"
+    fh.write_bytes(Path("tests/sample-rlin-bibs.mrc").read_bytes() + b"foo")
+    with open(fh, "rb") as marcfile:
+        with pytest.raises(GoogleBooksToolError):
+            list(batched_marc_records(marcfile, 10))
+
+
+def test_mmap_marc_records(rlin_marc_file):
+    with open(rlin_marc_file, "rb") as marcfile:
+        expected = [r for _, batch in batched_marc_records(marcfile, 3) for r in batch]
+    records = [
+        (n, offset, bytes(data))
+        for n, offset, data in mmap_marc_records(rlin_marc_file)
+    ]
+    assert [n for n, _, _ in records] == list(range(1, 11))
+    assert [data for _, _, data in records] == expected
+    assert [offset for _, offset, _ in records] == [
+        sum(len(r) for r in expected[:i]) for i in range(10)
+    ]
+
+
+def test_mmap_marc_records_as_record(rlin_marc_file):
+    bibs = [bib for _, bib in get_bibs(str(rlin_marc_file))]
+    records = [record.as_record() for record in mmap_marc_records(rlin_marc_file)]
+    assert [r.as_marc() for r in records] == [b.as_marc() for b in bibs]
+
+
+def test_mmap_marc_records_resyncs_after_invalid_length(tmp_path):
+    sample = Path("tests/sample-rlin-bibs.mrc").read_bytes()
+    first_length = int(sample[:5])
+    fh = tmp_path / "malformed.mrc"
+    # invalid length, length too short, and trailing garbage
+    fh.write_bytes(b"x" + sample + b"00030" + sample[5:first_length] + sample + b"\n")
+    end = fh.stat().st_size
+    with pytest.warns(UserWarning, match="invalid length") as caught:
+        records = [
+            (n, offset, bytes(data)) for n, offset, data in mmap_marc_records(fh)
+        ]
+    assert [str(w.message) for w in caught] == [
+        "Skipping record 1 with invalid length at byte 0.",
+        f"Skipping record 3 with invalid length at byte {len(sample) + 1}.",
+        f"Skipping record 6 with invalid length at byte {end - 1}.",
+    ]
+    assert [(n, offset) for n, offset, _ in records] == [
+        (2, first_length + 1),
+        (4, len(sample) + first_length + 1),
+        (5, len(sample) + 2 * first_length + 1),
+    ]
+    assert b"".join(data for _, _, data in records) == sample[first_length:] + sample
+
+
+def test_mmap_marc_records_empty_file(tmp_path):
+    fh = tmp_path / "empty.mrc"
+    fh.touch()
+    assert list(mmap_marc_records(fh)) == []
+
+
+def test_mmap_marc_records_kept_slices(rlin_marc_file):
+    records = list(mmap_marc_records(rlin_marc_file))
+    assert bytes(records[-1].data).endswith(b"\x1d")
+
+
+def test_fix_oclc_records_parallel_matches_serial(rlin_marc_file):
+    serial = list(fix_oclc_records(str(rlin_marc_file)))
+    parallel = list(
+        fix_oclc_records_parallel(str(rlin_marc_file), workers=2, batch_size=3)
+    )
+    assert [n for n, _, _ in parallel] == list(range(1, 11))
+    assert parallel == serial
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_manipulate_records(tmp_path, monkeypatch, rlin_marc_file, workers, capsys):
+    (tmp_path / "files/out").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    manipulate_records(str(rlin_marc_file), workers)
+
+    out = tmp_path / "files/out/hathi-20240131-fixed-oclc.mrc"
+    with open(out, "rb") as marcfile:
+        bibs = list(MARCReader(marcfile))
+    assert all(bib["003"].data == "OCoLC" for bib in bibs)
+    stdout = capsys.readouterr().out
+    assert stdout.splitlines()[0].endswith("(record 1)")
+    assert len(stdout.splitlines()) == len(bibs)
+
+
+def test_fix_oclc_records_parallel_reemits_warnings(tmp_path, stub_bib):
+    fh = tmp_path / "no-oclc.mrc"
+    fh.write_bytes(stub_bib.as_marc() * 2)
+    with pytest.warns(UserWarning, match=r"Unable to manipulate bib \(.b00000001\)"):
+        results = list(fix_oclc_records_parallel(str(fh), workers=2, batch_size=1))
+    assert results == [(1, None, None), (2, None, None)]
+
+
+def fix_oclc_with_pymarc(data):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        bib = Record(data, hide_utf8_warnings=True)
+        msg = fix_oclc_info(bib)
+    return (msg, bib.as_marc() if msg else None), [str(w.message) for w in caught]
+
+
+def fix_oclc_with_raw(data):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        result = fix_oclc_raw(data)
+    return result, [str(w.message) for w in caught]
+
+
+def test_fix_oclc_raw_matches_pymarc(tmp_path):
+    fh = tmp_path / "export.mrc"
+    write_marc21(fh, 200, seed=3)
+    with open(fh, "rb") as marcfile:
+        for _, batch in batched_marc_records(marcfile, 50):
+            for data in batch:
+                assert fix_oclc_with_raw(data) == fix_oclc_with_pymarc(data)
+
+
+@pytest.mark.parametrize("utf8", [True, False])
+@pytest.mark.parametrize(
+    "fields",
+    [
+        [("035", "a", "(OCoLC)1234")],
+        [("035", "a", "(OCoLC) 12a4 "), ("035", "a", "(OCoLC)5678")],
+        [("035", "a", "(OCoLC)ocm1"), ("991", "y", "x"), ("991", "y", " 5678 ")],
+        [("035", "a", "(OCoLC)ocm1")],
+        [("991", "y", "1234"), ("998", "a", "foo"), ("949", "a", "bar")],
+        [("991", "y", "1234"), ("AAA", "a", "foo"), ("100", "a", "Ökonomie")],
+    ],
+)
+def test_fix_oclc_raw_matches_pymarc_edge_cases(stub_bib, fields, utf8):
+    for tag, code, value in fields:
+        stub_bib.add_field(
+            Field(tag=tag, indicators=[" ", " "], subfields=[Subfield(code, value)])
+        )
+    data = stub_bib.as_marc()
+    if not utf8:
+        data = data[:9] + b" " + data[10:]
+    if not utf8 and not data.isascii():
+        # MARC-8 records with diacritics are decoded by pymarc
+        assert fix_oclc_raw(data) is None
+    else:
+        assert fix_oclc_with_raw(data) == fix_oclc_with_pymarc(data)
+
+
+@pytest.mark.parametrize(
+    "replace",
+    [
+        # empty subfield pymarc drops
+        (b"\x1fa.b00000001", b"\x1fa.b00000001\x1f"),
+        # missing 907$a
+        (b"\x1fa.b00000001", b"\x1fb.b00000001"),
+        # missing indicator
+        (b"  \x1fa.b00000001", b" \x1fa.b00000001"),
+    ],
+)
+def test_fix_oclc_raw_falls_back_to_pymarc(stub_bib, replace):
+    stub_bib.add_field(
+        Field(tag="991", indicators=[" ", " "], subfields=[Subfield("y", "1234")])
+    )
+    data = stub_bib.as_marc().replace(*replace)
+    # keep record length and base address valid
+    data = b"%05d" % (len(data)) + data[5:]
+    assert fix_oclc_raw(data) is None
+
+
+def test_fix_oclc_record_falls_back_to_pymarc():
+    with open("tests/sample-rlin-bibs.mrc", "rb") as marcfile:
+        for _, batch in batched_marc_records(marcfile, 10):
+            for data in batch:
+                assert fix_oclc_raw(data) is None
+                assert fix_oclc_record(data) == fix_oclc_with_pymarc(data)[0]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_fix_oclc_records_raw_matches_pymarc(tmp_path, workers):
+    fh = tmp_path / "export.mrc"
+    write_marc21(fh, 100, seed=5)
+    fh.write_bytes(fh.read_bytes() + Path("tests/sample-rlin-bibs.mrc").read_bytes())
+    if workers > 1:
+        raw = fix_oclc_records_parallel(str(fh), workers, batch_size=30)
+        decoded = fix_oclc_records_parallel(str(fh), workers, batch_size=30, raw=False)
+    else:
+        raw = fix_oclc_records(str(fh))
+        decoded = fix_oclc_records(str(fh), raw=False)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        assert list(raw) == list(decoded)
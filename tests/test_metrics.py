@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from google_books import metrics as metrics_module
+from google_books.metrics import PipelineMetrics, file_size
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def tick(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(metrics_module.time, "perf_counter", clock)
+    return clock
+
+
+def test_nested_stages_report_own_time(clock):
+    metrics = PipelineMetrics("test")
+
+    def source():
+        for n in range(4):
+            clock.tick(1)
+            yield n
+
+    def keep_even(rows):
+        for n in rows:
+            clock.tick(2)
+            if n % 2 == 0:
+                yield n
+
+    with metrics.timed("write") as write:
+        for n in metrics.meter("filter", keep_even(metrics.meter("read", source()))):
+            clock.tick(3)
+            write.records += 1
+
+    stages = {name: (s.records, s.seconds) for name, s in metrics.stages.items()}
+    assert [row["stage"] for row in metrics.rows()] == ["read", "filter", "write"]
+    assert stages == {"write": (2, 6.0), "read": (4, 4.0), "filter": (2, 8.0)}
+    assert metrics.stage("read").records_per_sec == 1.0
+
+
+def test_stage_time_recorded_on_error(clock):
+    metrics = PipelineMetrics("test")
+    with pytest.raises(ValueError):
+        with metrics.timed("read"):
+            clock.tick(5)
+            raise ValueError
+    assert metrics.stage("read").seconds == 5.0
+    assert metrics.stage("transform").records_per_sec == 0.0
+
+
+def test_save_appends_json_lines(tmp_path, clock):
+    metrics = PipelineMetrics("test", shipment_date="2024-01-02", mat_source="onsite")
+    with metrics.timed("read") as read:
+        clock.tick(2)
+        read.records, read.bytes_read = 10, 100
+    metrics.save(tmp_path)
+    log = metrics.save(tmp_path)
+
+    rows = [json.loads(line) for line in log.read_text().splitlines()]
+    assert log == tmp_path / "metrics.jsonl"
+    assert len(rows) == 2
+    del rows[0]["timestamp"]
+    assert rows[0] == {
+        "pipeline": "test",
+        "shipment_date": "2024-01-02",
+        "mat_source": "onsite",
+        "stage": "read",
+        "records": 10,
+        "bytes_read": 100,
+        "bytes_written": 0,
+        "seconds": 2.0,
+        "records_per_sec": 5.0,
+    }
+
+
+def test_file_size(tmp_path):
+    fh = tmp_path / "foo.txt"
+    assert file_size(fh) == 0
+    fh.write_text("foo")
+    assert file_size(fh) == 3
@@ -1,7 +1,20 @@
+import io
+import json
+import sys
+import tarfile
+
 import pytest
 
+from google_books import picklist
+from google_books.errors import GoogleBooksToolError
+from google_books.generator import write_sierra_export
 from google_books.picklist import (
+    SIERRA_EXPORT_FIELDS,
+    candidate_list_rows,
     is_oversized,
+    parse_dimensions,
+    prep_item_list_for_sierra,
+    prep_sierra_export_for_dataframe,
     too_tall,
     too_wide,
     too_thick,
@@ -10,6 +23,99 @@ from google_books.picklist import (
 )
 
 
+def make_candidate_tar(fh, mode):
+    members = {
+        "NYPL_combined-1.txt": (
+            "33433000000001\t.i10000001\n" "33433000000002\t.i10000002\n"
+        ),
+        "NYPL_combined-2.txt": "33433000000003\t.i10000003\n",
+        "README.txt": "foo\tbar\n",
+    }
+    with tarfile.open(fh, mode) as tar:
+        for name, content in members.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(f"candidates/{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.mark.parametrize("mode", ["w", "w:gz", "w:bz2"])
+def test_candidate_list_rows(tmp_path, mode):
+    fh = tmp_path / "NYPL_20240131_combined.tar"
+    make_candidate_tar(fh, mode)
+    assert [row[1] for row in candidate_list_rows(str(fh))] == [
+        ".i10000001",
+        ".i10000002",
+        ".i10000003",
+    ]
+
+
+def test_prep_item_list_for_sierra(tmp_path, monkeypatch):
+    fh = tmp_path / "NYPL_20240131_combined.tar.gz"
+    make_candidate_tar(fh, "w:gz")
+    (tmp_path / "files/picklist").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+
+    prep_item_list_for_sierra(str(fh), 2)
+
+    picklist = tmp_path / "files/picklist"
+    assert sorted(p.name for p in picklist.iterdir()) == [
+        "metrics.jsonl",
+        "nypl-20240131-candidate-items-001.csv",
+        "nypl-20240131-candidate-items-002.csv",
+    ]
+    assert (picklist / "nypl-20240131-candidate-items-001.csv").read_text() == (
+        "i10000001\ni10000002\n"
+    )
+    assert (picklist / "nypl-20240131-candidate-items-002.csv").read_text() == (
+        "i10000003\n"
+    )
+
+
+def test_prep_item_list_for_sierra_appends(tmp_path, monkeypatch):
+    fh = tmp_path / "NYPL_20240131_combined.tar.gz"
+    make_candidate_tar(fh, "w:gz")
+    picklist = tmp_path / "files/picklist"
+    picklist.mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+
+    prep_item_list_for_sierra(str(fh), 2)
+    prep_item_list_for_sierra(str(fh), 2)
+
+    assert (picklist / "nypl-20240131-candidate-items-001.csv").read_text() == (
+        "i10000001\ni10000002\n" * 2
+    )
+    metrics = [
+        json.loads(line)
+        for line in (picklist / "metrics.jsonl").read_text().splitlines()
+    ]
+    written = [m["bytes_written"] for m in metrics if m["stage"] == "write"]
+    # only bytes appended by each run are counted
+    assert written == [len("i10000001\ni10000002\ni10000003\n")] * 2
+
+
+@pytest.mark.parametrize(
+    "arg,expectation",
+    [
+        ("", (None, None, None)),
+        ("8vo.", (8, None, None)),
+        ("24 cm.", (24, None, None)),
+        ("24cm", (24, None, None)),
+        ("27-36 cm.", (27, None, None)),
+        ("33 x 34 cm.", (33, 34, None)),
+        ("42x54 cm.", (42, 54, None)),
+        ("42 X 54 cm.", (42, 54, None)),
+        ("42 × 54 cm.", (42, 54, None)),
+        ("10 x 15 x 13 cm.", (10, 15, 13)),
+        ("10x15x13cm", (10, 15, 13)),
+        ("22 x 28-33 x 25 cm", (22, 28, 25)),
+        ("ca. 30 x 40 cm.", (None, 40, None)),
+    ],
+)
+def test_parse_dimensions(arg, expectation):
+    assert parse_dimensions(arg) == expectation
+
+
 @pytest.mark.parametrize(
     "arg,expectation",
     [
@@ -79,6 +185,8 @@ def test_too_thick(arg, expectation):
         ("22 x 46 cm.", True),
         ("10 x 15 x 11 cm.", False),
         ("10 x 15 x 13 cm.", True),
+        ("10x15x13cm.", True),
+        ("10 x 50 x 5 cm.", True),
     ],
 )
 def test_is_oversized(arg, expectation):
@@ -125,3 +233,104 @@ def test_get_clean_bib_values_linked_bibs(stub_row_linked_bibs):
         "L-10 9215 Library has: 1-24 (Incomplete). Some vols. classed separately.",
         "L-10 9215 Library has: 1-24 (Incomplete). Some vols. classed separately.",
     ]
+
+
+@pytest.fixture
+def sierra_export(tmp_path, monkeypatch, stub_row_one_bib, stub_row_linked_bibs):
+    fh = tmp_path / "sierra-export.txt"
+    with open(fh, "w", encoding="utf-8") as export:
+        for row in [SIERRA_EXPORT_FIELDS, stub_row_one_bib, stub_row_linked_bibs]:
+            export.write("\t".join(row) + "\n")
+    (tmp_path / "files/picklist").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    return fh
+
+
+def test_prep_sierra_export_for_dataframe(sierra_export, tmp_path):
+    prep_sierra_export_for_dataframe(str(sierra_export), "2024-01-31")
+    out = tmp_path / "files/picklist/candidates-sierra-export-clean-2024-01-31.csv"
+    rows = [line.split("\t") for line in out.read_text().splitlines()]
+    assert len(rows) == 2
+    assert rows[0][15:18] == ["False", "1", "u"]
+    assert rows[1][15:18] == ["False", "2", "c"]
+    assert len(rows[1]) == 25
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_prep_sierra_export_for_dataframe_columnar(sierra_export, tmp_path, fmt):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+
+    prep_sierra_export_for_dataframe(str(sierra_export), "2024-01-31", fmt)
+    out = tmp_path / f"files/picklist/candidates-sierra-export-clean-2024-01-31.{fmt}"
+    if fmt == "parquet":
+        table = pq.read_table(out)
+    else:
+        table = pyarrow.ipc.open_file(out).read_all()
+
+    assert table.num_rows == 2
+    assert table.schema.field("OVERSIZED").type == pa.bool_()
+    assert table.schema.field("LINKED BIBS").type == pa.int32()
+    assert table.column("LINKED BIBS").to_pylist() == [1, 2]
+    assert table.column("RECORD #(ITEM)").to_pylist() == ["i105072515", "i240387521"]
+    assert table.column("300|c").to_pylist() == ["25 cm.", ""]
+    assert table.column("245").to_pylist()[1] == "Supplementary volume."
+
+
+def test_prep_sierra_export_for_dataframe_columnar_no_pyarrow(
+    sierra_export, monkeypatch
+):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(GoogleBooksToolError, match="requires pyarrow"):
+        prep_sierra_export_for_dataframe(str(sierra_export), "2024-01-31", "parquet")
+
+
+def test_prep_sierra_export_for_dataframe_resume(tmp_path, monkeypatch):
+    export = tmp_path / "sierra-export.txt"
+    write_sierra_export(export, 1000)
+    (tmp_path / "files/picklist").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    out = tmp_path / "files/picklist/candidates-sierra-export-clean-2024-01-31.csv"
+    checkpoint = out.with_name(out.name + ".checkpoint")
+
+    prep_sierra_export_for_dataframe(str(export), "2024-01-31", checkpoint_every=100)
+    expected = out.read_bytes()
+    assert not checkpoint.exists()
+    out.unlink()
+
+    # interrupt the run in the middle of rows between checkpoints
+    calls = []
+
+    def interrupt(value):
+        calls.append(value)
+        if len(calls) == 250:
+            raise KeyboardInterrupt
+        return is_oversized(value)
+
+    monkeypatch.setattr(picklist, "is_oversized", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        prep_sierra_export_for_dataframe(
+            str(export), "2024-01-31", checkpoint_every=100
+        )
+    monkeypatch.setattr(picklist, "is_oversized", is_oversized)
+    assert checkpoint.exists()
+    assert len(out.read_bytes().splitlines()) == 249
+
+    prep_sierra_export_for_dataframe(
+        str(export), "2024-01-31", resume=True, checkpoint_every=100
+    )
+    assert out.read_bytes() == expected
+    assert not checkpoint.exists()
+
+
+def test_prep_sierra_export_for_dataframe_resume_no_checkpoint(sierra_export):
+    with pytest.raises(GoogleBooksToolError, match="No checkpoint"):
+        prep_sierra_export_for_dataframe(str(sierra_export), "2024-01-31", resume=True)
+
+
+def test_prep_sierra_export_for_dataframe_resume_columnar(sierra_export):
+    with pytest.raises(GoogleBooksToolError, match="Only tsv output"):
+        prep_sierra_export_for_dataframe(
+            str(sierra_export), "2024-01-31", "parquet", resume=True
+        )
@@ -0,0 +1,135 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from google_books import pipeline
+from google_books.errors import GoogleBooksToolError
+from google_books.generator import (
+    write_grin_report,
+    write_marcxml,
+    write_zephir_errors,
+    write_zephir_report,
+)
+from google_books.marc_manipulator import create_stub_hathi_records
+from google_books.pipeline import ShipmentPipeline
+from google_books.status_store import StatusStore
+
+
+@pytest.fixture
+def shipment_dir(tmp_path, monkeypatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    d = Path("files/shipments/2024-01-02_onsite")
+    d.mkdir(parents=True)
+    write_marcxml(d / "NYPL_20240102.xml", 50)
+    write_grin_report(d / "_query.txt", 50)
+    return d
+
+
+def add_zephir_reports(shipment_dir):
+    write_zephir_report(shipment_dir / "nyp_20240102_google_onsite.txt", 50)
+    write_zephir_errors(shipment_dir / "nyp_20240102_google_error.xml", 50)
+
+
+def statuses(results):
+    return [(r.stage, r.status) for r in results]
+
+
+def test_shipment_pipeline_missing_shipment_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(GoogleBooksToolError):
+        ShipmentPipeline("20240102", "onsite")
+
+
+def test_shipment_pipeline_waits_for_zephir_report(shipment_dir):
+    results = ShipmentPipeline("20240102", "onsite").run()
+    assert statuses(results) == [
+        ("hathi-metadata-prep", "done"),
+        ("hathi-report", "waiting"),
+        ("hathi-urls", "waiting"),
+    ]
+    assert results[1].message == "Missing nyp_20240102_google_onsite.txt"
+    assert (shipment_dir / "nyp_20240102_google.xml").exists()
+
+
+def test_shipment_pipeline_waits_for_marcxml(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("files/shipments/2024-01-02_onsite").mkdir(parents=True)
+    results = ShipmentPipeline("20240102", "onsite").run()
+    assert results[0] == (
+        "hathi-metadata-prep",
+        "waiting",
+        "Missing NYPL_20240102.xml, _query.txt",
+    )
+
+
+def test_shipment_pipeline_run(shipment_dir, tmp_path):
+    add_zephir_reports(shipment_dir)
+    with StatusStore(tmp_path / "status.db") as store:
+        results = ShipmentPipeline("20240102", "onsite", store).run()
+        assert statuses(results) == [
+            ("hathi-metadata-prep", "done"),
+            ("hathi-report", "done"),
+            ("hathi-urls", "done"),
+        ]
+        assert store.query("shipment_date", ["2024-01-02"])
+    assert (shipment_dir / "hathi-20240102-success.csv").exists()
+    assert (shipment_dir / "hathi-stub-urls_20240102.mrc").stat().st_size > 0
+
+
+def test_shipment_pipeline_parses_each_input_once(shipment_dir, monkeypatch):
+    add_zephir_reports(shipment_dir)
+    calls = []
+    for name in ("get_rejected_barcodes", "get_invalid_bib_nos"):
+        parse = getattr(pipeline, name)
+        monkeypatch.setattr(
+            pipeline, name, lambda fh, parse=parse: calls.append(fh) or parse(fh)
+        )
+    shipment = ShipmentPipeline("20240102", "onsite")
+    shipment.run()
+    shipment.run()
+    assert calls == [
+        shipment_dir / "_query.txt",
+        shipment_dir / "nyp_20240102_google_error.xml",
+    ]
+
+
+def test_shipment_pipeline_skips_current_stages(shipment_dir):
+    add_zephir_reports(shipment_dir)
+    ShipmentPipeline("20240102", "onsite").run()
+    stubs = shipment_dir / "hathi-stub-urls_20240102.mrc"
+    size = stubs.stat().st_size
+
+    results = ShipmentPipeline("20240102", "onsite").run()
+    assert [r.status for r in results] == ["skipped"] * 3
+
+    # a newer Zephir error report reruns only the stage that uses it
+    errors = shipment_dir / "nyp_20240102_google_error.xml"
+    mtime = stubs.stat().st_mtime + 10
+    os.utime(errors, (mtime, mtime))
+    results = ShipmentPipeline("20240102", "onsite").run()
+    assert [r.status for r in results] == ["skipped", "skipped", "done"]
+    # stubs are recreated, not appended
+    assert stubs.stat().st_size == size
+
+
+def test_shipment_pipeline_force(shipment_dir):
+    add_zephir_reports(shipment_dir)
+    ShipmentPipeline("20240102", "onsite").run()
+    results = ShipmentPipeline("20240102", "onsite", force=True).run()
+    assert [r.status for r in results] == ["done"] * 3
+
+
+def test_shipment_pipeline_stubs_created_with_submission(shipment_dir, tmp_path):
+    add_zephir_reports(shipment_dir)
+    ShipmentPipeline("20240102", "onsite").run()
+    assert (shipment_dir / "hathi-stub-candidates_20240102.mrc").exists()
+
+    expected = tmp_path / "expected.mrc"
+    create_stub_hathi_records(
+        shipment_dir / "nyp_20240102_google.xml",
+        shipment_dir / "nyp_20240102_google_error.xml",
+        expected,
+    )
+    stubs = shipment_dir / "hathi-stub-urls_20240102.mrc"
+    assert stubs.read_bytes() == expected.read_bytes()
@@ -0,0 +1,147 @@
+import os
+from pathlib import Path
+import shutil
+
+import pytest
+from pymarc import Record
+
+from google_books import record_index
+from google_books.generator import barcode, bibno, write_marc21, write_marcxml
+from google_books.marc_manipulator import marcxml_reader, mmap_marc_records
+from google_books.record_index import (
+    RecordIndex,
+    fetch_records,
+    index_fh,
+    load_index,
+    read_index,
+    write_records,
+)
+
+
+@pytest.fixture
+def marc21_file(tmp_path) -> Path:
+    fh = tmp_path / "catalog.mrc"
+    write_marc21(fh, 100)
+    return fh
+
+
+@pytest.fixture
+def marcxml_file(tmp_path) -> Path:
+    fh = tmp_path / "NYPL_20240102.xml"
+    write_marcxml(fh, 50)
+    return fh
+
+
+@pytest.fixture
+def build_calls(monkeypatch):
+    calls = []
+
+    def build(fh):
+        calls.append(fh)
+        return build_index(fh)
+
+    build_index = record_index.build_index
+    monkeypatch.setattr(record_index, "build_index", build)
+    return calls
+
+
+def test_record_index_lookup():
+    index = RecordIndex(
+        "marc21",
+        [0, 10, 30],
+        [10, 20, 15],
+        [(".b1", 0), ("33433", 0), ("b2", 1), ("33433", 2), ("", 2)],
+    )
+    assert index.lookup(".b1") == [0]
+    assert index.lookup("b1") == [0]
+    assert index.lookup(".b2") == [1]
+    assert index.lookup(" 33433 ") == [0, 2]
+    assert index.lookup("b3") == []
+    assert index.lookup("") == []
+    assert len(index) == 3
+
+
+def test_record_index_bytes():
+    index = RecordIndex("marcxml", [0, 2**40], [10, 20], [("b1", 0), ("é", 1)])
+    restored = RecordIndex.from_bytes("marcxml", index.to_bytes(), 2, 2)
+    assert list(restored.offsets) == [0, 2**40]
+    assert list(restored.lengths) == [10, 20]
+    assert restored.keys == ["b1", "é"]
+    assert list(restored.positions) == [0, 1]
+
+
+def test_load_index_marc21(marc21_file, build_calls):
+    index = load_index(marc21_file)
+    assert index_fh(marc21_file).exists()
+    assert index.fmt == "marc21"
+    assert len(index) == 100
+    records = [bytes(r.data) for r in mmap_marc_records(marc21_file)]
+    assert fetch_records(marc21_file, [bibno(7), barcode(42)]) == [
+        records[7],
+        records[42],
+    ]
+
+    # the saved index is used as long as the file does not change
+    cached = load_index(marc21_file)
+    assert build_calls == [marc21_file]
+    assert cached.keys == index.keys
+    assert list(cached.offsets) == list(index.offsets)
+
+
+def test_load_index_marcxml(marcxml_file):
+    index = load_index(marcxml_file)
+    assert index.fmt == "marcxml"
+    assert len(index) == 50
+    record = fetch_records(marcxml_file, [bibno(3)])[0]
+    assert record.startswith(b"<record>")
+    assert record.endswith(b"</record>")
+    assert barcode(3).encode() in record
+
+
+def test_load_index_rebuilt_when_file_changes(marc21_file, build_calls):
+    load_index(marc21_file)
+    write_marc21(marc21_file, 10, seed=1)
+    assert read_index(marc21_file) is None
+
+    index = load_index(marc21_file)
+    assert build_calls == [marc21_file, marc21_file]
+    assert len(index) == 10
+
+    mtime = marc21_file.stat().st_mtime + 10
+    os.utime(marc21_file, (mtime, mtime))
+    load_index(marc21_file)
+    assert len(build_calls) == 3
+
+
+def test_fetch_records_missing_key(marc21_file):
+    with pytest.warns(UserWarning, match=r"No record found for \.b99999999\."):
+        records = fetch_records(marc21_file, [".b99999999", bibno(1), bibno(1)])
+    # each record is fetched once
+    assert len(records) == 1
+    assert Record(records[0])["907"]["a"] == bibno(1)
+
+
+def test_write_records_marc21(marc21_file, tmp_path):
+    out = tmp_path / "fetched.mrc"
+    assert write_records(marc21_file, [barcode(9), bibno(2)], out) == 2
+    bibs = [r.as_record() for r in mmap_marc_records(out)]
+    assert [bib["907"]["a"] for bib in bibs] == [bibno(9), bibno(2)]
+
+
+def test_write_records_marcxml_keeps_namespace_prefix(tmp_path):
+    fh = tmp_path / "marcxml-sample.xml"
+    shutil.copy("tests/marcxml-sample.xml", fh)
+    out = tmp_path / "fetched.xml"
+    assert write_records(fh, ["33433010140428"], out) == 1
+    bibs = list(marcxml_reader(out))
+    assert [bib["907"]["a"] for bib in bibs] == [".b122759692"]
+    assert out.read_bytes().startswith(fh.read_bytes()[:100])
+
+
+def test_write_records_empty_marcxml(tmp_path):
+    fh = tmp_path / "empty.xml"
+    fh.write_bytes(b'<?xml version="1.0" encoding="UTF-8"?><collection/>')
+    out = tmp_path / "fetched.xml"
+    with pytest.warns(UserWarning):
+        assert write_records(fh, ["b1"], out) == 0
+    assert list(marcxml_reader(out)) == []
@@ -0,0 +1,87 @@
+from datetime import date
+
+import pytest
+
+from google_books.status_store import (
+    StatusRecord,
+    StatusRow,
+    StatusStore,
+    normalize_bibno,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    with StatusStore(tmp_path / "status.db") as store:
+        yield store
+
+
+@pytest.mark.parametrize("arg", [".b12274570x", "b12274570x", " .b12274570x "])
+def test_normalize_bibno(arg):
+    assert normalize_bibno(arg) == "b12274570x"
+
+
+def test_status_store_creates_parent_directory(tmp_path):
+    db = tmp_path / "files" / "status.db"
+    with StatusStore(db):
+        pass
+    assert db.exists()
+
+
+def test_status_store_upsert_and_query_by_bibno(store):
+    store.upsert(
+        date(2024, 8, 16),
+        "onsite",
+        [
+            StatusRow("error", bibno="b103615325", message="invalid recTyp"),
+            StatusRow("missing-oclc", bibno="b16006420x"),
+        ],
+    )
+    store.upsert(
+        date(2024, 9, 1),
+        "recap",
+        [StatusRow("url-created", bibno=".b103615325", barcode="33433010141525")],
+    )
+    records = store.query("bibno", [".b103615325", "b99999999x"])
+    assert [(r.shipment_date, r.status) for r in records] == [
+        ("2024-08-16", "error"),
+        ("2024-09-01", "url-created"),
+    ]
+    assert isinstance(records[0], StatusRecord)
+    assert records[0].message == "invalid recTyp"
+
+
+def test_status_store_upsert_updates_existing_row(store):
+    shipment = date(2024, 8, 16)
+    store.upsert(shipment, "onsite", [StatusRow("error", "b103615325", message="a")])
+    store.upsert(shipment, "onsite", [StatusRow("error", "b103615325", message="b")])
+    records = store.query("bibno", ["b103615325"])
+    assert len(records) == 1
+    assert records[0].message == "b"
+
+
+@pytest.mark.parametrize(
+    "key,value",
+    [
+        ("barcode", "33433010141525"),
+        ("cid", "109999996"),
+        ("shipment_date", "2024-08-16"),
+    ],
+)
+def test_status_store_query_by_other_keys(store, key, value):
+    store.upsert(
+        date(2024, 8, 16),
+        "onsite",
+        [
+            StatusRow("success", cid="109999996"),
+            StatusRow("url-created", bibno="b103615325", barcode="33433010141525"),
+        ],
+    )
+    records = store.query(key, [value])
+    assert records
+    assert all(getattr(r, key) == value for r in records)
+
+
+def test_status_store_query_invalid_key(store):
+    with pytest.raises(ValueError):
+        store.query("foo", ["bar"])
@@ -1,11 +1,17 @@
+from array import array
 from contextlib import nullcontext as does_not_raise
 import csv
 from datetime import date
+import sys
 
 import pytest
 
 
 from google_books.utils import (
+    CSVSink,
+    array_from_bytes,
+    array_to_bytes,
+    atomic_write,
     get_directory,
     fh_date,
     save2csv,
@@ -40,6 +46,51 @@ def test_save2csv_unicode_encode_error(tmp_path):
     assert wrn[0].message.args[0] == f"Could not write `foo` to {fh}"
 
 
+def test_csv_sink_writes_rows_through_single_handle(tmp_path):
+    fh = tmp_path / "sink-test.csv"
+    with CSVSink(fh, "\t") as sink:
+        sink.writerow(["foo", "bar"])
+        sink.writerow(["spam", "eggs, ham"])
+        assert sink.rows_written == 2
+    assert fh.read_text(encoding="utf-8") == "foo\tbar\nspam\teggs, ham\n"
+
+
+def test_csv_sink_appends_by_default(tmp_path):
+    fh = tmp_path / "sink-test.csv"
+    save2csv(fh, ",", ["foo"])
+    with CSVSink(fh) as sink:
+        sink.writerow(["bar"])
+    assert fh.read_text(encoding="utf-8") == "foo\nbar\n"
+
+
+def test_csv_sink_no_rows_creates_no_file(tmp_path):
+    fh = tmp_path / "sink-test.csv"
+    with CSVSink(fh):
+        pass
+    assert not fh.exists()
+
+
+def test_csv_sink_rollover(tmp_path):
+    first = tmp_path / "sink-test-001.csv"
+    second = tmp_path / "sink-test-002.csv"
+    with CSVSink(first) as sink:
+        sink.writerow(["foo"])
+        sink.rollover(second)
+        sink.writerow(["bar"])
+    assert first.read_text(encoding="utf-8") == "foo\n"
+    assert second.read_text(encoding="utf-8") == "bar\n"
+
+
+def test_csv_sink_unicode_encode_error(tmp_path):
+    fh = tmp_path / "sink-test.csv"
+    with pytest.warns(UserWarning, match=f"Could not write `foo` to {fh}"):
+        with CSVSink(fh) as sink:
+            sink.writerow(["foo", "\ud83d\udca9"])
+            sink.writerow(["bar", "baz"])
+    assert sink.rows_written == 1
+    assert fh.read_text(encoding="utf-8") == "bar,baz\n"
+
+
 @pytest.mark.parametrize(
     "arg,expectation",
     [
@@ -104,3 +155,28 @@ def test_timestamp_str2date_exceptions(arg):
     with pytest.raises(GoogleBooksToolError) as exc:
         timestamp_str2date(arg)
     assert f"Error. Encountered invalid timestamp: `{arg}`." in str(exc.value)
+
+
+def test_atomic_write(tmp_path):
+    fh = tmp_path / "foo.idx"
+    fh.write_bytes(b"old")
+    assert atomic_write(fh, b"new", "Could not save foo")
+    assert fh.read_bytes() == b"new"
+    assert [p.name for p in tmp_path.iterdir()] == ["foo.idx"]
+
+
+def test_atomic_write_failure(tmp_path):
+    fh = tmp_path / "missing-dir" / "foo.idx"
+    with pytest.warns(UserWarning, match="Could not save foo: "):
+        assert not atomic_write(fh, b"new", "Could not save foo")
+
+
+@pytest.mark.parametrize("byteorder", ["little", "big"])
+def test_array_bytes(monkeypatch, byteorder):
+    values = array("Q", [1, 2**40])
+    data = array_to_bytes(values)
+    assert data[:8] == (1).to_bytes(8, "little")
+    monkeypatch.setattr(sys, "byteorder", byteorder)
+    restored = array_from_bytes("Q", memoryview(array_to_bytes(values) + b"foo"), 2)
+    assert list(restored) == [1, 2**40]
+    assert list(values) == [1, 2**40]